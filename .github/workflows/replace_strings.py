@@ -1,33 +1,358 @@
 # script.py
+import argparse
+import hashlib
 import json
 import os
 import re
-import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
+# json mode only touches string values at these paths, segments are dict
+# keys, "*" for any key or list index, "**" for any depth and
+# "[key=value]" for list items whose `key` equals `value`
+DEFAULT_PATHS = [
+    "displayName",
+    "genericWebService.uri",
+    "**.setParameterActions.[parameter=friendly_practice_name].value",
+]
 
-def replace_in_file(file_path, replacements):
-    with open(file_path, "r", encoding="utf-8") as file:
-        content = file.read()
-    for old, new in replacements.items():
-        content = re.sub(r"\b" + re.escape(old) + r"\b", new, content)
-    with open(file_path, "w", encoding="utf-8") as file:
-        file.write(content)
+# set by init_worker in every pool process, one
+# (name, output path, pattern, replacements) per environment
+_base_path = ""
+_environments: List[Tuple[str, str, Optional[re.Pattern], dict]] = []
+_paths: Optional[List[Tuple[str, ...]]] = None
 
 
-def main(base_path):
-    replacements_str = os.getenv("REPLACEMENTS")
-    if not replacements_str:
-        raise ValueError("REPLACEMENTS environment variable is not set")
-    replacements = json.loads(replacements_str)
+def trie_pattern(keys):
+    # one regex for all keys, factored by common prefix so the work per
+    # position depends on key length and not on how many keys there are
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [
+            re.escape(char) + emit(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        if len(branches) == 1:
+            body = branches[0]
+        else:
+            body = "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # greedy, so the longest key wins and shorter keys are the
+            # fallback when the word boundary after the longer one fails
+            return "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+
+def compile_replacements(replacements):
+    keys = [key for key in replacements if key]
+    if not keys:
+        return None
+    return re.compile(r"\b" + trie_pattern(keys) + r"\b")
+
+
+def replace_text(content, pattern, replacements):
+    if pattern is None:
+        return content, 0
+    return pattern.subn(lambda match: replacements[match.group(0)], content)
+
+
+def init_worker(base_path, environments, paths=None):
+    global _base_path, _environments, _paths
+    _base_path = base_path
+    _environments = [
+        (name, output_path, compile_replacements(replacements), replacements)
+        for name, output_path, replacements in environments
+    ]
+    _paths = None if paths is None else [tuple(p.split(".")) for p in paths]
+
+
+def write_atomic(file_path, data):
+    directory, filename = os.path.split(file_path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{filename}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        if os.path.exists(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode)
+        else:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def link_atomic(source_path, file_path):
+    directory, filename = os.path.split(file_path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{filename}.{os.getpid()}.link")
+    os.link(source_path, temp_path)
+    os.replace(temp_path, file_path)
+
+
+def file_digest(file_path):
+    try:
+        with open(file_path, "rb") as file:
+            return hashlib.sha256(file.read()).digest()
+    except FileNotFoundError:
+        return None
+
+
+def write_variant(file_path, data, shared):
+    """Write data unless file_path already holds it.
+
+    `shared` maps content hashes to a file already holding that content,
+    those are hard linked instead of written again.
+    """
+    digest = hashlib.sha256(data).digest()
+    if file_digest(file_path) == digest:
+        shared.setdefault(digest, file_path)
+        return
+    if digest in shared:
+        try:
+            link_atomic(shared[digest], file_path)
+            return
+        except OSError:
+            pass
+    write_atomic(file_path, data)
+    shared[digest] = file_path
+
+
+def children(node):
+    if isinstance(node, dict):
+        return node.items()
+    if isinstance(node, list):
+        return enumerate(node)
+    return ()
+
 
+def segment_matches(segment, key, child):
+    if segment == "*":
+        return True
+    if segment.startswith("[") and segment.endswith("]"):
+        field, _, value = segment[1:-1].partition("=")
+        return isinstance(child, dict) and str(child.get(field)) == value
+    return isinstance(key, str) and segment == key
+
+
+def find_values(node, segments, location=(), found=None):
+    """{location: (parent, key)} for string values matching segments."""
+    if found is None:
+        found = {}
+    if not segments:
+        return found
+    segment, rest = segments[0], segments[1:]
+    if segment == "**":
+        find_values(node, rest, location, found)
+    for key, child in children(node):
+        child_location = location + (str(key),)
+        if segment == "**":
+            find_values(child, segments, child_location, found)
+        elif segment_matches(segment, key, child):
+            if not rest and isinstance(child, str):
+                found[child_location] = (node, key)
+            else:
+                find_values(child, rest, child_location, found)
+    return found
+
+
+def dump_like(document, content):
+    # keep the export formatting so unchanged lines stay unchanged
+    indent = re.search(r"\n( +)\S", content)
+    text = json.dumps(
+        document,
+        indent=len(indent.group(1)) if indent else None,
+        ensure_ascii=False,
+    )
+    return text + "\n" if content.endswith("\n") else text
+
+
+def process_file(file_path):
+    """Read and parse one exported file, write it for every environment."""
+    relative = os.path.relpath(file_path, _base_path)
+    with open(file_path, "rb") as file:
+        data = file.read()
+    content = data.decode("utf-8")
+
+    found = {}
+    if _paths is not None:
+        try:
+            document = json.loads(content)
+        except json.JSONDecodeError as error:
+            print(f"Skipping {file_path}: {error}")
+            document = None
+        for segments in _paths if document is not None else []:
+            find_values(document, segments, found=found)
+    originals = {
+        location: parent[key] for location, (parent, key) in found.items()
+    }
+
+    changes_by_environment = {}
+    shared = {hashlib.sha256(data).digest(): file_path}
+    for name, output_path, pattern, replacements in _environments:
+        changes = []
+        if _paths is None:
+            new_content, count = replace_text(content, pattern, replacements)
+            if new_content != content:
+                changes.append({"replacements": count})
+        else:
+            for location, (parent, key) in found.items():
+                old = originals[location]
+                new, count = replace_text(old, pattern, replacements)
+                parent[key] = new
+                if count and new != old:
+                    changes.append(
+                        {"path": ".".join(location), "old": old, "new": new}
+                    )
+            new_content = dump_like(document, content) if changes else content
+        target = os.path.join(output_path, relative)
+        if changes:
+            write_variant(target, new_content.encode("utf-8"), shared)
+            changes_by_environment[name] = changes
+        elif os.path.abspath(target) != os.path.abspath(file_path):
+            write_variant(target, data, shared)
+    return relative, changes_by_environment
+
+
+def find_json_files(base_path):
     for root, dirs, files in os.walk(base_path):
-        for filename in files:
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(files):
             if filename.endswith(".json"):
-                replace_in_file(os.path.join(root, filename), replacements)
+                yield os.path.join(root, filename)
+
+
+def load_replacements(variable):
+    replacements_str = os.getenv(variable)
+    if not replacements_str:
+        raise ValueError(f"{variable} environment variable is not set")
+    return json.loads(replacements_str)
+
+
+def main(
+    base_path,
+    workers=None,
+    paths=None,
+    manifest_path=None,
+    environments=None,
+):
+    """Replace strings in base_path, in place or fanned out.
+
+    `environments` is a list of (name, output path), each environment gets
+    its replacements from the REPLACEMENTS_<name> variable and a copy of
+    base_path at its output path, written in the same pass.
+    """
+    fan_out = bool(environments)
+    if fan_out:
+        environments = [
+            (name, output_path, load_replacements(f"REPLACEMENTS_{name}"))
+            for name, output_path in environments
+        ]
+    else:
+        environments = [("", base_path, load_replacements("REPLACEMENTS"))]
+    # anything written in place goes last, other environments link to the
+    # original file while it is still unchanged
+    environments.sort(
+        key=lambda item: os.path.abspath(item[1]) == os.path.abspath(base_path)
+    )
+
+    file_paths = list(find_json_files(base_path))
+    workers = workers or os.cpu_count() or 1
+    init_args = (base_path, environments, paths)
+    if workers == 1 or len(file_paths) < 2:
+        init_worker(*init_args)
+        results = list(map(process_file, file_paths))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=init_args,
+        ) as executor:
+            results = list(
+                executor.map(
+                    process_file,
+                    file_paths,
+                    chunksize=max(1, len(file_paths) // (workers * 4)),
+                )
+            )
+
+    manifest = {
+        name: {
+            relative: changes[name]
+            for relative, changes in results
+            if name in changes
+        }
+        for name, _, _ in environments
+    }
+    for name, changed in manifest.items():
+        label = f" for {name}" if name else ""
+        print(
+            f"Replaced strings{label} in {len(changed)} of "
+            f"{len(file_paths)} files"
+        )
+    if manifest_path:
+        with open(manifest_path, "w", encoding="utf-8") as file:
+            json.dump(
+                manifest if fan_out else manifest[""],
+                file,
+                indent=2,
+                ensure_ascii=False,
+            )
+    return manifest
+
+
+def parse_environment(value):
+    name, separator, output_path = value.partition("=")
+    if not separator or not name or not output_path:
+        raise argparse.ArgumentTypeError(f"Expected NAME=PATH, got {value}")
+    return name, output_path
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        raise ValueError("No base path provided")
-    base_path = sys.argv[1]
-    main(base_path)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_path")
+    parser.add_argument(
+        "--mode",
+        choices=["text", "json"],
+        default=os.getenv("REPLACEMENT_MODE", "text"),
+        help="text replaces anywhere, json only at the declared paths",
+    )
+    parser.add_argument(
+        "--paths",
+        type=json.loads,
+        default=json.loads(os.getenv("REPLACEMENT_PATHS", "null")),
+        help="JSON list of paths for json mode",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        type=parse_environment,
+        dest="environments",
+        metavar="NAME=PATH",
+        help="write base_path with REPLACEMENTS_<NAME> applied to PATH",
+    )
+    parser.add_argument("--manifest", help="write changed files here")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    main(
+        args.base_path,
+        workers=args.workers,
+        paths=(args.paths or DEFAULT_PATHS) if args.mode == "json" else None,
+        manifest_path=args.manifest,
+        environments=args.environments,
+    )
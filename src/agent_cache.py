@@ -0,0 +1,165 @@
+"""
+On-disk cache of agent resource names, shared by the runs of a machine
+
+Looking an agent up by display name lists the agents of every region of
+the project. The resource names found are kept in a JSON file, keyed by
+project, location and display name:
+
+- an entry younger than `AGENT_CACHE_TTL_SECONDS` is used as is
+- an older one is validated by reading the agent back by its name, one
+  get instead of the listing; it is used again if the agent still has
+  that display name, and dropped otherwise
+- a missing or dropped entry is looked up by listing, as before
+
+The file is `AGENT_CACHE` (agent_cache.json in the working directory),
+set it to an empty value to turn the cache off.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from dfcx_scrapi.core.agents import Agents
+from google.api_core import exceptions as core_exceptions
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_PATH = os.environ.get("AGENT_CACHE", "agent_cache.json")
+TTL_SECONDS = float(os.environ.get("AGENT_CACHE_TTL_SECONDS", 24 * 3600))
+
+# agents deploy side by side and share the cache file
+_lock = threading.Lock()
+
+
+class AgentCache:
+    def __init__(self, *, path: str, ttl_seconds: float = TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def key(project_id: str, location: Optional[str], display_name: str):
+        return f"{project_id}/{location or '-'}/{display_name}"
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring agent cache %s: %s", self.path, e)
+            return {}
+
+    def _update(self, key: str, entry: Optional[Dict[str, Any]]):
+        with _lock:
+            entries = self._read()
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+            # write aside and rename, a crash never leaves half a file
+            partial = f"{self.path}.{os.getpid()}.tmp"
+            with open(partial, "w", encoding="utf-8") as file:
+                json.dump(entries, file, indent=2, sort_keys=True)
+            os.replace(partial, self.path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read().get(key)
+
+    def put(self, key: str, name: str, display_name: str):
+        self._update(
+            key,
+            {"name": name, "display_name": display_name, "time": time.time()},
+        )
+
+    def drop(self, key: str):
+        self._update(key, None)
+
+    def resolve(
+        self,
+        key: str,
+        display_name: str,
+        *,
+        look_up: Callable[[], Any],
+        get: Callable[[str], Any],
+    ) -> Optional[str]:
+        """Resource name of the agent, from the cache when it can be.
+
+        `look_up()` lists the agents and returns the one with the display
+        name or None, `get(name)` reads an agent by resource name.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            if time.time() - entry["time"] < self.ttl_seconds:
+                return entry["name"]
+            if self._still_valid(entry, display_name, get):
+                self.put(key, entry["name"], display_name)
+                return entry["name"]
+            self.drop(key)
+        agent = look_up()
+        if agent is None:
+            return None
+        self.put(key, agent.name, display_name)
+        return agent.name
+
+    @staticmethod
+    def _still_valid(entry, display_name: str, get) -> bool:
+        try:
+            agent = get(entry["name"])
+        except (
+            core_exceptions.NotFound,
+            core_exceptions.PermissionDenied,
+        ) as e:
+            logger.info("Cached agent %s is gone: %s", entry["name"], e)
+            return False
+        return agent.display_name == display_name
+
+
+def default_cache() -> Optional[AgentCache]:
+    if not DEFAULT_CACHE_PATH:
+        return None
+    return AgentCache(path=DEFAULT_CACHE_PATH)
+
+
+def resolve_agent(
+    agents: Agents,
+    *,
+    project_id: str,
+    location: Optional[str],
+    display_name: str,
+) -> Optional[str]:
+    """Resource name of the agent with the display name, None if none."""
+
+    def look_up():
+        return agents.get_agent_by_display_name(
+            project_id=project_id, display_name=display_name
+        )
+
+    cache = default_cache()
+    if cache is None:
+        agent = look_up()
+        return agent.name if agent is not None else None
+    return cache.resolve(
+        cache.key(project_id, location, display_name),
+        display_name,
+        look_up=look_up,
+        get=agents.get_agent,
+    )
+
+
+def remember_agent(
+    *,
+    project_id: str,
+    location: Optional[str],
+    display_name: str,
+    name: str,
+):
+    """Cache an agent found or created outside `resolve_agent`."""
+    cache = default_cache()
+    if cache is not None:
+        cache.put(
+            cache.key(project_id, location, display_name), name, display_name
+        )
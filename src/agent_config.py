@@ -1,7 +1,9 @@
 import os
+from typing import Dict
 
 from dfcx_scrapi.core.agents import Agents
 from dfcx_scrapi.core.flows import Flows
+from dfcx_scrapi.core.pages import Pages
 from google.cloud.dialogflowcx_v3beta1.types import (
     AdvancedSettings,
     Flow,
@@ -72,3 +74,72 @@ def update_flow_settings(config: utils.Config):
         flow_obj.nlu_settings.model_type = nlu_settings_model_type
         flows.update_flow(flow_id=flow_id, obj=flow_obj)
         print("Updated flow: ", flow_display_name, end="\n")
+
+
+def _merge_speech_settings(
+    current: AdvancedSettings, desired: AdvancedSettings
+) -> AdvancedSettings:
+    """`current` with the speech and DTMF settings of `desired`.
+
+    What the profile leaves out is cleared, so it falls back to the flow or
+    agent settings again.
+    """
+    merged = AdvancedSettings(current)
+    for field in ("speech_settings", "dtmf_settings"):
+        if field in AdvancedSettings.meta.fields:
+            value = getattr(desired, field) if field in desired else None
+            setattr(merged, field, value)
+    return merged
+
+
+def update_speech_settings(config: utils.Config):
+    """Push utils.FLOW_SPEECH_PROFILES / PAGE_SPEECH_PROFILES.
+
+    Flows and pages the builders create get their profile when they are
+    created, this also covers the copied flows and a changed profile on a
+    deployed agent. Only flows and pages whose settings differ are updated.
+    """
+    agent_id = utils.get_agent_id(config)
+    flows = Flows(creds_path=config.service_account_key)
+    pages = Pages(creds_path=config.service_account_key)
+    flows_map = flows.get_flows_map(agent_id=agent_id, reverse=True)
+    page_profiles: Dict[str, Dict[str, utils.SpeechProfiles]] = {}
+    for (flow_name, page_name), profile in utils.PAGE_SPEECH_PROFILES.items():
+        page_profiles.setdefault(flow_name, {})[page_name] = profile
+
+    for flow_name, profile in utils.FLOW_SPEECH_PROFILES.items():
+        if flow_name not in flows_map:
+            utils.logger.warning("No flow %s for speech settings", flow_name)
+            continue
+        flow_obj: Flow = flows.get_flow(flow_id=flows_map[flow_name])
+        settings = _merge_speech_settings(
+            flow_obj.advanced_settings,
+            utils.create_advanced_settings(profile),
+        )
+        if settings != flow_obj.advanced_settings:
+            flows.update_flow(
+                flow_id=flow_obj.name, advanced_settings=settings
+            )
+            print("Updated speech settings of flow: ", flow_name, end="\n")
+
+    for flow_name, profiles in page_profiles.items():
+        if flow_name not in flows_map:
+            utils.logger.warning("No flow %s for speech settings", flow_name)
+            continue
+        for page in pages.list_pages(flows_map[flow_name]):
+            page_profile = profiles.get(page.display_name)
+            if page_profile is None:
+                continue
+            settings = _merge_speech_settings(
+                page.advanced_settings,
+                utils.create_advanced_settings(page_profile),
+            )
+            if settings != page.advanced_settings:
+                pages.update_page(
+                    page_id=page.name, advanced_settings=settings
+                )
+                print(
+                    "Updated speech settings of page: ",
+                    f"{flow_name} / {page.display_name}",
+                    end="\n",
+                )
@@ -49,6 +49,9 @@ def create_name_collection_flow_pages(config):
     # nc stands for name collection
     # fb stands for flow builder
     nc_fb = FlowBuilder().create_new_proto_obj(flow_name)
+    profile = utils.speech_profile(flow_name)
+    if profile is not None:
+        nc_fb.advanced_settings = utils.create_advanced_settings(profile)
     nc_flow = flows_instance.create_flow(obj=nc_fb, agent_id=agent_id)
 
     pages_instance = Pages(creds_path=config.service_account_key)
@@ -272,10 +275,10 @@ def create_authentication_flow_pages(config):
     webhook_map = webhooks_instance.get_webhooks_map(reverse=True)
     logger.info("webhook_map: %s", webhook_map)
     webhook_dob_name_query_transition_fulfillment = (
-        FulfillmentBuilder().create_new_proto_obj(
+        utils.create_fulfillment_builder(
             webhook=webhook_map[diagflow_wh_enum.value],
             tag=utils.WebHookTags.Authentication,
-        )
+        ).proto_obj
     )
 
     # Find Patient with Name and DOB Starts #####
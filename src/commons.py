@@ -161,3 +161,10 @@ SPEAK_PROVIDER_NAME = (
 )
 
 OFFICE_HOURS_CLOSED = "Office is closed"
+
+# played while a slow webhook runs, see utils.interim_prompt
+INTERIM_PROMPT_DEFAULT = "One moment please."
+INTERIM_PROMPTS = {
+    "authenticate": "Thanks. One moment while I look you up.",
+    "find_appointments": "One moment while I find your appointments.",
+}
@@ -0,0 +1,143 @@
+"""
+On-disk journal of deploy steps, so a failed deploy can be resumed
+
+Every step of `main.deploy` appends one JSON line with the flows it builds as
+they are before it runs, and one more once it completed with the resource
+names they got (flow id, page ids and route counts). `python main.py
+--resume` replays the journal of the last deploy of each agent: completed
+steps whose flows still match what is deployed are skipped, the first step
+that fails the check and everything after it run again, since later flows
+look up the ids of the earlier ones. A step without flows (the restore, the
+settings) has nothing deployed to check, only its completion counts.
+
+The builders add pages to the flows the restore brings back, they cannot run
+again into a flow they left half built. A step runs again only if its flows
+are as they were before it first ran, otherwise the deploy starts over from
+the restore.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dfcx_scrapi.core.flows import Flows
+from dfcx_scrapi.core.pages import Pages
+
+import utils
+
+DEFAULT_JOURNAL_PATH = os.environ.get("DEPLOY_JOURNAL", "deploy_journal.jsonl")
+
+# agents deploy side by side and share the journal file
+_lock = threading.Lock()
+
+
+class DeployJournal:
+    def __init__(self, *, path: str, agent_display_name: str):
+        self.path = path
+        self.agent_display_name = agent_display_name
+
+    def _read(self) -> Iterable[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid write leaves a partial last line
+                    continue
+                if entry.get("agent") == self.agent_display_name:
+                    yield entry
+
+    def _append(self, entry: Dict[str, Any]):
+        entry = {
+            "agent": self.agent_display_name,
+            "time": time.time(),
+            **entry,
+        }
+        with _lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def start(self):
+        """Begin a new deploy, earlier entries of this agent stop counting."""
+        self._append({"event": "start"})
+
+    def begin(self, step: str, flows: Dict[str, Any]):
+        """A step is about to run, with its flows as they are before."""
+        self._append({"event": "begin", "step": step, "flows": flows})
+
+    def record(self, step: str, flows: Dict[str, Any]):
+        self._append({"event": "step", "step": step, "flows": flows})
+
+    def _steps(self, event: str) -> Dict[str, Dict[str, Any]]:
+        steps: Dict[str, Dict[str, Any]] = {}
+        for entry in self._read():
+            if entry["event"] == "start":
+                steps = {}
+            elif entry["event"] == event:
+                steps[entry["step"]] = entry["flows"]
+        return steps
+
+    def begun_steps(self) -> Dict[str, Dict[str, Any]]:
+        """Steps begun since the last start, step -> flows before."""
+        return self._steps("begin")
+
+    def completed_steps(self) -> Dict[str, Dict[str, Any]]:
+        """Steps completed since the last start, step -> recorded flows."""
+        return self._steps("step")
+
+
+def snapshot_flows(config: utils.Config, flow_names: List[str]):
+    """Resource names of flows as deployed, flow -> {name, pages}."""
+    if not flow_names:
+        return {}
+    agent_id = utils.get_agent_id(config)
+    flows_map = Flows().get_flows_map(agent_id=agent_id, reverse=True)
+    pages_instance = Pages(creds_path=config.service_account_key)
+    snapshot: Dict[str, Optional[Dict[str, Any]]] = {}
+    for flow_name in flow_names:
+        flow_id = flows_map.get(flow_name)
+        if flow_id is None:
+            snapshot[flow_name] = None
+            continue
+        snapshot[flow_name] = {
+            "name": flow_id,
+            "pages": {
+                page.display_name: {
+                    "name": page.name,
+                    "routes": len(page.transition_routes),
+                }
+                for page in pages_instance.list_pages(flow_id=flow_id)
+            },
+        }
+    return snapshot
+
+
+def matches_deployed(config: utils.Config, flows: Dict[str, Any]) -> bool:
+    return snapshot_flows(config, list(flows)) == flows
+
+
+def resume_index(
+    config: utils.Config,
+    journal: DeployJournal,
+    steps: List[Tuple[str, Any, List[str]]],
+) -> int:
+    """Index of the first of `steps` a resumed deploy runs again."""
+    begun = journal.begun_steps()
+    completed = journal.completed_steps()
+    for index, (step, _, flow_names) in enumerate(steps):
+        if step in completed and (
+            not flow_names or matches_deployed(config, completed[step])
+        ):
+            continue
+        if step not in begun or matches_deployed(config, begun[step]):
+            return index
+        utils.logger.warning(
+            "Flows of %s changed since it began, starting over", step
+        )
+        return 0
+    return len(steps)
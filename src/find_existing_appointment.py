@@ -25,6 +25,7 @@ import time
 from google.cloud.dialogflowcx_v3 import Flow
 
 import utils
+from library import KEYPAD_DATE_DIGITS
 from library import DialogflowLibrary as dl
 from library import StandardPage, SystemEntityType
 
@@ -36,10 +37,10 @@ def create_existing_appointment_flow_pages(config) -> Flow:
     utils.delete_flow_with_check(flow_display_name=flow_name, config=config)
 
     # common elements
-    intent_yes = dl.get_intent("prebuilt_components_confirmation_yes")
-    intent_no = dl.get_intent("prebuilt_components_confirmation_no")
+    intent_yes = dl.get_intent(config, "prebuilt_components_confirmation_yes")
+    intent_no = dl.get_intent(config, "prebuilt_components_confirmation_no")
     intent_agent_transfer = dl.get_intent(
-        "prebuilt_components_escalate_human_agent"
+        config, "prebuilt_components_escalate_human_agent"
     )
 
     no_match_1_fulfillment = dl.create_fulfillment(
@@ -101,7 +102,7 @@ def create_existing_appointment_flow_pages(config) -> Flow:
 
     # create the new flow
     find_existing_appointment_flow = dl.create_flow(
-        utils.FlowNames.FIND_EXISTING_APPOINTMENT
+        config, utils.FlowNames.FIND_EXISTING_APPOINTMENT
     )
 
     end_flow_page = dl.get_standard_page(
@@ -140,7 +141,17 @@ def create_existing_appointment_flow_pages(config) -> Flow:
     # - appointment_date (can be null)
     # - provider_name (can be null)
     # - appointments_limit (can be null)
-    get_appointments_webhook = dl.get_webhook(utils.WebHookNames.DIAGFLOW)
+    # a caller going back to a webhook page with the same values gets the
+    # appointments of the last call again, without calling the webhook
+    get_appointments_webhook = dl.get_webhook(
+        config, utils.WebHookNames.DIAGFLOW
+    )
+    get_appointments_inputs = [
+        "patientId",
+        "appointment_date",
+        "provider_name",
+        "appointments_limit",
+    ]
 
     # prepare the required webhook variables with null values
     initialize_webhook_set_vars_task = dl.create_page(
@@ -219,6 +230,7 @@ def create_existing_appointment_flow_pages(config) -> Flow:
                 target_page=end_failure_page,
             ),
         ],
+        memo_inputs=get_appointments_inputs,
     )
 
     # set_webhook_vars_task >> get_all_appointments_call_webhook_task (always)
@@ -525,7 +537,10 @@ with $session.params.third_appointment.doctorName.
                     reprompt_event_handlers=[
                         *standard_match_event_handlers,
                     ],
+                    dtmf_max_digits=KEYPAD_DATE_DIGITS,
                 ),
+                # the date keyed in as MMDDYYYY
+                dl.create_keypad_date_parameter(name="appointment_date_obj"),
             ]
         ),
         event_handlers=[
@@ -807,6 +822,20 @@ $sys.func.FORMAT_DATE($session.params.appointment_time_obj, "HH:mm:ss")))
                 target_page=end_failure_page,
             ),
         ],
+        memo_inputs=get_appointments_inputs,
+    )
+    time.sleep(5)
+
+    # ask_if_patient_knows_date_page >>
+    # get_first_appointment_after_date_call_webhook_task (when date is keyed)
+    dl.add_transition_route(
+        parent=ask_if_patient_knows_date_page,
+        transition=dl.create_keypad_date_route(
+            name="appointment_date_obj",
+            parameter="appointment_date",
+            target_page=get_first_appointment_after_date_call_webhook_task,
+            suffix="T00:00:00",
+        ),
     )
     time.sleep(5)
 
@@ -937,6 +966,7 @@ $session.params.first_appointment.facilityName.
                 target_page=end_failure_page,
             ),
         ],
+        memo_inputs=get_appointments_inputs,
     )
     time.sleep(5)
 
@@ -0,0 +1,260 @@
+"""
+Flow templates, sub-flows described once and stamped out per flow
+
+A template lists its pages, the routes of the flow start and of every page,
+and which of them get the no-match / no-input event handlers. Targets,
+conditions, parameter presets and messages may hold `{placeholders}`:
+
+    {flow}              the instantiated flow
+    {page:<name>}       a page of the template
+    {flow:<name>}       another flow of the agent, by display name
+    {<param>}           a parameter given to `instantiate` (or a default)
+
+The route and event handler protos are compiled once per template, in
+memory. `instantiate` creates the flow and its pages, copies the compiled
+protos, fills in the placeholders and updates everything in one pass, so
+another flow built from a template costs only its API calls.
+"""
+
+import re
+import threading
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from dfcx_scrapi.builders.routes import TransitionRouteBuilder
+
+import commons
+import utils
+from utils import FlowNames, SymbolicPages
+
+PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+# owner of the routes and event handlers of the flow start
+FLOW_START = None
+
+
+def page(name: str) -> str:
+    return f"{{page:{name}}}"
+
+
+def flow(name: str) -> str:
+    return f"{{flow:{name}}}"
+
+
+def symbolic(mode: SymbolicPages) -> str:
+    return utils.get_symbolic_page("{flow}", mode).name
+
+
+class TemplateRoute:
+    def __init__(
+        self,
+        *,
+        condition: str,
+        target: str,
+        parameter_presets: Optional[Dict[str, Any]] = None,
+        messages: Optional[List[str]] = None,
+    ):
+        self.condition = condition
+        self.target = target
+        self.parameter_presets = parameter_presets
+        self.messages = messages
+
+    def build(self):
+        fulfillment = None
+        if self.parameter_presets or self.messages:
+            fulfillment = utils.create_fulfillment_builder(
+                parameter_presets=self.parameter_presets,
+                response_message=(
+                    {"type": "text", "message": self.messages}
+                    if self.messages
+                    else None
+                ),
+            ).proto_obj
+        to_flow = self.target.startswith("{flow:")
+        return TransitionRouteBuilder().create_new_proto_obj(
+            condition=self.condition,
+            trigger_fulfillment=fulfillment,
+            target_flow=self.target if to_flow else None,
+            target_page=None if to_flow else self.target,
+        )
+
+
+class FlowTemplate:
+    def __init__(
+        self,
+        *,
+        pages: List[str],
+        routes: Dict[Optional[str], List[TemplateRoute]],
+        event_handler_owners: List[Optional[str]],
+        escalation_page: str,
+        event_handler_messages: Optional[utils.EventHandlerMessages] = None,
+        defaults: Optional[Dict[str, str]] = None,
+        nlu_threshold: float = 0.3,
+    ):
+        self.pages = pages
+        self.routes = routes
+        self.event_handler_owners = event_handler_owners
+        self.escalation_page = escalation_page
+        # currently this states are not required
+        self.event_handler_messages = (
+            event_handler_messages
+            or utils.EventHandlerMessages(
+                no_match_1="", no_match_2="", no_input_1="", no_input_2=""
+            )
+        )
+        self.defaults = defaults or {}
+        self.nlu_threshold = nlu_threshold
+        self._compiled: Optional[Dict[Optional[str], Dict[str, list]]] = None
+        self._lock = threading.Lock()
+
+    def _compile(self):
+        event_handlers = utils.create_event_handlers(
+            self.event_handler_messages,
+            end_escalation_page=page(self.escalation_page),
+        )
+        return {
+            owner: {
+                "routes": [
+                    route.build() for route in self.routes.get(owner, [])
+                ],
+                "event_handlers": (
+                    event_handlers
+                    if owner in self.event_handler_owners
+                    else []
+                ),
+            }
+            for owner in [FLOW_START, *self.pages]
+        }
+
+    def compile(self) -> Dict[Optional[str], Dict[str, list]]:
+        """Routes and event handlers of every owner, with placeholders."""
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = self._compile()
+        return self._compiled
+
+    def instantiate(self, config, flow_name: str, **params: str):
+        compiled = self.compile()
+        (
+            flow_obj,
+            flows_instance,
+            flows_map,
+            pages_instance,
+        ) = utils.create_flow_by_name(
+            config=config,
+            flow_name=flow_name,
+            nlu_threshold=self.nlu_threshold,
+        )
+        page_map, builder_map = utils.create_pages(
+            self.pages, flow_obj, pages_instance, flows_map, flow_name
+        )
+
+        values = {**self.defaults, **params, "flow": flow_obj.name}
+        values.update({f"flow:{k}": v for k, v in flows_map.items()})
+        values.update({f"page:{k}": v for k, v in page_map.items()})
+
+        for owner, protos in compiled.items():
+            proto_obj = (
+                flow_obj
+                if owner is FLOW_START
+                else builder_map[owner].proto_obj
+            )
+            proto_obj.transition_routes.extend(
+                substitute(route, values) for route in protos["routes"]
+            )
+            proto_obj.event_handlers.extend(
+                substitute(handler, values)
+                for handler in protos["event_handlers"]
+            )
+
+        utils.update_flow_and_pages(
+            flow_obj=flow_obj,
+            page_map=page_map,
+            builder_map=builder_map,
+            pages_instance=pages_instance,
+            flows_instance=flows_instance,
+        )
+        return flow_obj
+
+
+def _fill(text: str, values: Dict[str, str]) -> str:
+    def replace(match):
+        if match.group(1) not in values:
+            raise KeyError(f"No value for placeholder {match.group(0)}")
+        return values[match.group(1)]
+
+    return PLACEHOLDER.sub(replace, text)
+
+
+def _fill_message(message: Any, values: Dict[str, str]):
+    for field, value in message.ListFields():
+        repeated = field.label == field.LABEL_REPEATED
+        if field.type == field.TYPE_STRING:
+            if repeated:
+                value[:] = [_fill(item, values) for item in value]
+            else:
+                setattr(message, field.name, _fill(value, values))
+        elif field.type == field.TYPE_MESSAGE:
+            if field.message_type.GetOptions().map_entry:
+                if field.message_type.fields_by_name["value"].message_type:
+                    for item in value.values():
+                        _fill_message(item, values)
+            elif repeated:
+                for item in value:
+                    _fill_message(item, values)
+            else:
+                _fill_message(value, values)
+
+
+def substitute(proto_obj, values: Dict[str, str]):
+    """A copy of a compiled proto with its placeholders filled in."""
+    message_type = type(proto_obj)
+    copied = message_type()
+    message_type.pb(copied).CopyFrom(message_type.pb(proto_obj))
+    _fill_message(message_type.pb(copied), values)
+    return copied
+
+
+def authentication_gate(authenticated: List[TemplateRoute]):
+    """Unauthenticated callers go to Authentication, others `authenticated`"""
+    return [
+        TemplateRoute(
+            condition="$session.params.patientFound = null"
+            + ' OR $session.params.patientFound =  "false"',
+            target=flow(FlowNames.AUTHENTICATION.value),
+        ),
+        *authenticated,
+    ]
+
+
+class EscalationPageNames(str, Enum):
+    END_ESCALATION = "end escalation"
+
+
+# authenticate, then hand the caller over to a scheduler
+ESCALATION_TEMPLATE = FlowTemplate(
+    pages=[EscalationPageNames.END_ESCALATION.value],
+    routes={
+        FLOW_START: authentication_gate(
+            [
+                TemplateRoute(
+                    condition='$session.params.patientFound = "true"',
+                    target=page(EscalationPageNames.END_ESCALATION.value),
+                    parameter_presets={
+                        "transfering_agent_message": "{transfer_message}",
+                        # the scheduler may change the caller's appointments
+                        **utils.forget_memoized_webhooks(),
+                    },
+                )
+            ]
+        ),
+        EscalationPageNames.END_ESCALATION.value: [
+            TemplateRoute(
+                condition="true",
+                target=symbolic(SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION),
+            )
+        ],
+    },
+    event_handler_owners=[FLOW_START],
+    escalation_page=EscalationPageNames.END_ESCALATION.value,
+    defaults={"transfer_message": commons.TRANSFERRING_TO_AGENT_SUCCESS},
+)
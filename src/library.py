@@ -1,11 +1,11 @@
-import os
 from enum import Enum
-from typing import Iterable, List, Optional, Union
+from typing import Iterable, List, Optional, Tuple, Union
 
 from google.api_core.exceptions import AlreadyExists
 from google.cloud import dialogflowcx_v3
 from google.cloud.dialogflowcx_v3 import EntityType, Form
 from google.cloud.dialogflowcx_v3.types import (
+    AdvancedSettings,
     EventHandler,
     Flow,
     Fulfillment,
@@ -17,15 +17,6 @@ from google.cloud.dialogflowcx_v3.types import (
 )
 
 import utils
-from resources.utils import Resources
-
-# Get project_id, location, agent_id from environment variables
-project_id = os.environ.get("PROJECT_ID")
-location = os.environ.get("LOCATION")
-config = utils.Config()
-agent_name = Resources(config).agent_path
-agent_path = dialogflowcx_v3.AgentsClient().parse_agent_path(agent_name)
-agent_id = agent_path["agent"]
 
 
 class StandardPage(Enum):
@@ -43,24 +34,34 @@ class SystemEntityType(Enum):
     DURATION = "duration"
     LAST_NAME = "last-name"
     NUMBER = "number"
+    NUMBER_SEQUENCE = "number-sequence"
     PERSON = "person"
     TIME = "time"
 
 
+KEYPAD_DATE_DIGITS = utils.KEYPAD_DATE_DIGITS
+
+
 class DialogflowLibrary:
+    # the agent comes from the config of every call, main.py deploys
+    # several agents side by side
     @classmethod
-    def get_parent(cls):
-        client = dialogflowcx_v3.AgentsClient()
-        return client.agent_path(project_id, location, agent_id)
+    def get_parent(cls, config: utils.Config) -> str:
+        return utils.get_agent_id(config)
 
     @classmethod
-    def create_flow(cls, flow_name: str):
+    def create_flow(cls, config: utils.Config, flow_name: str):
         client = dialogflowcx_v3.FlowsClient()
 
         # Initialize request argument(s)
         flow = dialogflowcx_v3.Flow()
         flow.display_name = flow_name
-        parent = cls.get_parent()
+        profile = utils.speech_profile(flow_name)
+        if profile is not None:
+            flow.advanced_settings = utils.create_advanced_settings(
+                profile, AdvancedSettings
+            )
+        parent = cls.get_parent(config)
         try:
             request = dialogflowcx_v3.CreateFlowRequest(
                 parent=parent,
@@ -69,7 +70,7 @@ class DialogflowLibrary:
             response = client.create_flow(request=request)
             return response
         except AlreadyExists:
-            flow = cls.get_flow(flow_name)
+            flow = cls.get_flow(config, flow_name)
             request = dialogflowcx_v3.UpdateFlowRequest(flow=flow)
             response = client.update_flow(request=request)
             return response
@@ -82,14 +83,40 @@ class DialogflowLibrary:
         entry_fulfillment: Optional[Fulfillment] = None,
         event_handlers: Optional[List[EventHandler]] = None,
         form: Optional[Form] = None,
+        memo_inputs: Optional[List[str]] = None,
     ):
+        """Create (or update) a page.
+
+        With `memo_inputs` the webhook of the entry fulfillment is skipped
+        when those session parameters are the same as on the last
+        successful call of its tag, see memoize_webhook.
+        """
         client = dialogflowcx_v3.PagesClient()
+        memo_routes = []
+        if memo_inputs is not None:
+            if entry_fulfillment is None:
+                raise ValueError("memo_inputs needs an entry fulfillment")
+            (
+                entry_fulfillment,
+                event_handlers,
+                memo_route,
+            ) = cls.memoize_webhook(
+                entry_fulfillment, event_handlers, memo_inputs
+            )
+            memo_routes = [memo_route]
         # Initialize request argument(s)
         page = dialogflowcx_v3.Page()
         page.display_name = page_name
         page.entry_fulfillment = entry_fulfillment
         page.event_handlers = event_handlers
         page.form = form
+        profile = utils.speech_profile(flow.display_name, page_name)
+        if profile is not None:
+            page.advanced_settings = utils.create_advanced_settings(
+                profile, AdvancedSettings
+            )
+        # the memo route goes first, routes added later only see results
+        page.transition_routes = memo_routes
         parent = flow.name
 
         try:
@@ -106,6 +133,13 @@ class DialogflowLibrary:
             page.display_name = page_name
             page.entry_fulfillment = entry_fulfillment
             page.event_handlers = event_handlers
+            if profile is not None:
+                page.advanced_settings = utils.create_advanced_settings(
+                    profile, AdvancedSettings
+                )
+            for memo_route in memo_routes:
+                if memo_route not in page.transition_routes:
+                    page.transition_routes.insert(0, memo_route)
 
             request = dialogflowcx_v3.UpdatePageRequest(
                 page=page,
@@ -136,9 +170,9 @@ class DialogflowLibrary:
         return response
 
     @classmethod
-    def get_intent(cls, intent_display_name: str):
+    def get_intent(cls, config: utils.Config, intent_display_name: str):
         client = dialogflowcx_v3.IntentsClient()
-        parent = cls.get_parent()
+        parent = cls.get_parent(config)
         # Initialize request argument(s)
         request = dialogflowcx_v3.ListIntentsRequest(
             parent=parent,
@@ -151,7 +185,7 @@ class DialogflowLibrary:
         }
         if intent_display_name not in display_name2intent_name:
             raise ValueError(
-                f"Intent {intent_display_name} not found in agent {agent_id}"
+                f"Intent {intent_display_name} not found in agent {parent}"
             )
         intent_name = display_name2intent_name[intent_display_name]
 
@@ -161,9 +195,9 @@ class DialogflowLibrary:
         return intent
 
     @classmethod
-    def get_flow(cls, display_name: str) -> Flow | None:
+    def get_flow(cls, config: utils.Config, display_name: str) -> Flow | None:
         client = dialogflowcx_v3.FlowsClient()
-        parent = cls.get_parent()
+        parent = cls.get_parent(config)
         # Initialize request argument(s)
         request = dialogflowcx_v3.ListFlowsRequest(
             parent=parent,
@@ -181,9 +215,9 @@ class DialogflowLibrary:
         return flow
 
     @classmethod
-    def get_webhook(cls, display_name: str) -> Webhook:
+    def get_webhook(cls, config: utils.Config, display_name: str) -> Webhook:
         client = dialogflowcx_v3.WebhooksClient()
-        parent = cls.get_parent()
+        parent = cls.get_parent(config)
         # Initialize request argument(s)
         request = dialogflowcx_v3.ListWebhooksRequest(
             parent=parent,
@@ -199,9 +233,11 @@ class DialogflowLibrary:
         return webhook
 
     @classmethod
-    def get_entity_type(cls, display_name: str) -> EntityType:
+    def get_entity_type(
+        cls, config: utils.Config, display_name: str
+    ) -> EntityType:
         client = dialogflowcx_v3.EntityTypesClient()
-        parent = DialogflowLibrary.get_parent()
+        parent = cls.get_parent(config)
 
         # Initialize request argument(s)
         request = dialogflowcx_v3.ListEntityTypesRequest(
@@ -258,7 +294,7 @@ class DialogflowLibrary:
         target_flow: Flow = None,
         intent: Intent = None,
         trigger_fulfillment: Fulfillment = None,
-    ) -> Optional[TransitionRoute]:
+    ) -> TransitionRoute:
         # only target_page or target_flow can be used
         if target_page and target_flow:
             raise ValueError("Only target_page or target_flow can be used")
@@ -295,9 +331,19 @@ class DialogflowLibrary:
         set_parameter_actions: Optional[
             Iterable[Fulfillment.SetParameterAction]
         ] = None,
+        return_partial_responses: Optional[bool] = None,
     ) -> Fulfillment:
+        # same rules as utils.create_fulfillment_builder
+        if return_partial_responses is None:
+            prompt = None
+            if webhook is not None and not messages:
+                prompt = utils.interim_prompt(tag)
+            return_partial_responses = prompt is not None
+            if prompt:
+                messages = [cls.create_response_message(prompt)]
         fullfilment = Fulfillment()
         fullfilment.messages = messages
+        fullfilment.return_partial_responses = return_partial_responses
         if webhook is not None:
             fullfilment.webhook = webhook.name
 
@@ -305,6 +351,95 @@ class DialogflowLibrary:
         fullfilment.set_parameter_actions = set_parameter_actions
         return fullfilment
 
+    @classmethod
+    def memoize_webhook(
+        cls,
+        fulfillment: Fulfillment,
+        event_handlers: Optional[List[EventHandler]],
+        inputs: List[str],
+    ) -> Tuple[Fulfillment, List[EventHandler], TransitionRoute]:
+        """Split a webhook entry fulfillment into a memo key and a guard.
+
+        The entry fulfillment keeps its parameter presets and sets
+        `<tag>_memo_key` from the inputs, a constant preset is part of the
+        key as its value. The webhook call (and the messages, which belong
+        to it) move to a route without target that runs only while the key
+        differs from `<tag>_memo_last`, the key of the last successful call
+        in the session. CX evaluates the page routes again after the call,
+        so the routes added to the page afterwards see the webhook results
+        either way. The page's webhook.error handlers forget the last key,
+        a failed call is never reused, and so do the fulfillments after
+        which the backend may change (utils.forget_memoized_webhooks).
+        """
+        if not fulfillment.webhook:
+            raise ValueError("memoizing needs a webhook entry fulfillment")
+        if fulfillment.tag not in utils.MEMOIZED_WEBHOOK_TAGS:
+            # state changing flows only forget the tags listed there
+            raise ValueError(
+                f"add {fulfillment.tag} to utils.MEMOIZED_WEBHOOK_TAGS"
+            )
+        error_handlers = [
+            handler
+            for handler in event_handlers or []
+            if handler.event == utils.EventNames.WEBHOOK_ERROR
+        ]
+        if not error_handlers:
+            # the flow level handler could not forget the key
+            raise ValueError(
+                "memoizing needs a page level webhook.error handler"
+            )
+        memo_key = utils.memo_key_parameter(fulfillment.tag)
+        memo_last = utils.memo_last_parameter(fulfillment.tag)
+        constants = {
+            action.parameter: action.value
+            for action in fulfillment.set_parameter_actions
+            if not str(action.value).startswith("$")
+        }
+        key = "|".join(
+            f"{name}={constants[name]}"
+            if name in constants
+            else f"{name}=$session.params.{name}"
+            for name in inputs
+        )
+
+        entry_fulfillment = cls.create_fulfillment(
+            set_parameter_actions=[
+                *fulfillment.set_parameter_actions,
+                cls.create_set_parameter_action(memo_key, key),
+            ],
+            return_partial_responses=False,
+        )
+        webhook_fulfillment = cls.create_fulfillment(
+            messages=list(fulfillment.messages),
+            tag=fulfillment.tag,
+            set_parameter_actions=[
+                cls.create_set_parameter_action(
+                    memo_last, f"$session.params.{memo_key}"
+                ),
+            ],
+            return_partial_responses=fulfillment.return_partial_responses,
+        )
+        # create_fulfillment takes the Webhook, the name is all we have
+        webhook_fulfillment.webhook = fulfillment.webhook
+        memo_route = cls.create_transition_route(
+            condition=(
+                f"$session.params.{memo_last} != $session.params.{memo_key}"
+            ),
+            trigger_fulfillment=webhook_fulfillment,
+        )
+
+        handlers = []
+        for handler in event_handlers or []:
+            if handler in error_handlers:
+                handler = EventHandler(handler)
+                trigger_fulfillment = Fulfillment(handler.trigger_fulfillment)
+                trigger_fulfillment.set_parameter_actions.append(
+                    cls.create_set_parameter_action(memo_last, None)
+                )
+                handler.trigger_fulfillment = trigger_fulfillment
+            handlers.append(handler)
+        return entry_fulfillment, handlers, memo_route
+
     @classmethod
     def create_page_form(cls, parameters: list[Form.Parameter]) -> Form:
         form = Form()
@@ -322,7 +457,14 @@ class DialogflowLibrary:
         redact: bool = False,
         initial_prompt_fulfillment: Optional[Fulfillment] = None,
         reprompt_event_handlers: Optional[List[EventHandler]] = None,
+        dtmf_max_digits: Optional[int] = None,
+        dtmf_finish_digit: str = "#",
     ) -> Form.Parameter:
+        """Form parameter, with `dtmf_max_digits` it can also be keyed in.
+
+        The keyed digits are matched against the entity type like speech,
+        see create_keypad_date_parameter for entities digits do not match.
+        """
         parameter = Form.Parameter()
         parameter.display_name = name
         parameter.required = required
@@ -336,8 +478,58 @@ class DialogflowLibrary:
         parameter.fill_behavior.reprompt_event_handlers = (
             reprompt_event_handlers
         )
+        if dtmf_max_digits is not None:
+            parameter.advanced_settings = AdvancedSettings(
+                dtmf_settings=AdvancedSettings.DtmfSettings(
+                    enabled=True,
+                    max_digits=dtmf_max_digits,
+                    finish_digit=dtmf_finish_digit,
+                )
+            )
         return parameter
 
+    @classmethod
+    def create_keypad_date_parameter(cls, *, name: str) -> Form.Parameter:
+        """Optional companion of the date parameter `name` for keyed dates.
+
+        Keyed MMDDYYYY digits do not match sys.date, they fill
+        `<name>_keyed` instead and create_keypad_date_route takes it from
+        there. Give the date parameter dtmf_max_digits=KEYPAD_DATE_DIGITS.
+        """
+        return cls.create_page_form_parameter(
+            name=f"{name}_keyed",
+            entity_type=cls.get_system_entity_type(
+                SystemEntityType.NUMBER_SEQUENCE
+            ),
+            required=False,
+        )
+
+    @classmethod
+    def create_keypad_date_route(
+        cls,
+        *,
+        name: str,
+        parameter: str,
+        target_page: Page,
+        suffix: str = "",
+    ) -> TransitionRoute:
+        """Route taking a keyed date of the date parameter `name`.
+
+        Sets `parameter` to the keyed date as YYYY-MM-DD plus `suffix` and
+        goes to `target_page`, in the same turn the digits were keyed.
+        """
+        return cls.create_transition_route(
+            condition=utils.keypad_date_condition(name),
+            target_page=target_page,
+            trigger_fulfillment=cls.create_fulfillment(
+                set_parameter_actions=[
+                    cls.create_set_parameter_action(
+                        parameter, utils.keypad_date_value(name, suffix)
+                    ),
+                ],
+            ),
+        )
+
     @classmethod
     def create_event_handler(
         cls,
@@ -1,4 +1,8 @@
+import argparse
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import agent_config
 import anything_else
@@ -7,6 +11,7 @@ import cancel_appointment
 import confirm_block
 import create_appointment
 import default_start
+import deploy_journal
 import desired_action
 import find_existing_appointment
 import reschedule_appointment
@@ -22,72 +27,182 @@ def delete_flows(config):
         utils.delete_flow_with_check(flow.value, config)
 
 
+# (what is created, builder, flows it builds) in dependency order
+FLOW_STEPS = [
+    (
+        "name collection flow pages",
+        authentication.create_name_collection_flow_pages,
+        [utils.FlowNames.NAME_COLLECTION.value],
+    ),
+    (
+        "authentication flow pages",
+        authentication.create_authentication_flow_pages,
+        [utils.FlowNames.AUTHENTICATION.value],
+    ),
+    (
+        "existing appointment flow pages",
+        find_existing_appointment.create_existing_appointment_flow_pages,
+        [utils.FlowNames.FIND_EXISTING_APPOINTMENT.value],
+    ),
+    (
+        "new appointment flow pages",
+        create_appointment.create_new_appointment_flow_pages,
+        [utils.FlowNames.CREATE_NEW_APPOINTMENT.value],
+    ),
+    (
+        "cancel appointment flow pages",
+        cancel_appointment.create_cancel_appointment_flow_pages,
+        [utils.FlowNames.CANCEL.value],
+    ),
+    (
+        "reschedule appointment flow pages",
+        reschedule_appointment.create_reschedule_appointment_flow_pages,
+        [utils.FlowNames.RESCHEDULE.value],
+    ),
+    (
+        "verify appointment flow pages",
+        verify_appointment.create_verify_appointment_flow_pages,
+        [utils.FlowNames.VERIFY.value],
+    ),
+    (
+        "desired_action",
+        desired_action.create_desired_action_flow_pages,
+        [utils.FlowNames.SCHEDULING.value],
+    ),
+    (
+        "office_hours",
+        office_hours.create_flow_pages,
+        [utils.FlowNames.OFFICE_HOURS.value],
+    ),
+    (
+        "default_start",
+        default_start.create_default_start_flow_pages,
+        [utils.DEFAULT_START_FLOW],
+    ),
+    (
+        "confirm_block",
+        confirm_block.create_confirm_block_flow_pages,
+        ["Confirm Block"],
+    ),
+    (
+        "anything_else",
+        anything_else.create_flow_pages,
+        [utils.FlowNames.ANYTHING_ELSE.value],
+    ),
+    (
+        "wrapup_block",
+        wrapup_block.create_flow_pages,
+        [utils.FlowNames.WRAPUP_BLOCK.value],
+    ),
+]
+MAX_PARALLEL_DEPLOYS = int(os.environ.get("MAX_PARALLEL_DEPLOYS", "4"))
+
+
+def restore_agent(config):
+    Resources(config).restore_agent()
+
+
+DEPLOY_STEPS = [
+    ("restore agent", restore_agent, []),
+    *FLOW_STEPS,
+    ("flow settings", agent_config.update_flow_settings, []),
+    ("speech settings", agent_config.update_speech_settings, []),
+]
+
+
+def run_steps(config, steps, journal=None, start=0):
+    # steps before `start` are still deployed as the journal recorded
+    for step_name, _, _ in steps[:start]:
+        print(f"[{config.agent_display_name}] skipped {step_name}")
+    for step_name, run_step, flow_names in steps[start:]:
+        if journal is not None:
+            journal.begin(
+                step_name, deploy_journal.snapshot_flows(config, flow_names)
+            )
+        s = time.time()
+        run_step(config)
+        e = time.time()
+        print(
+            f"[{config.agent_display_name}]",
+            f"time taken for {step_name}: ",
+            e - s,
+        )
+        if journal is not None:
+            journal.record(
+                step_name, deploy_journal.snapshot_flows(config, flow_names)
+            )
+
+
 def create_flows(config):
+    run_steps(config, FLOW_STEPS)
+
+
+def deploy(config, resume=False):
     s = time.time()
-    authentication.create_name_collection_flow_pages(config)
-    e = time.time()
-    print("time taken to create name collection flow pages: ", e - s)
-    s = time.time()
-    authentication.create_authentication_flow_pages(config)
-    e = time.time()
-    print("time taken to create authentication flow pages: ", e - s)
-    s = time.time()
-    find_existing_appointment.create_existing_appointment_flow_pages(config)
-    e = time.time()
-    print("time taken to create existing appointment flow pages: ", e - s)
-    s = time.time()
-    create_appointment.create_new_appointment_flow_pages(config)
-    e = time.time()
-    print("time taken to create new appointment flow pages: ", e - s)
-    s = time.time()
-    cancel_appointment.create_cancel_appointment_flow_pages(config)
-    e = time.time()
-    print("time taken to create cancel appointment flow pages: ", e - s)
-    s = time.time()
-    reschedule_appointment.create_reschedule_appointment_flow_pages(config)
-    e = time.time()
-    print("time taken to create reschedule appointment flow pages: ", e - s)
-    s = time.time()
-    verify_appointment.create_verify_appointment_flow_pages(config)
-    e = time.time()
-    print("time taken to create verify appointment flow pages: ", e - s)
-    desired_action.create_desired_action_flow_pages(config)
-    e = time.time()
-    print("time taken to desired_action: ", e - s)
-    s = time.time()
-    office_hours.create_flow_pages(config)
-    e = time.time()
-    print("time taken to office_hours: ", e - s)
-    s = time.time()
-    default_start.create_default_start_flow_pages(config)
-    e = time.time()
-    print("time taken to default_start: ", e - s)
-    s = time.time()
-    confirm_block.create_confirm_block_flow_pages(config)
-    e = time.time()
-    print("time taken to confirm_block: ", e - s)
-    s = time.time()
-    anything_else.create_flow_pages(config)
-    e = time.time()
-    print("time taken to anything_else: ", e - s)
-    s = time.time()
-    wrapup_block.create_flow_pages(config)
+    journal = deploy_journal.DeployJournal(
+        path=deploy_journal.DEFAULT_JOURNAL_PATH,
+        agent_display_name=config.agent_display_name,
+    )
+    start = (
+        deploy_journal.resume_index(config, journal, DEPLOY_STEPS)
+        if resume
+        else 0
+    )
+    if start == 0:
+        journal.start()
+    run_steps(config, DEPLOY_STEPS, journal, start)
     e = time.time()
-    print("time taken to wrapup_block: ", e - s)
+    print(f"[{config.agent_display_name}] Total Time: ", e - s)
 
 
-def main():
+def get_agent_display_names(config, argv):
+    # agents from the command line, AGENT_DISPLAY_NAMES (comma separated)
+    # or AGENT_DISPLAY_NAME
+    names = argv or os.environ.get("AGENT_DISPLAY_NAMES", "").split(",")
+    names = [name.strip() for name in names if name.strip()]
+    if not names and config.agent_display_name is not None:
+        names = [config.agent_display_name]
+    return list(dict.fromkeys(names))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agents", nargs="*", help="agent display names")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the steps the deploy journal shows as still deployed",
+    )
+    args = parser.parse_args(argv)
+
     s = time.time()
     config = utils.Config()
-    if config.agent_display_name is None:
+    agent_display_names = get_agent_display_names(config, args.agents)
+    if not agent_display_names:
         raise ValueError("agent_display_name cannot be None")
-    resource = Resources(config)
-    resource.restore_agent()
-    create_flows(config)
-    agent_config.update_flow_settings(config)
+
+    # every agent gets its own config, so its own agent id lookups, and the
+    # agents are deployed side by side
+    failed = []
+    with ThreadPoolExecutor(
+        max_workers=min(len(agent_display_names), MAX_PARALLEL_DEPLOYS)
+    ) as executor:
+        futures = {
+            executor.submit(deploy, config.for_agent(name), args.resume): name
+            for name in agent_display_names
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as error:
+                utils.logger.error(f"Deploy of {futures[future]} failed")
+                utils.logger.exception(error)
+                failed.append(futures[future])
     e = time.time()
     print("Total Time: ", e - s)
+    if failed:
+        raise RuntimeError(f"Deploy failed for {', '.join(failed)}")
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
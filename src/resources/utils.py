@@ -3,6 +3,7 @@ from dfcx_scrapi.core.agents import Agents
 from dfcx_scrapi.core.entity_types import EntityTypes
 from google.cloud.dialogflowcx_v3beta1 import types
 
+import agent_cache
 from resources.entity_types import ENTITY_TYPES
 from utils import Config
 
@@ -24,16 +25,24 @@ class Resources:
         self.agent_path = self.get_agent_path(config.agent_display_name)
 
     def get_agent_path(self, display_name: str):
-        agent_obj = self.agents_instance.get_agent_by_display_name(
+        agent_path = agent_cache.resolve_agent(
+            self.agents_instance,
             project_id=self.config.project_id,
+            location=self.config.location,
             display_name=display_name,
         )
-        if agent_obj is None:
-            agent_obj = self.agents_instance.create_agent(
+        if agent_path is None:
+            agent_path = self.agents_instance.create_agent(
                 project_id=self.config.project_id,
                 display_name=display_name,
+            ).name
+            agent_cache.remember_agent(
+                project_id=self.config.project_id,
+                location=self.config.location,
+                display_name=display_name,
+                name=agent_path,
             )
-        return agent_obj.name
+        return agent_path
 
     def restore_agent(self):
         agents_instance = Agents(creds_path=self.config.service_account_key)
@@ -1,9 +1,12 @@
+import utils
 from library import DialogflowLibrary as dl
 
-# flow = dl.get_flow("test_flow11")
+config = utils.Config()
+
+# flow = dl.get_flow(config, "test_flow11")
 # page = dl.get_page(flow, "source")
 # print(page.name)
-flow = dl.create_flow("test_flow18")
+flow = dl.create_flow(config, "test_flow18")
 
 page_end = dl.create_page(flow, "end")
 event_handler1 = dl.create_event_handler(
@@ -15,7 +18,7 @@ event_handler2 = dl.create_event_handler(
 event_handler3 = dl.create_event_handler(
     name="a", event="sys.no-input-3", target_page=page_end
 )
-# webhook = dl.get_webhook("mywebhook")
+# webhook = dl.get_webhook(config, "mywebhook")
 # print(webhook.name)
 
 
@@ -40,7 +43,7 @@ page_source = dl.create_page(
 # )
 
 
-# intent = dl.get_intent("Default Welcome Intent")
+# intent = dl.get_intent(config, "Default Welcome Intent")
 condition = "$session.params = null AND $session.params = null"
 fullfillment = dl.create_fulfillment(
     messages=[dl.create_response_message("Hello world")],
@@ -0,0 +1,579 @@
+"""
+In-memory model of the agent produced by the flow builders
+
+Flows, pages, forms, transition routes, event handlers and fulfillments are
+read from the agent (or from the proto objects the builders create) and every
+resource name is resolved to a display name, so the offline tools can walk
+the graph without talking to Dialogflow.
+
+The graph can be saved to / loaded from JSON, which lets CI snapshot the
+deployed agent once and replay conversations against it offline:
+
+    cd src && python -m tools.agent_graph agent_graph.json
+"""
+
+import json
+import sys
+from typing import Any, Dict, Iterable, List, Optional
+
+from dfcx_scrapi.core.flows import Flows
+from dfcx_scrapi.core.intents import Intents
+from dfcx_scrapi.core.pages import Pages
+from dfcx_scrapi.core.webhooks import Webhooks
+from google.protobuf import json_format
+
+import utils
+
+START_PAGE = "START"
+# symbolic targets a route or event handler can point to besides real pages
+SYMBOLIC_TARGETS = {page.value for page in utils.SymbolicPages} | {
+    "START_PAGE",
+    "CURRENT_PAGE",
+    "PREVIOUS_PAGE",
+}
+
+
+def _proto_to_python(value: Any) -> Any:
+    # proto-plus marshals Struct/Value into MapComposite/RepeatedComposite
+    if hasattr(value, "items"):
+        return {k: _proto_to_python(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) or (
+        hasattr(value, "__iter__") and not isinstance(value, (str, bytes))
+    ):
+        return [_proto_to_python(v) for v in value]
+    return value
+
+
+class Fulfillment:
+    def __init__(
+        self,
+        *,
+        messages: Optional[List[Any]] = None,
+        webhook: Optional[str] = None,
+        tag: Optional[str] = None,
+        set_parameters: Optional[Dict[str, Any]] = None,
+    ):
+        # text messages are plain strings, everything else is kept as a dict
+        # keyed by the message type eg {"live_agent_handoff": {...}}
+        self.messages = messages or []
+        self.webhook = webhook
+        self.tag = tag
+        self.set_parameters = set_parameters or {}
+
+    def is_empty(self) -> bool:
+        return not (
+            self.messages or self.webhook or self.tag or self.set_parameters
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "messages": self.messages,
+            "webhook": self.webhook,
+            "tag": self.tag,
+            "set_parameters": self.set_parameters,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]):
+        if not data:
+            return None
+        return cls(
+            messages=data.get("messages"),
+            webhook=data.get("webhook"),
+            tag=data.get("tag"),
+            set_parameters=data.get("set_parameters"),
+        )
+
+
+class Route:
+    def __init__(
+        self,
+        *,
+        intent: Optional[str] = None,
+        condition: Optional[str] = None,
+        target_page: Optional[str] = None,
+        target_flow: Optional[str] = None,
+        trigger_fulfillment: Optional[Fulfillment] = None,
+    ):
+        self.intent = intent
+        self.condition = condition
+        self.target_page = target_page
+        self.target_flow = target_flow
+        self.trigger_fulfillment = trigger_fulfillment
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "intent": self.intent,
+            "condition": self.condition,
+            "target_page": self.target_page,
+            "target_flow": self.target_flow,
+            "trigger_fulfillment": (
+                self.trigger_fulfillment.to_dict()
+                if self.trigger_fulfillment
+                else None
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        return cls(
+            intent=data.get("intent"),
+            condition=data.get("condition"),
+            target_page=data.get("target_page"),
+            target_flow=data.get("target_flow"),
+            trigger_fulfillment=Fulfillment.from_dict(
+                data.get("trigger_fulfillment")
+            ),
+        )
+
+
+class EventHandler:
+    def __init__(
+        self,
+        *,
+        event: str,
+        target_page: Optional[str] = None,
+        target_flow: Optional[str] = None,
+        trigger_fulfillment: Optional[Fulfillment] = None,
+    ):
+        self.event = event
+        self.target_page = target_page
+        self.target_flow = target_flow
+        self.trigger_fulfillment = trigger_fulfillment
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "event": self.event,
+            "target_page": self.target_page,
+            "target_flow": self.target_flow,
+            "trigger_fulfillment": (
+                self.trigger_fulfillment.to_dict()
+                if self.trigger_fulfillment
+                else None
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        return cls(
+            event=data["event"],
+            target_page=data.get("target_page"),
+            target_flow=data.get("target_flow"),
+            trigger_fulfillment=Fulfillment.from_dict(
+                data.get("trigger_fulfillment")
+            ),
+        )
+
+
+class FormParameter:
+    def __init__(
+        self,
+        *,
+        name: str,
+        entity_type: Optional[str] = None,
+        required: bool = True,
+        is_list: bool = False,
+        initial_prompt: Optional[Fulfillment] = None,
+        reprompt_event_handlers: Optional[List[EventHandler]] = None,
+    ):
+        self.name = name
+        self.entity_type = entity_type
+        self.required = required
+        self.is_list = is_list
+        self.initial_prompt = initial_prompt
+        self.reprompt_event_handlers = reprompt_event_handlers or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "entity_type": self.entity_type,
+            "required": self.required,
+            "is_list": self.is_list,
+            "initial_prompt": (
+                self.initial_prompt.to_dict() if self.initial_prompt else None
+            ),
+            "reprompt_event_handlers": [
+                eh.to_dict() for eh in self.reprompt_event_handlers
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        return cls(
+            name=data["name"],
+            entity_type=data.get("entity_type"),
+            required=data.get("required", True),
+            is_list=data.get("is_list", False),
+            initial_prompt=Fulfillment.from_dict(data.get("initial_prompt")),
+            reprompt_event_handlers=[
+                EventHandler.from_dict(eh)
+                for eh in data.get("reprompt_event_handlers", [])
+            ],
+        )
+
+
+class Page:
+    def __init__(
+        self,
+        *,
+        name: str,
+        flow: str,
+        entry_fulfillment: Optional[Fulfillment] = None,
+        form: Optional[List[FormParameter]] = None,
+        routes: Optional[List[Route]] = None,
+        event_handlers: Optional[List[EventHandler]] = None,
+        advanced_settings: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.flow = flow
+        self.entry_fulfillment = entry_fulfillment
+        self.form = form or []
+        self.routes = routes or []
+        self.event_handlers = event_handlers or []
+        # speech and DTMF settings of the page, see speech_settings
+        self.advanced_settings = advanced_settings or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "entry_fulfillment": (
+                self.entry_fulfillment.to_dict()
+                if self.entry_fulfillment
+                else None
+            ),
+            "form": [parameter.to_dict() for parameter in self.form],
+            "routes": [route.to_dict() for route in self.routes],
+            "event_handlers": [eh.to_dict() for eh in self.event_handlers],
+            "advanced_settings": self.advanced_settings,
+        }
+
+    @classmethod
+    def from_dict(cls, flow: str, data: Dict[str, Any]):
+        return cls(
+            name=data["name"],
+            flow=flow,
+            entry_fulfillment=Fulfillment.from_dict(
+                data.get("entry_fulfillment")
+            ),
+            form=[FormParameter.from_dict(p) for p in data.get("form", [])],
+            routes=[Route.from_dict(r) for r in data.get("routes", [])],
+            event_handlers=[
+                EventHandler.from_dict(eh)
+                for eh in data.get("event_handlers", [])
+            ],
+            advanced_settings=data.get("advanced_settings"),
+        )
+
+
+class Flow:
+    def __init__(
+        self,
+        *,
+        name: str,
+        routes: Optional[List[Route]] = None,
+        event_handlers: Optional[List[EventHandler]] = None,
+        pages: Optional[Dict[str, Page]] = None,
+        nlu_threshold: Optional[float] = None,
+        advanced_settings: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        # flow level routes are the routes of the START page
+        self.routes = routes or []
+        self.event_handlers = event_handlers or []
+        self.pages = pages or {}
+        self.nlu_threshold = nlu_threshold
+        self.advanced_settings = advanced_settings or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "nlu_threshold": self.nlu_threshold,
+            "advanced_settings": self.advanced_settings,
+            "routes": [route.to_dict() for route in self.routes],
+            "event_handlers": [eh.to_dict() for eh in self.event_handlers],
+            "pages": [page.to_dict() for page in self.pages.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        name = data["name"]
+        pages = [Page.from_dict(name, p) for p in data.get("pages", [])]
+        return cls(
+            name=name,
+            nlu_threshold=data.get("nlu_threshold"),
+            advanced_settings=data.get("advanced_settings"),
+            routes=[Route.from_dict(r) for r in data.get("routes", [])],
+            event_handlers=[
+                EventHandler.from_dict(eh)
+                for eh in data.get("event_handlers", [])
+            ],
+            pages={page.name: page for page in pages},
+        )
+
+
+class AgentGraph:
+    def __init__(
+        self,
+        *,
+        flows: Dict[str, Flow],
+        intents: Optional[Dict[str, List[str]]] = None,
+        start_flow: str = utils.DEFAULT_START_FLOW,
+    ):
+        self.flows = flows
+        # intent display name -> training phrases
+        self.intents = intents or {}
+        self.start_flow = start_flow
+
+    def get_page(self, flow_name: str, page_name: str) -> Page:
+        try:
+            return self.flows[flow_name].pages[page_name]
+        except KeyError:
+            raise ValueError(f"Page {page_name} not found in flow {flow_name}")
+
+    def iter_pages(self) -> Iterable[Page]:
+        for flow in self.flows.values():
+            yield from flow.pages.values()
+
+    def speech_settings(self, flow_name: str, page_name: str) -> Dict:
+        """Speech and DTMF settings in effect on a page.
+
+        A page setting overrides its flow's, empty means the agent's.
+        """
+        flow = self.flows[flow_name]
+        settings = dict(flow.advanced_settings)
+        if page_name in flow.pages:
+            settings.update(flow.pages[page_name].advanced_settings)
+        return settings
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "start_flow": self.start_flow,
+            "intents": self.intents,
+            "flows": [flow.to_dict() for flow in self.flows.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        flows = [Flow.from_dict(f) for f in data["flows"]]
+        return cls(
+            flows={flow.name: flow for flow in flows},
+            intents=data.get("intents"),
+            start_flow=data.get("start_flow", utils.DEFAULT_START_FLOW),
+        )
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=2, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r", encoding="utf-8") as file:
+            return cls.from_dict(json.load(file))
+
+
+class _NameResolver:
+    """Maps Dialogflow resource names to display names."""
+
+    def __init__(
+        self,
+        flow_names: Dict[str, str],
+        page_names: Dict[str, str],
+        intent_names: Dict[str, str],
+        webhook_names: Dict[str, str],
+    ):
+        self.flow_names = flow_names
+        self.page_names = page_names
+        self.intent_names = intent_names
+        self.webhook_names = webhook_names
+
+    def page(self, resource_name: str) -> Optional[str]:
+        if not resource_name:
+            return None
+        last = resource_name.rsplit("/", 1)[-1]
+        if last in SYMBOLIC_TARGETS:
+            return last
+        return self.page_names.get(resource_name, resource_name)
+
+    def flow(self, resource_name: str) -> Optional[str]:
+        if not resource_name:
+            return None
+        return self.flow_names.get(resource_name, resource_name)
+
+    def intent(self, resource_name: str) -> Optional[str]:
+        if not resource_name:
+            return None
+        return self.intent_names.get(resource_name, resource_name)
+
+    def webhook(self, resource_name: str) -> Optional[str]:
+        if not resource_name:
+            return None
+        return self.webhook_names.get(resource_name, resource_name)
+
+    def fulfillment(self, proto) -> Optional[Fulfillment]:
+        if proto is None:
+            return None
+        messages: List[Any] = []
+        for message in proto.messages:
+            if message.text.text:
+                messages.extend(message.text.text)
+            elif message.live_agent_handoff.metadata:
+                messages.append(
+                    {
+                        "live_agent_handoff": _proto_to_python(
+                            message.live_agent_handoff.metadata
+                        )
+                    }
+                )
+            elif message.payload:
+                messages.append({"payload": _proto_to_python(message.payload)})
+        fulfillment = Fulfillment(
+            messages=messages,
+            webhook=self.webhook(proto.webhook),
+            tag=proto.tag or None,
+            set_parameters={
+                action.parameter: _proto_to_python(action.value)
+                for action in proto.set_parameter_actions
+            },
+        )
+        return None if fulfillment.is_empty() else fulfillment
+
+    def route(self, proto) -> Route:
+        return Route(
+            intent=self.intent(proto.intent),
+            condition=proto.condition or None,
+            target_page=self.page(proto.target_page),
+            target_flow=self.flow(proto.target_flow),
+            trigger_fulfillment=self.fulfillment(proto.trigger_fulfillment),
+        )
+
+    def event_handler(self, proto) -> EventHandler:
+        return EventHandler(
+            event=proto.event,
+            target_page=self.page(proto.target_page),
+            target_flow=self.flow(proto.target_flow),
+            trigger_fulfillment=self.fulfillment(proto.trigger_fulfillment),
+        )
+
+    def form_parameter(self, proto) -> FormParameter:
+        fill_behavior = proto.fill_behavior
+        return FormParameter(
+            name=proto.display_name,
+            entity_type=proto.entity_type or None,
+            required=proto.required,
+            is_list=proto.is_list,
+            initial_prompt=self.fulfillment(
+                fill_behavior.initial_prompt_fulfillment
+            ),
+            reprompt_event_handlers=[
+                self.event_handler(eh)
+                for eh in fill_behavior.reprompt_event_handlers
+            ],
+        )
+
+
+def _speech_settings(proto) -> Dict[str, Any]:
+    """The speech and DTMF part of an AdvancedSettings proto."""
+    settings = json_format.MessageToDict(
+        type(proto).pb(proto), preserving_proto_field_name=True
+    )
+    return {
+        field: settings[field]
+        for field in ("speech_settings", "dtmf_settings")
+        if field in settings
+    }
+
+
+def build_agent_graph(
+    flows: List[Any],
+    pages: Dict[str, List[Any]],
+    intent_names: Optional[Dict[str, str]] = None,
+    webhook_names: Optional[Dict[str, str]] = None,
+    intents: Optional[Dict[str, List[str]]] = None,
+) -> AgentGraph:
+    """Build the graph from Flow protos and their Page protos.
+
+    `pages` is keyed by flow resource name, `intent_names` and
+    `webhook_names` map resource names to display names.
+    """
+    flow_names = {flow.name: flow.display_name for flow in flows}
+    page_names = {
+        page.name: page.display_name
+        for flow_pages in pages.values()
+        for page in flow_pages
+    }
+    resolver = _NameResolver(
+        flow_names, page_names, intent_names or {}, webhook_names or {}
+    )
+
+    graph_flows = {}
+    for flow_proto in flows:
+        flow = Flow(
+            name=flow_proto.display_name,
+            routes=[resolver.route(tr) for tr in flow_proto.transition_routes],
+            event_handlers=[
+                resolver.event_handler(eh) for eh in flow_proto.event_handlers
+            ],
+            nlu_threshold=flow_proto.nlu_settings.classification_threshold,
+            advanced_settings=_speech_settings(flow_proto.advanced_settings),
+        )
+        for page_proto in pages.get(flow_proto.name, []):
+            page = Page(
+                name=page_proto.display_name,
+                flow=flow.name,
+                entry_fulfillment=resolver.fulfillment(
+                    page_proto.entry_fulfillment
+                ),
+                form=[
+                    resolver.form_parameter(parameter)
+                    for parameter in page_proto.form.parameters
+                ],
+                routes=[
+                    resolver.route(tr) for tr in page_proto.transition_routes
+                ],
+                event_handlers=[
+                    resolver.event_handler(eh)
+                    for eh in page_proto.event_handlers
+                ],
+                advanced_settings=_speech_settings(
+                    page_proto.advanced_settings
+                ),
+            )
+            flow.pages[page.name] = page
+        graph_flows[flow.name] = flow
+
+    return AgentGraph(flows=graph_flows, intents=intents)
+
+
+def load_agent_graph(config: utils.Config) -> AgentGraph:
+    agent_id = utils.get_agent_id(config)
+    flows_instance = Flows(creds_path=config.service_account_key)
+    pages_instance = Pages(creds_path=config.service_account_key)
+    intents_instance = Intents(creds_path=config.service_account_key)
+    webhooks_instance = Webhooks(creds_path=config.service_account_key)
+
+    flows = flows_instance.list_flows(agent_id)
+    pages = {flow.name: pages_instance.list_pages(flow.name) for flow in flows}
+
+    intent_names = {}
+    intents = {}
+    for intent in intents_instance.list_intents(agent_id):
+        intent_names[intent.name] = intent.display_name
+        intents[intent.display_name] = [
+            "".join(part.text for part in phrase.parts)
+            for phrase in intent.training_phrases
+        ]
+    webhook_names = webhooks_instance.get_webhooks_map(agent_id)
+
+    return build_agent_graph(
+        flows,
+        pages,
+        intent_names=intent_names,
+        webhook_names=webhook_names,
+        intents=intents,
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise ValueError("No output path provided")
+    load_agent_graph(utils.Config()).save(sys.argv[1])
@@ -0,0 +1,584 @@
+"""
+Coalesce webhook calls that run back to back into one round trip
+
+Within one turn the caller waits for every webhook call in turn: on the
+dob turn of a verification the agent calls `authenticate` on "# auth dob
+name", returns, and calls `find_appointments` on "* Get The Next Few
+Appointments" of Find Existing Appointment. When the second call's inputs
+are already known at the first call, both can go in one request with a
+combined tag ("authenticate+find_appointments"): the webhook runs the tags
+in order, each one seeing what the tags before it set, and its answer fans
+all their results out into session parameters (see
+`tools.webhook_stub.respond`).
+
+Every pair of calls that follow each other in a turn, with no other call
+between them, is checked on every enumerated path (`tools.paths`). The
+second call B moves onto the first call A when
+- A and B go to the same webhook and a webhook.error is handled the same
+  way at both
+- every B call is preceded by an A call it can join
+- nothing between A and B reads B's results or sets them
+- what sets B's inputs between A and B is a constant, which is preset on
+  A instead, and A does not read or produce it
+- on paths where A is not followed by B, B has no side effects and
+  nothing later reads what it returns (B runs speculatively there)
+
+Calls separated by a caller input can not be coalesced, the turn ends
+between them. What every tag reads and sets is declared in
+`TAG_CONTRACTS`, tags without a contract are left alone.
+
+The rewrite is checked with the simulator and the stub webhooks, and the
+round trips saved per conversation are reported:
+
+    cd src && python -m tools.coalesce_webhooks agent_graph.json \\
+        --output agent_graph.coalesced.json --round-trip-ms 120
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import utils
+from tools import collapse_pages, webhook_stub
+from tools.agent_graph import START_PAGE, AgentGraph, Fulfillment
+from tools.conversation_load import MAX_TURNS
+from tools.paths import (
+    MAX_STEPS,
+    MAX_VISITS,
+    Site,
+    enumerate_paths,
+    get_fulfillment,
+    set_fulfillment,
+)
+
+# network and CX overhead of one webhook round trip
+ROUND_TRIP_MS = 120.0
+MAX_ROUNDS = 4
+MAX_PATHS = 100000
+WEBHOOK_ERROR = utils.EventNames.WEBHOOK_ERROR.value
+
+
+class TagContract:
+    def __init__(
+        self,
+        *,
+        inputs: Optional[Set[str]],
+        outputs: Optional[Set[str]],
+        side_effects: bool = False,
+    ):
+        # None when the tag may read / set any session parameter
+        self.inputs = inputs
+        self.outputs = outputs
+        self.side_effects = side_effects
+
+
+PATIENT = {"name", "genesysPatientName", "dob_collection_dob"}
+SPANNER = TagContract(inputs=None, outputs=set(), side_effects=True)
+TAG_CONTRACTS: Dict[str, TagContract] = {
+    utils.WebHookTags.Authentication.value: TagContract(
+        inputs=PATIENT | {"ssn"},
+        outputs={"patientFound", "needToAskSsn"},
+    ),
+    "find_appointments": TagContract(
+        inputs=PATIENT
+        | {"appointment_date", "appointments_limit", "provider_name"},
+        outputs={
+            "appointments",
+            "num_appointments",
+            "num_appointments_on_date",
+            "first_appointment",
+            "second_appointment",
+            "third_appointment",
+        },
+    ),
+    "office_hours": TagContract(inputs=set(), outputs={"is_pac_open"}),
+    "conversation_started": SPANNER,
+    "human_escalate": SPANNER,
+    "success_path": SPANNER,
+    "need_extra_with_wait": SPANNER,
+}
+
+
+def contract(tag: Optional[str]) -> Optional[TagContract]:
+    """Contract of a tag, combined tags included."""
+    inputs: Optional[Set[str]] = set()
+    outputs: Optional[Set[str]] = set()
+    side_effects = False
+    for part in webhook_stub.split_tag(tag):
+        if part not in TAG_CONTRACTS:
+            return None
+        tag_contract = TAG_CONTRACTS[part]
+        if inputs is not None:
+            inputs = (
+                None
+                if tag_contract.inputs is None
+                else inputs | (tag_contract.inputs - (outputs or set()))
+            )
+        if outputs is not None:
+            outputs = (
+                None
+                if tag_contract.outputs is None
+                else outputs | tag_contract.outputs
+            )
+        side_effects = side_effects or tag_contract.side_effects
+    return TagContract(
+        inputs=inputs, outputs=outputs, side_effects=side_effects
+    )
+
+
+def _overlap(names: Optional[Set[str]], other: Set[str]) -> Set[str]:
+    return set(other) if names is None else names & other
+
+
+def _references(value: Any) -> Set[str]:
+    return set(collapse_pages.SESSION_REFERENCE.findall(json.dumps(value)))
+
+
+def describe_site(site: Site) -> str:
+    flow, owner, part, key = site
+    suffix = "" if key is None else f" {key}"
+    return f"{flow} / {owner} {part}{suffix}"
+
+
+class _Call:
+    def __init__(self, *, site: Site, webhook: str, tag: Optional[str]):
+        self.site = site
+        self.webhook = webhook
+        self.tag = tag
+
+
+def _operations(graph: AgentGraph, path) -> List[Tuple[str, Any]]:
+    """The path as ("read", names), ("write", presets), ("call", _Call)
+    and ("input", None), in the order CX runs them."""
+    operations: List[Tuple[str, Any]] = []
+    for kind, value in path.steps:
+        if kind == "input":
+            operations.append(("input", None))
+        elif kind == "route":
+            flow, owner, _ = value
+            routes = (
+                graph.flows[flow].routes
+                if owner == START_PAGE
+                else graph.get_page(flow, owner).routes
+            )
+            operations.append(
+                ("read", _references([route.condition for route in routes]))
+            )
+        elif kind == "fulfillment":
+            fulfillment = get_fulfillment(graph, value)
+            if fulfillment is None:
+                continue
+            # presets, then the webhook, then the messages
+            presets = fulfillment.set_parameters
+            operations.append(("read", _references(list(presets.values()))))
+            operations.append(("write", presets))
+            if fulfillment.webhook:
+                operations.append(
+                    (
+                        "call",
+                        _Call(
+                            site=value,
+                            webhook=fulfillment.webhook,
+                            tag=fulfillment.tag,
+                        ),
+                    )
+                )
+            operations.append(("read", _references(fulfillment.messages)))
+    return operations
+
+
+def _error_handler(graph: AgentGraph, site: Site):
+    flow, owner, _, _ = site
+    handlers = list(graph.flows[flow].event_handlers)
+    if owner != START_PAGE:
+        handlers = graph.get_page(flow, owner).event_handlers + handlers
+    for handler in handlers:
+        if handler.event == WEBHOOK_ERROR:
+            return flow, handler.to_dict()
+    return flow, None
+
+
+class Pair:
+    """Call A followed by call B in the same turn."""
+
+    def __init__(self, *, first: _Call, second: _Call):
+        self.first = first
+        self.second = second
+        # paths on which A is followed by B
+        self.joined = 0
+        self.hoisted: Dict[str, Any] = {}
+        self.blocked: Optional[str] = None
+
+    def block(self, reason: str):
+        self.blocked = self.blocked or reason
+
+
+class CoalesceAnalysis:
+    def __init__(self, graph: AgentGraph, *, pairs: List[Pair]):
+        self.graph = graph
+        self.pairs = pairs
+
+    def groups(self) -> List[List[Pair]]:
+        """Pairs to rewrite together: all the A calls in front of one B."""
+        by_second: Dict[Site, List[Pair]] = {}
+        for pair in self.pairs:
+            by_second.setdefault(pair.second.site, []).append(pair)
+        return [
+            pairs
+            for pairs in by_second.values()
+            if not any(pair.blocked for pair in pairs)
+        ]
+
+
+class _Occurrence:
+    def __init__(self, operations, first: int, second: Optional[int]):
+        self.operations = operations
+        self.first = first
+        self.second = second
+
+
+def analyze(
+    graph: AgentGraph,
+    *,
+    max_steps: int = MAX_STEPS,
+    max_visits: int = MAX_VISITS,
+    max_paths: int = MAX_PATHS,
+) -> CoalesceAnalysis:
+    # site -> every time it is called, with the next call in the turn
+    occurrences: Dict[Site, List[_Occurrence]] = {}
+    calls: Dict[Site, _Call] = {}
+    # B site -> sites of the calls right before it in the turn
+    previous: Dict[Site, Set[Optional[Site]]] = {}
+    for count, path in enumerate(
+        enumerate_paths(graph, max_steps=max_steps, max_visits=max_visits)
+    ):
+        if count >= max_paths:
+            utils.logger.warning(f"Stopped after {max_paths} paths")
+            break
+        operations = _operations(graph, path)
+        last: Optional[int] = None
+        for index, (kind, value) in enumerate(operations):
+            if kind == "input":
+                if last is not None:
+                    occurrences[operations[last][1].site].append(
+                        _Occurrence(operations, last, None)
+                    )
+                last = None
+            elif kind == "call":
+                calls.setdefault(value.site, value)
+                occurrences.setdefault(value.site, [])
+                previous.setdefault(value.site, set()).add(
+                    None if last is None else operations[last][1].site
+                )
+                if last is not None:
+                    occurrences[operations[last][1].site].append(
+                        _Occurrence(operations, last, index)
+                    )
+                last = index
+        if last is not None:
+            occurrences[operations[last][1].site].append(
+                _Occurrence(operations, last, None)
+            )
+
+    pairs = []
+    for second_site, first_sites in previous.items():
+        for first_site in first_sites:
+            if first_site is None:
+                continue
+            pair = Pair(first=calls[first_site], second=calls[second_site])
+            if None in first_sites:
+                pair.block(
+                    "the second call also runs without the first before it"
+                )
+            _check_pair(graph, pair, occurrences[first_site])
+            pairs.append(pair)
+    return CoalesceAnalysis(graph, pairs=pairs)
+
+
+def _check_pair(graph: AgentGraph, pair: Pair, occurrences: List[_Occurrence]):
+    first, second = pair.first, pair.second
+    if first.webhook != second.webhook:
+        pair.block(f"different webhooks {first.webhook}, {second.webhook}")
+    if _error_handler(graph, first.site) != _error_handler(graph, second.site):
+        pair.block("webhook.error is handled differently")
+    first_contract, second_contract = contract(first.tag), contract(second.tag)
+    if first_contract is None or second_contract is None:
+        pair.block("no contract for the tag")
+        return
+    if second_contract.outputs is None:
+        pair.block(f"{second.tag} may set any parameter")
+        return
+    outputs = second_contract.outputs
+
+    alone = []
+    for occurrence in occurrences:
+        if occurrence.second is None:
+            alone.append(occurrence)
+            continue
+        next_call = occurrence.operations[occurrence.second][1]
+        if next_call.site != second.site:
+            pair.block(
+                f"{first.tag} is followed by {next_call.tag} on other paths"
+            )
+            continue
+        pair.joined += 1
+        reads: Set[str] = set()
+        writes: Dict[str, Any] = {}
+        start, end = occurrence.first + 1, occurrence.second
+        between = occurrence.operations[start:end]
+        for kind, value in between:
+            if kind == "read":
+                reads |= value
+            elif kind == "write":
+                writes.update(value)
+        if outputs & reads:
+            pair.block(f"{sorted(outputs & reads)} read before {second.tag}")
+        if outputs & set(writes):
+            pair.block(f"{sorted(outputs & set(writes))} set in between")
+        for name in _overlap(second_contract.inputs, set(writes)):
+            value = writes[name]
+            if _references(value):
+                pair.block(f"{name} is computed before {second.tag}")
+            elif pair.hoisted.get(name, value) != value:
+                pair.block(f"{name} is set to different values")
+            else:
+                pair.hoisted[name] = value
+        hoisted = set(pair.hoisted)
+        if hoisted & reads:
+            pair.block(f"{sorted(hoisted & reads)} read in between")
+    hoisted = set(pair.hoisted)
+    if _overlap(first_contract.outputs, hoisted) or _overlap(
+        first_contract.inputs, hoisted
+    ):
+        pair.block(f"{first.tag} uses {sorted(hoisted)}")
+
+    for occurrence in alone:
+        if second_contract.side_effects:
+            pair.block(
+                f"{second.tag} has side effects and does not always follow"
+            )
+            break
+        later: Set[str] = set()
+        start = occurrence.first + 1
+        for kind, value in occurrence.operations[start:]:
+            if kind == "read":
+                later |= value
+        if later & (outputs | hoisted):
+            pair.block(
+                f"{sorted(later & (outputs | hoisted))} read later on paths "
+                f"without {second.tag}"
+            )
+            break
+
+
+def _copy(graph: AgentGraph, site: Site) -> Fulfillment:
+    fulfillment = get_fulfillment(graph, site)
+    if fulfillment is None:
+        # the analysis found a webhook call there
+        raise ValueError(f"No fulfillment at {site}")
+    return Fulfillment.from_dict(fulfillment.to_dict())
+
+
+def rewrite(graph: AgentGraph, groups: List[List[Pair]]) -> List[Pair]:
+    """Apply the groups whose sites no other applied group touches."""
+    touched: Set[Site] = set()
+    applied = []
+    for pairs in groups:
+        sites = {pair.first.site for pair in pairs} | {pairs[0].second.site}
+        if sites & touched:
+            continue
+        touched |= sites
+        second = pairs[0].second
+        for pair in pairs:
+            fulfillment = _copy(graph, pair.first.site)
+            fulfillment.tag = (
+                f"{fulfillment.tag}{webhook_stub.TAG_SEPARATOR}{second.tag}"
+            )
+            fulfillment.set_parameters = {
+                **fulfillment.set_parameters,
+                **pair.hoisted,
+            }
+            set_fulfillment(graph, pair.first.site, fulfillment)
+            applied.append(pair)
+        fulfillment = _copy(graph, second.site)
+        fulfillment.webhook = fulfillment.tag = None
+        set_fulfillment(
+            graph,
+            second.site,
+            None if fulfillment.is_empty() else fulfillment,
+        )
+    return applied
+
+
+class CoalesceResult:
+    def __init__(self, *, graph: AgentGraph):
+        self.graph = graph
+        self.applied: List[Pair] = []
+        # the pairs left alone, from the last analysis
+        self.blocked: List[Pair] = []
+
+
+def coalesce(
+    graph: AgentGraph,
+    *,
+    max_rounds: int = MAX_ROUNDS,
+    max_steps: int = MAX_STEPS,
+    max_visits: int = MAX_VISITS,
+    max_paths: int = MAX_PATHS,
+) -> CoalesceResult:
+    """Rewrite a copy of the graph until no pair is left to coalesce."""
+    result = CoalesceResult(graph=AgentGraph.from_dict(graph.to_dict()))
+    for _ in range(max_rounds):
+        analysis = analyze(
+            result.graph,
+            max_steps=max_steps,
+            max_visits=max_visits,
+            max_paths=max_paths,
+        )
+        result.blocked = [pair for pair in analysis.pairs if pair.blocked]
+        applied = rewrite(result.graph, analysis.groups())
+        if not applied:
+            break
+        result.applied.extend(applied)
+    return result
+
+
+def verify(
+    original: AgentGraph,
+    coalesced: CoalesceResult,
+    *,
+    sessions: int = 200,
+    seed: int = 0,
+    max_turns: int = MAX_TURNS,
+) -> Tuple[List[int], int, int]:
+    """Conversations that differ, and webhook round trips before / after."""
+    # parameters a speculative call may leave behind where it did not run
+    ignore: Set[str] = set()
+    for pair in coalesced.applied:
+        ignore |= set(pair.hoisted)
+        second_contract = contract(pair.second.tag)
+        if second_contract is not None:
+            ignore |= second_contract.outputs or set()
+    mismatches = []
+    before_calls = after_calls = 0
+    for number in range(sessions):
+        before = collapse_pages.simulate_caller(
+            original, number, seed=seed, max_turns=max_turns
+        )
+        after = collapse_pages.simulate_caller(
+            coalesced.graph, number, seed=seed, max_turns=max_turns
+        )
+        if not collapse_pages.same_behaviour(before, after, ignore):
+            mismatches.append(number)
+        before_calls += sum(len(calls) for calls in before.webhook_calls)
+        after_calls += sum(len(calls) for calls in after.webhook_calls)
+    return mismatches, before_calls, after_calls
+
+
+def print_report(
+    result: CoalesceResult,
+    mismatches: List[int],
+    before_calls: int,
+    after_calls: int,
+    sessions: int,
+    round_trip_ms: float,
+):
+    for pair in result.applied:
+        hoisted = f", presets {sorted(pair.hoisted)}" if pair.hoisted else ""
+        print(
+            f"coalesced {pair.first.tag} + {pair.second.tag} "
+            f"({pair.joined} paths{hoisted})\n"
+            f"    {describe_site(pair.first.site)}\n"
+            f"    {describe_site(pair.second.site)}"
+        )
+    for pair in result.blocked:
+        print(
+            f"left {pair.first.tag} -> {pair.second.tag}: {pair.blocked}\n"
+            f"    {describe_site(pair.first.site)}\n"
+            f"    {describe_site(pair.second.site)}"
+        )
+    saved = (before_calls - after_calls) / max(sessions, 1)
+    print(
+        f"webhook round trips per conversation "
+        f"{before_calls / max(sessions, 1):.2f} -> "
+        f"{after_calls / max(sessions, 1):.2f}, "
+        f"~{saved * round_trip_ms:.0f} ms less waiting per conversation"
+    )
+    if mismatches:
+        print(
+            f"BEHAVIOUR CHANGED in {len(mismatches)} of {sessions} "
+            f"conversations, eg caller {mismatches[0]}"
+        )
+    else:
+        print(f"same behaviour in {sessions} simulated conversations")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument("--output", help="write the rewritten graph here")
+    parser.add_argument("--round-trip-ms", type=float, default=ROUND_TRIP_MS)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--max-visits", type=int, default=MAX_VISITS)
+    parser.add_argument("--max-paths", type=int, default=MAX_PATHS)
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    result = coalesce(
+        graph,
+        max_steps=args.max_steps,
+        max_visits=args.max_visits,
+        max_paths=args.max_paths,
+    )
+    mismatches, before_calls, after_calls = verify(
+        graph, result, sessions=args.sessions, seed=args.seed
+    )
+    if args.output and not mismatches:
+        result.graph.save(args.output)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "coalesced": [
+                        {
+                            "first": describe_site(pair.first.site),
+                            "second": describe_site(pair.second.site),
+                            "tag": f"{pair.first.tag}+{pair.second.tag}",
+                            "hoisted": pair.hoisted,
+                        }
+                        for pair in result.applied
+                    ],
+                    "blocked": [
+                        {
+                            "first": describe_site(pair.first.site),
+                            "second": describe_site(pair.second.site),
+                            "reason": pair.blocked,
+                        }
+                        for pair in result.blocked
+                    ],
+                    "round_trips_before": before_calls,
+                    "round_trips_after": after_calls,
+                    "mismatches": mismatches,
+                },
+                default=str,
+            )
+        )
+    else:
+        print_report(
+            result,
+            mismatches,
+            before_calls,
+            after_calls,
+            args.sessions,
+            args.round_trip_ms,
+        )
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
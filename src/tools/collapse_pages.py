@@ -0,0 +1,543 @@
+"""
+Collapse silent set-parameter page chains in the agent graph
+
+A silent page only presets parameters on entry and leaves through condition
+routes, it plays nothing, calls no webhook and collects nothing
+("- Extract 1st of All Appointments", "- Set Appointment ID to First
+Appointment", ...). Every one of them still costs a page transition at
+runtime. This pass points the routes into a silent page straight at where
+the page would send the caller: the page's presets and the fulfillment of
+its route are merged into the route's trigger fulfillment, and the
+conditions are combined:
+
+    * Get The Next Few Appointments
+        num_appointments >= 1                   -> - Extract 1st ...
+    - Extract 1st of All Appointments (first_appointment = GET(...))
+        num_appointments_on_date = 1            -> > Describe 1 Appointment
+        num_appointments_on_date >= 2           -> - Extract 2nd ...
+
+becomes
+
+    * Get The Next Few Appointments
+        num_appointments >= 1 AND num_appointments_on_date = 1
+            -> > Describe 1 Appointment, presets first_appointment
+        num_appointments >= 1 AND num_appointments_on_date >= 2 AND ...
+            -> (- Extract 2nd ... collapsed the same way)
+        num_appointments >= 1                   -> - Extract 1st ...
+
+The last route keeps the original hop for when none of the page's routes
+match, so the caller waits on the silent page exactly as before. Intent
+routes and event handlers are only collapsed into a page that always
+leaves through its first route. A page is not collapsed when its routes
+depend on a parameter the merged presets set, use $page parameters, call
+a webhook, enter a flow (the flow would return to a different page) or go
+to CURRENT_PAGE / PREVIOUS_PAGE. Silent pages nothing points to anymore
+are removed.
+
+The rewrite is checked with the simulator: the same callers, answered by
+the stub webhooks, must get the same prompts, webhook calls, events, end
+state and session parameters from both graphs. The page transitions that
+saved are reported per flow:
+
+    cd src && python -m tools.collapse_pages agent_graph.json \\
+        --output agent_graph.collapsed.json --sessions 500
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from tools import conversation_load, webhook_stub
+from tools.agent_graph import (
+    AgentGraph,
+    EventHandler,
+    Flow,
+    Fulfillment,
+    Page,
+    Route,
+)
+from tools.paths import is_always_true
+from tools.simulator import SimulationError, Simulator
+
+SESSION_REFERENCE = re.compile(r"\$session\.params\.([\w-]+)")
+PAGE_REFERENCE = re.compile(r"\$page\.params\b")
+UNSUPPORTED_TARGETS = {"CURRENT_PAGE", "PREVIOUS_PAGE"}
+# routes one route may be rewritten into before it is left alone
+MAX_ROUTES = 16
+# share of turns a verification caller stays silent
+NO_INPUT_RATE = 0.15
+
+
+def _references(value: Any) -> Set[str]:
+    return set(SESSION_REFERENCE.findall(json.dumps(value)))
+
+
+def _and(first: str, second: str) -> str:
+    if is_always_true(first):
+        return second
+    if is_always_true(second):
+        return first
+    parts = [
+        f"({condition})" if " OR " in condition.upper() else condition
+        for condition in (first, second)
+    ]
+    return " AND ".join(parts)
+
+
+def _merge(*fulfillments: Optional[Fulfillment]) -> Optional[Fulfillment]:
+    merged = Fulfillment()
+    for fulfillment in fulfillments:
+        if fulfillment is None:
+            continue
+        merged.messages = merged.messages + fulfillment.messages
+        merged.set_parameters = {
+            **merged.set_parameters,
+            **fulfillment.set_parameters,
+        }
+    return None if merged.is_empty() else merged
+
+
+def is_silent(page: Page) -> bool:
+    """Presets at most, and leaves through condition routes only."""
+    entry = page.entry_fulfillment
+    return (
+        not page.form
+        and not (entry and (entry.messages or entry.webhook or entry.tag))
+        and bool(page.routes)
+        and all(route.condition and not route.intent for route in page.routes)
+    )
+
+
+def exits(page: Page) -> List[Route]:
+    """The routes a page can leave through, up to the first always true."""
+    routes = []
+    for route in page.routes:
+        routes.append(route)
+        if is_always_true(route.condition):
+            break
+    return routes
+
+
+class CollapseResult:
+    def __init__(self, *, graph: AgentGraph):
+        self.graph = graph
+        # flow -> routes and event handlers rewritten
+        self.rewritten: Dict[str, int] = {}
+        # flow -> silent pages removed
+        self.removed: Dict[str, List[str]] = {}
+
+
+class PageCollapser:
+    def __init__(self, graph: AgentGraph, *, max_routes: int = MAX_ROUTES):
+        # pages are read from the original graph, rewrites go to a copy
+        self.graph = graph
+        self.max_routes = max_routes
+
+    def collapse(self) -> CollapseResult:
+        result = CollapseResult(
+            graph=AgentGraph.from_dict(self.graph.to_dict())
+        )
+        for flow in result.graph.flows.values():
+            # rewrites per owner page, None for the flow itself
+            rewritten: Dict[Optional[str], int] = {
+                None: self._collapse_owner(flow, flow.routes, [])
+            }
+            for page in flow.pages.values():
+                rewritten[page.name] = self._collapse_owner(
+                    flow, page.routes, page.event_handlers
+                ) + sum(
+                    self._collapse_owner(
+                        flow, [], parameter.reprompt_event_handlers
+                    )
+                    for parameter in page.form
+                )
+            rewritten[None] += self._collapse_owner(
+                flow, [], flow.event_handlers
+            )
+            removed = self._remove_unreferenced(flow)
+            # rewrites inside removed pages never run
+            for page in removed:
+                del rewritten[page.name]
+            if sum(rewritten.values()):
+                result.rewritten[flow.name] = sum(rewritten.values())
+            if removed:
+                result.removed[flow.name] = [page.name for page in removed]
+        return result
+
+    def _silent_page(self, flow: Flow, target: Optional[str]):
+        original = self.graph.flows[flow.name]
+        if target not in original.pages:
+            return None
+        page = original.pages[target]
+        return page if is_silent(page) else None
+
+    def _collapse_owner(
+        self,
+        flow: Flow,
+        routes: List[Route],
+        handlers: list,
+    ) -> int:
+        rewritten = 0
+        collapsed_routes: List[Route] = []
+        for route in routes:
+            expanded = self._expand_route(flow, route, frozenset())
+            if expanded is None:
+                collapsed_routes.append(route)
+            else:
+                collapsed_routes.extend(expanded)
+                rewritten += 1
+        routes[:] = collapsed_routes
+        for index, handler in enumerate(handlers):
+            collapsed = self._expand_unconditional(flow, handler, frozenset())
+            if collapsed is not None:
+                handlers[index] = collapsed
+                rewritten += 1
+        return rewritten
+
+    def _can_bypass(
+        self,
+        flow: Flow,
+        page: Page,
+        fulfillment: Optional[Fulfillment],
+    ) -> bool:
+        if fulfillment and (fulfillment.webhook or fulfillment.tag):
+            return False
+        presets = dict(fulfillment.set_parameters) if fulfillment else {}
+        entry = page.entry_fulfillment
+        if entry:
+            if _references(entry.set_parameters) & set(presets):
+                return False
+            presets.update(entry.set_parameters)
+        for route in exits(page):
+            target = route.target_page
+            if (
+                route.target_flow
+                or not target
+                or target in UNSUPPORTED_TARGETS
+                or PAGE_REFERENCE.search(route.condition or "")
+                or _references(route.condition) & set(presets)
+            ):
+                return False
+            trigger = route.trigger_fulfillment
+            if trigger and (
+                trigger.webhook
+                or trigger.tag
+                or _references(trigger.set_parameters) & set(presets)
+            ):
+                return False
+            if self._returns_to_previous(flow, target):
+                return False
+        return True
+
+    def _returns_to_previous(self, flow: Flow, target: str) -> bool:
+        # the page after the silent one would go back to a different page
+        page = self.graph.flows[flow.name].pages.get(target)
+        if page is None:
+            return False
+        owners: List[Sequence[Union[Route, EventHandler]]] = [
+            page.routes,
+            page.event_handlers,
+        ]
+        owners.extend(
+            parameter.reprompt_event_handlers for parameter in page.form
+        )
+        return any(
+            item.target_page == "PREVIOUS_PAGE"
+            for items in owners
+            for item in items
+        )
+
+    def _expand_route(
+        self, flow: Flow, route: Route, seen: frozenset
+    ) -> Optional[List[Route]]:
+        page = self._silent_page(flow, route.target_page)
+        if page is None or page.name in seen:
+            return None
+        if not route.intent and not route.condition:
+            # never taken without an intent or a condition
+            return None
+        if route.intent:
+            collapsed = self._expand_unconditional(flow, route, seen)
+            return None if collapsed is None else [collapsed]
+        if not self._can_bypass(flow, page, route.trigger_fulfillment):
+            return None
+
+        expanded: List[Route] = []
+        for exit_route in exits(page):
+            hop = Route(
+                condition=_and(
+                    route.condition or "", exit_route.condition or ""
+                ),
+                target_page=exit_route.target_page,
+                trigger_fulfillment=_merge(
+                    route.trigger_fulfillment,
+                    page.entry_fulfillment,
+                    exit_route.trigger_fulfillment,
+                ),
+            )
+            expanded.extend(
+                self._expand_route(flow, hop, seen | {page.name}) or [hop]
+            )
+        if not is_always_true(exits(page)[-1].condition):
+            # none of the page's routes matched, wait on it as before
+            expanded.append(route)
+        if len(expanded) > self.max_routes:
+            return None
+        return expanded
+
+    def _expand_unconditional(self, flow: Flow, item, seen: frozenset):
+        """Collapse an intent route or event handler, or None."""
+        page = self._silent_page(flow, item.target_page)
+        if page is None or page.name in seen:
+            return None
+        exit_routes = exits(page)
+        if len(exit_routes) != 1 or not is_always_true(
+            exit_routes[0].condition
+        ):
+            return None
+        if not self._can_bypass(flow, page, item.trigger_fulfillment):
+            return None
+
+        collapsed = type(item).from_dict(item.to_dict())
+        collapsed.target_page = exit_routes[0].target_page
+        collapsed.trigger_fulfillment = _merge(
+            item.trigger_fulfillment,
+            page.entry_fulfillment,
+            exit_routes[0].trigger_fulfillment,
+        )
+        return (
+            self._expand_unconditional(flow, collapsed, seen | {page.name})
+            or collapsed
+        )
+
+    def _referenced(self, flow: Flow) -> Set[str]:
+        owners: List[Sequence[Union[Route, EventHandler]]] = [
+            flow.routes,
+            flow.event_handlers,
+        ]
+        for page in flow.pages.values():
+            owners.extend([page.routes, page.event_handlers])
+            owners.extend(
+                parameter.reprompt_event_handlers for parameter in page.form
+            )
+        return {
+            item.target_page
+            for items in owners
+            for item in items
+            if item.target_page
+        }
+
+    def _remove_unreferenced(self, flow: Flow) -> List[Page]:
+        removed: List[Page] = []
+        while True:
+            referenced = self._referenced(flow)
+            unused = [
+                page
+                for page in flow.pages.values()
+                if page.name not in referenced
+                and self._silent_page(flow, page.name) is not None
+                # only pages this pass bypassed, not ones that were
+                # unreferenced to begin with
+                and page.name in self._referenced(self.graph.flows[flow.name])
+            ]
+            if not unused:
+                return removed
+            for page in unused:
+                del flow.pages[page.name]
+            removed.extend(unused)
+
+
+def collapse_pages(
+    graph: AgentGraph, *, max_routes: int = MAX_ROUTES
+) -> CollapseResult:
+    return PageCollapser(graph, max_routes=max_routes).collapse()
+
+
+class CallerRun:
+    """What one simulated caller went through."""
+
+    def __init__(self):
+        # (messages, events) and the webhook calls of every turn
+        self.turns: List[Tuple[List[Any], List[str]]] = []
+        self.webhook_calls: List[List[Tuple[str, Optional[str]]]] = []
+        # pages entered per flow
+        self.pages: Dict[str, int] = {}
+        self.end_state: Optional[str] = None
+        self.params: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+
+def simulate_caller(
+    graph: AgentGraph,
+    number: int,
+    *,
+    seed: int = 0,
+    max_turns: int = conversation_load.MAX_TURNS,
+) -> CallerRun:
+    """Caller `number` picks intents at random and answers every form.
+
+    Callers only depend on `number` and `seed`, so two graphs can be
+    compared caller by caller.
+    """
+    webhook = webhook_stub.StubWebhook(f"verify-{number}")
+    simulator = Simulator(graph, webhook=webhook)
+    # the same caller for both graphs, not a secret
+    generator = random.Random(seed * 1000003 + number)  # nosec B311
+    persona = {**conversation_load.PERSONA, "name": f"Caller {number}"}
+    session = simulator.start()
+    run = CallerRun()
+    turn: Dict[str, Any] = conversation_load.OPENING_TURN
+    try:
+        for _ in range(max_turns):
+            result = simulator.send(session, turn)
+            run.turns.append((result.messages, result.events))
+            run.webhook_calls.append(result.webhook_calls)
+            for flow, _ in result.pages:
+                run.pages[flow] = run.pages.get(flow, 0) + 1
+            if session.ended:
+                break
+            awaiting, intents = simulator.expected_input(session)
+            if awaiting is not None:
+                value = persona.get(awaiting, conversation_load.DEFAULT_ANSWER)
+                turn = {"parameters": {awaiting: value}}
+            elif intents and generator.random() >= NO_INPUT_RATE:
+                turn = {"intent": generator.choice(intents)}
+            else:
+                turn = {"event": "no-input"}
+    except SimulationError as error:
+        run.error = str(error)
+    run.end_state = session.end_state
+    run.params = session.params
+    return run
+
+
+def same_behaviour(
+    before: CallerRun, after: CallerRun, ignore: Optional[Set[str]] = None
+) -> bool:
+    """Same prompts, events, end state and parameters, but for `ignore`."""
+    ignore = ignore or set()
+
+    def observed(run: CallerRun) -> str:
+        params = {k: v for k, v in run.params.items() if k not in ignore}
+        return json.dumps(
+            [run.turns, run.end_state, params, run.error], default=str
+        )
+
+    return observed(before) == observed(after)
+
+
+def verify(
+    original: AgentGraph,
+    collapsed: AgentGraph,
+    *,
+    sessions: int = 200,
+    seed: int = 0,
+    max_turns: int = conversation_load.MAX_TURNS,
+) -> Tuple[List[int], Dict[str, Tuple[int, int]]]:
+    """Conversations that differ, and (before, after) pages per flow."""
+    mismatches = []
+    pages: Dict[str, Tuple[int, int]] = {}
+    for number in range(sessions):
+        before = simulate_caller(
+            original, number, seed=seed, max_turns=max_turns
+        )
+        after = simulate_caller(
+            collapsed, number, seed=seed, max_turns=max_turns
+        )
+        if (
+            not same_behaviour(before, after)
+            or before.webhook_calls != after.webhook_calls
+        ):
+            mismatches.append(number)
+        for flow in set(before.pages) | set(after.pages):
+            total_before, total_after = pages.get(flow, (0, 0))
+            pages[flow] = (
+                total_before + before.pages.get(flow, 0),
+                total_after + after.pages.get(flow, 0),
+            )
+    return mismatches, pages
+
+
+def print_report(
+    result: CollapseResult,
+    mismatches: List[int],
+    pages: Dict[str, Tuple[int, int]],
+    sessions: int,
+):
+    print(
+        f"{'flow':<32}{'rewritten':>10}{'removed':>9}"
+        f"{'hops before':>13}{'hops after':>12}{'saved':>8}"
+    )
+    flows = sorted(set(result.rewritten) | set(result.removed) | set(pages))
+    for flow in flows:
+        before, after = pages.get(flow, (0, 0))
+        print(
+            f"{flow:<32}{result.rewritten.get(flow, 0):>10}"
+            f"{len(result.removed.get(flow, [])):>9}"
+            f"{before:>13}{after:>12}{before - after:>8}"
+        )
+    for flow, removed in sorted(result.removed.items()):
+        for page in removed:
+            print(f"removed {flow} / {page}")
+    if mismatches:
+        print(
+            f"BEHAVIOUR CHANGED in {len(mismatches)} of {sessions} "
+            f"conversations, eg caller {mismatches[0]}"
+        )
+    else:
+        print(f"same behaviour in {sessions} simulated conversations")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument("--output", help="write the collapsed graph here")
+    parser.add_argument("--max-routes", type=int, default=MAX_ROUTES)
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=200,
+        help="simulated conversations to check the rewrite with",
+    )
+    parser.add_argument(
+        "--max-turns", type=int, default=conversation_load.MAX_TURNS
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    result = collapse_pages(graph, max_routes=args.max_routes)
+    mismatches, pages = verify(
+        graph,
+        result.graph,
+        sessions=args.sessions,
+        seed=args.seed,
+        max_turns=args.max_turns,
+    )
+    if args.output and not mismatches:
+        result.graph.save(args.output)
+    if args.json:
+        report = {
+            flow: {
+                "rewritten": result.rewritten.get(flow, 0),
+                "removed": result.removed.get(flow, []),
+                "hops_before": pages.get(flow, (0, 0))[0],
+                "hops_after": pages.get(flow, (0, 0))[1],
+            }
+            for flow in sorted(
+                set(result.rewritten) | set(result.removed) | set(pages)
+            )
+        }
+        print(json.dumps({"flows": report, "mismatches": mismatches}))
+    else:
+        print_report(result, mismatches, pages, args.sessions)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Compact, array backed form of the agent graph for whole-agent analyses
+
+`AgentGraph` keeps every flow, page, route and fulfillment as its own
+Python object, which is convenient to edit but slow to walk and heavy on
+memory once an agent has thousands of pages. `CompactGraph` is built once
+from an `AgentGraph` and holds the same structure as flat arrays:
+
+- flows and pages are nodes with integer ids, the START page of a flow
+  is a node as well, so flow level routes and event handlers are simply
+  the ones of that node
+- routes, event handlers and form parameters are CSR adjacency arrays:
+  the ones of node n are `offsets[n]` up to `offsets[n + 1]`
+- names, conditions, intents, events and fulfillments are interned
+  tables, the arrays hold their ids
+
+Targets are a (kind, value) pair: a node for pages and flows, an interned
+name for symbolic pages (END_FLOW, PREVIOUS_PAGE, ...) and for pages or
+flows that do not exist. The arrays pickle cheaply, so the graph can be
+sent to worker processes.
+
+Print the size of an agent and its structural problems (pages nothing
+leads to, routes to pages or flows that do not exist):
+
+    cd src && python -m tools.compact_graph agent_graph.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from array import array
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from tools.agent_graph import START_PAGE, SYMBOLIC_TARGETS, AgentGraph
+
+NONE = -1
+
+# target kinds
+TARGET_NONE = 0
+TARGET_NODE = 1
+TARGET_FLOW = 2
+TARGET_SYMBOLIC = 3
+TARGET_MISSING_PAGE = 4
+TARGET_MISSING_FLOW = 5
+
+T = TypeVar("T")
+
+
+class Interner(Generic[T]):
+    """Table of distinct values, each known by its index."""
+
+    def __init__(self):
+        self.values: List[T] = []
+        self._ids: Dict[Any, int] = {}
+
+    def intern(self, value: T, key: Any = None) -> int:
+        # `key` for values that are not hashable themselves
+        key = value if key is None else key
+        index = self._ids.get(key)
+        if index is None:
+            index = self._ids[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def get(self, key: Any) -> int:
+        return self._ids.get(key, NONE)
+
+    def __getitem__(self, index: int) -> T:
+        return self.values[index]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class CompactFulfillment:
+    """What the analyses need of a fulfillment."""
+
+    def __init__(
+        self,
+        *,
+        webhook: Optional[str],
+        tag: Optional[str],
+        messages: Tuple[Any, ...],
+    ):
+        self.webhook = webhook
+        self.tag = tag
+        self.messages = messages
+
+
+def _fulfillment_key(fulfillment) -> str:
+    return json.dumps(
+        [fulfillment.webhook, fulfillment.tag, fulfillment.messages],
+        sort_keys=True,
+        default=str,
+    )
+
+
+class CompactGraph:
+    def __init__(self):
+        self.names: Interner[str] = Interner()
+        self.conditions: Interner[str] = Interner()
+        self.intents: Interner[str] = Interner()
+        self.events: Interner[str] = Interner()
+        self.fulfillments: Interner[CompactFulfillment] = Interner()
+
+        self.flow_names: List[str] = []
+        # node of the START page of every flow
+        self.flow_start = array("i")
+        self.start_flow = NONE
+
+        self.node_flow = array("i")
+        # name id, START for the START node
+        self.node_name = array("i")
+        self.node_entry = array("i")
+
+        self.route_offsets = array("i", [0])
+        self.route_intent = array("i")
+        self.route_condition = array("i")
+        self.route_target_kind = array("b")
+        self.route_target = array("i")
+        self.route_fulfillment = array("i")
+
+        self.handler_offsets = array("i", [0])
+        self.handler_event = array("i")
+        self.handler_target_kind = array("b")
+        self.handler_target = array("i")
+        self.handler_fulfillment = array("i")
+
+        self.form_offsets = array("i", [0])
+        self.form_parameter = array("i")
+        self.form_required = array("b")
+        self.form_prompt = array("i")
+
+        # per condition id, whether it is "true" or empty
+        self.condition_always_true = array("b")
+
+        self._flows: Dict[str, int] = {}
+        self._nodes: Dict[Tuple[int, int], int] = {}
+
+    @classmethod
+    def from_graph(cls, graph: AgentGraph) -> "CompactGraph":
+        compact = cls()
+        # nodes first, so targets can be resolved in one pass
+        for flow in graph.flows.values():
+            flow_id = len(compact.flow_names)
+            compact._flows[flow.name] = flow_id
+            compact.flow_names.append(flow.name)
+            compact.flow_start.append(compact._add_node(flow_id, START_PAGE))
+            for page_name in flow.pages:
+                compact._add_node(flow_id, page_name)
+        compact.start_flow = compact._flows.get(graph.start_flow, NONE)
+
+        for flow in graph.flows.values():
+            flow_id = compact._flows[flow.name]
+            compact._add_edges(flow_id, None, flow.routes, flow.event_handlers)
+            for page in flow.pages.values():
+                compact._add_edges(
+                    flow_id, page, page.routes, page.event_handlers
+                )
+        return compact
+
+    def _add_node(self, flow_id: int, page_name: str) -> int:
+        node = len(self.node_flow)
+        name_id = self.names.intern(page_name)
+        self._nodes[(flow_id, name_id)] = node
+        self.node_flow.append(flow_id)
+        self.node_name.append(name_id)
+        return node
+
+    def _fulfillment(self, fulfillment) -> int:
+        if fulfillment is None:
+            return NONE
+        return self.fulfillments.intern(
+            CompactFulfillment(
+                webhook=fulfillment.webhook,
+                tag=fulfillment.tag,
+                messages=tuple(fulfillment.messages),
+            ),
+            _fulfillment_key(fulfillment),
+        )
+
+    def _condition(self, condition: Optional[str]) -> int:
+        if not condition:
+            return NONE
+        index = self.conditions.intern(condition)
+        if index == len(self.condition_always_true):
+            self.condition_always_true.append(
+                condition.strip().lower() == "true"
+            )
+        return index
+
+    def _target(self, flow_id: int, item) -> Tuple[int, int]:
+        if item.target_flow:
+            flow = self._flows.get(item.target_flow)
+            if flow is None:
+                return TARGET_MISSING_FLOW, self.names.intern(item.target_flow)
+            return TARGET_FLOW, flow
+        if item.target_page:
+            if item.target_page in SYMBOLIC_TARGETS:
+                return TARGET_SYMBOLIC, self.names.intern(item.target_page)
+            node = NONE
+            if item.target_page != START_PAGE:
+                node = self._nodes.get(
+                    (flow_id, self.names.get(item.target_page)), NONE
+                )
+            if node == NONE:
+                return TARGET_MISSING_PAGE, self.names.intern(item.target_page)
+            return TARGET_NODE, node
+        return TARGET_NONE, NONE
+
+    def _add_edges(self, flow_id: int, page, routes, handlers):
+        if page is None:
+            self.node_entry.append(NONE)
+        else:
+            self.node_entry.append(self._fulfillment(page.entry_fulfillment))
+            for parameter in page.form:
+                self.form_parameter.append(self.names.intern(parameter.name))
+                self.form_required.append(parameter.required)
+                self.form_prompt.append(
+                    self._fulfillment(parameter.initial_prompt)
+                )
+        self.form_offsets.append(len(self.form_parameter))
+
+        for route in routes:
+            self.route_intent.append(
+                self.intents.intern(route.intent) if route.intent else NONE
+            )
+            self.route_condition.append(self._condition(route.condition))
+            kind, target = self._target(flow_id, route)
+            self.route_target_kind.append(kind)
+            self.route_target.append(target)
+            self.route_fulfillment.append(
+                self._fulfillment(route.trigger_fulfillment)
+            )
+        self.route_offsets.append(len(self.route_intent))
+
+        for handler in handlers:
+            self.handler_event.append(self.events.intern(handler.event))
+            kind, target = self._target(flow_id, handler)
+            self.handler_target_kind.append(kind)
+            self.handler_target.append(target)
+            self.handler_fulfillment.append(
+                self._fulfillment(handler.trigger_fulfillment)
+            )
+        self.handler_offsets.append(len(self.handler_event))
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_flow)
+
+    def node(self, flow_name: str, page_name: str = START_PAGE) -> int:
+        flow_id = self._flows.get(flow_name, NONE)
+        return self._nodes.get((flow_id, self.names.get(page_name)), NONE)
+
+    def flow_of(self, node: int) -> str:
+        return self.flow_names[self.node_flow[node]]
+
+    def page_of(self, node: int) -> str:
+        return self.names[self.node_name[node]]
+
+    def key(self, node: int) -> Tuple[str, str]:
+        return self.flow_of(node), self.page_of(node)
+
+    def is_start(self, node: int) -> bool:
+        return self.flow_start[self.node_flow[node]] == node
+
+    def routes(self, node: int) -> range:
+        return range(self.route_offsets[node], self.route_offsets[node + 1])
+
+    def handlers(self, node: int) -> range:
+        return range(
+            self.handler_offsets[node], self.handler_offsets[node + 1]
+        )
+
+    def form(self, node: int) -> range:
+        return range(self.form_offsets[node], self.form_offsets[node + 1])
+
+    def is_unconditional(self, route: int) -> bool:
+        """A route without intent that is always taken when reached."""
+        if self.route_intent[route] != NONE:
+            return False
+        condition = self.route_condition[route]
+        return condition == NONE or bool(self.condition_always_true[condition])
+
+    def _target_node(self, kind: int, target: int) -> int:
+        if kind == TARGET_NODE:
+            return target
+        if kind == TARGET_FLOW:
+            return self.flow_start[target]
+        return NONE
+
+    def successors(self, node: int) -> List[int]:
+        """Nodes the routes and event handlers of `node` lead to."""
+        nodes = [
+            self._target_node(
+                self.route_target_kind[route], self.route_target[route]
+            )
+            for route in self.routes(node)
+        ] + [
+            self._target_node(
+                self.handler_target_kind[handler], self.handler_target[handler]
+            )
+            for handler in self.handlers(node)
+        ]
+        return [n for n in nodes if n != NONE]
+
+    def reachable(self, start: Optional[int] = None) -> bytearray:
+        """Nodes reachable from `start`, the start flow by default.
+
+        Flow level event handlers are reachable from every page of the
+        flow, they apply there.
+        """
+        if start is None:
+            start = self.flow_start[self.start_flow]
+        seen = bytearray(self.node_count)
+        flow_seen = bytearray(len(self.flow_names))
+        stack = [start]
+        seen[start] = 1
+        while stack:
+            node = stack.pop()
+            following = self.successors(node)
+            flow = self.node_flow[node]
+            if not flow_seen[flow]:
+                flow_seen[flow] = 1
+                following.append(self.flow_start[flow])
+            for successor in following:
+                if not seen[successor]:
+                    seen[successor] = 1
+                    stack.append(successor)
+        return seen
+
+    def unreachable_pages(self) -> List[Tuple[str, str]]:
+        if self.start_flow == NONE:
+            return []
+        seen = self.reachable()
+        return [
+            self.key(node)
+            for node in range(self.node_count)
+            if not seen[node] and not self.is_start(node)
+        ]
+
+    def missing_targets(self) -> List[Tuple[str, str, str]]:
+        """(flow, page, missing target) of routes and handlers."""
+        missing = []
+        for node in range(self.node_count):
+            targets = [
+                (self.route_target_kind[r], self.route_target[r])
+                for r in self.routes(node)
+            ] + [
+                (self.handler_target_kind[h], self.handler_target[h])
+                for h in self.handlers(node)
+            ]
+            for kind, target in targets:
+                if kind in (TARGET_MISSING_PAGE, TARGET_MISSING_FLOW):
+                    missing.append((*self.key(node), self.names[target]))
+        return missing
+
+    def nbytes(self) -> int:
+        """Memory of the arrays, the interned tables not included."""
+        return sum(
+            value.itemsize * len(value)
+            for value in vars(self).values()
+            if isinstance(value, array)
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "flows": len(self.flow_names),
+            "pages": self.node_count - len(self.flow_names),
+            "routes": len(self.route_intent),
+            "event_handlers": len(self.handler_event),
+            "form_parameters": len(self.form_parameter),
+            "conditions": len(self.conditions),
+            "intents": len(self.intents),
+            "fulfillments": len(self.fulfillments),
+            "array_bytes": self.nbytes(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    start = time.perf_counter()
+    compact = CompactGraph.from_graph(graph)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    unreachable = compact.unreachable_pages()
+    missing = compact.missing_targets()
+    checked = time.perf_counter() - start
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    **compact.stats(),
+                    "build_seconds": built,
+                    "check_seconds": checked,
+                    "unreachable_pages": unreachable,
+                    "missing_targets": missing,
+                },
+                indent=2,
+            )
+        )
+    else:
+        for name, value in compact.stats().items():
+            print(f"{name:<18}{value:>10}")
+        print(
+            f"built in {built * 1000:.0f} ms, checked in "
+            f"{checked * 1000:.0f} ms"
+        )
+        for flow, page in unreachable:
+            print(f"unreachable  {flow} / {page}")
+        for flow, page, target in missing:
+            print(f"missing      {flow} / {page} -> {target}")
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,718 @@
+"""
+Compiler for the Dialogflow CX condition and expression language
+
+Route conditions such as
+
+    $session.params.num_appointments_on_date >= 2
+    $session.params.patientFound = null OR $session.params.ssn = "false"
+
+and parameter values such as
+
+    $sys.func.GET($session.params.appointments, 0)
+
+are parsed once, type checked, and compiled into Python closures that are
+cached by source text. Evaluation takes any object with `params` (session
+parameters) and `page_params` attributes, eg the simulator Session.
+
+Check every condition and expression of a graph snapshot:
+
+    cd src && python -m tools.conditions agent_graph.json
+"""
+
+import functools
+import random
+import re
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NoReturn, Optional, Tuple
+
+from tools.agent_graph import AgentGraph, Fulfillment
+
+ANY = "any"
+BOOLEAN = "boolean"
+LIST = "list"
+NULL = "null"
+NUMBER = "number"
+STRING = "string"
+
+TOKEN = re.compile(
+    r"""
+    (?P<space>\s+)
+    |(?P<string>"(?:[^"\\]|\\.)*")
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<reference>\$[A-Za-z_][\w-]*(?:\.[\w-]+)*)
+    |(?P<operator>!=|>=|<=|=|>|<|:)
+    |(?P<lparen>\()
+    |(?P<rparen>\))
+    |(?P<comma>,)
+    |(?P<minus>-)
+    |(?P<word>[A-Za-z_]\w*)
+    """,
+    re.VERBOSE,
+)
+TEMPLATE_REFERENCE = re.compile(r"\$(?:session|page)\.params(?:\.[\w-]+)+")
+FUNCTION_PREFIX = "$sys.func."
+
+Evaluator = Callable[[Any], Any]
+
+
+class ConditionError(ValueError):
+    def __init__(self, message: str, source: str, position: int):
+        super().__init__(f"{message} at position {position} in: {source}")
+        self.source = source
+        self.position = position
+
+
+class ConditionSyntaxError(ConditionError):
+    pass
+
+
+class ConditionTypeError(ConditionError):
+    pass
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_text(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    # sys.date / sys.time values are structs, webhook values ISO strings
+    if isinstance(value, dict):
+        now = datetime.now()
+        return datetime(
+            int(value.get("year") or now.year),
+            int(value.get("month") or now.month),
+            int(value.get("day") or now.day),
+            int(value.get("hours") or 0),
+            int(value.get("minutes") or 0),
+            int(value.get("seconds") or 0),
+        )
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return None
+
+
+_DATE_PATTERN = re.compile(r"'[^']*'|([A-Za-z])\1*")
+
+
+def _format_date(value: Any, pattern: Any, *_language: Any) -> Optional[str]:
+    date = _to_datetime(value)
+    if date is None:
+        return None
+
+    def replace(match):
+        token = match.group(0)
+        if token.startswith("'"):
+            return token[1:-1]
+        letter, width = token[0], len(token)
+        if letter == "y":
+            return f"{date.year % 100:02d}" if width == 2 else str(date.year)
+        if letter == "M":
+            if width >= 4:
+                return date.strftime("%B")
+            if width == 3:
+                return date.strftime("%b")
+            return f"{date.month:0{width}d}"
+        if letter == "d":
+            return f"{date.day:0{width}d}"
+        if letter == "E":
+            return date.strftime("%A" if width >= 4 else "%a")
+        if letter == "H":
+            return f"{date.hour:0{width}d}"
+        if letter == "h":
+            return f"{(date.hour % 12) or 12:0{width}d}"
+        if letter == "m":
+            return f"{date.minute:0{width}d}"
+        if letter == "s":
+            return f"{date.second:0{width}d}"
+        if letter == "a":
+            return "AM" if date.hour < 12 else "PM"
+        return token
+
+    return _DATE_PATTERN.sub(replace, to_text(pattern))
+
+
+def _get(items: Any, index: Any) -> Any:
+    number = _to_number(index)
+    if not isinstance(items, list) or number is None:
+        return None
+    position = int(number)
+    return items[position] if -len(items) <= position < len(items) else None
+
+
+def _join(separator: Any, items: Any, last_separator: Any = None) -> str:
+    texts = [to_text(item) for item in items or []]
+    if last_separator is not None and len(texts) > 1:
+        head = to_text(separator).join(texts[:-1])
+        return f"{head}{to_text(last_separator)}{texts[-1]}"
+    return to_text(separator).join(texts)
+
+
+def _mid(text: Any, start: Any, length: Any) -> str:
+    # 1 based, like the spreadsheet function
+    first, count = _to_number(start), _to_number(length)
+    if first is None or count is None or first < 1 or count < 0:
+        return ""
+    begin = int(first) - 1
+    end = begin + int(count)
+    return to_text(text)[begin:end]
+
+
+def _arithmetic(operation: Callable[[float, float], Optional[float]]):
+    def apply(left: Any, right: Any) -> Optional[float]:
+        left, right = _to_number(left), _to_number(right)
+        if left is None or right is None:
+            return None
+        return operation(left, right)
+
+    return apply
+
+
+def _if(context: Any, condition: Any, when_true: Any, when_false: Any):
+    # the condition is a string evaluated against the calling context
+    evaluator = compile_condition(to_text(condition))
+    return when_true if evaluator(context) else when_false
+
+
+class FunctionSpec:
+    def __init__(
+        self,
+        function: Callable[..., Any],
+        min_args: int,
+        max_args: int,
+        returns: str = ANY,
+        first_arg: Optional[str] = None,
+        takes_context: bool = False,
+    ):
+        self.function = function
+        self.min_args = min_args
+        self.max_args = max_args
+        self.returns = returns
+        # static type the first argument must be compatible with
+        self.first_arg = first_arg
+        # the evaluation context is passed before the arguments
+        self.takes_context = takes_context
+
+
+FUNCTIONS: Dict[str, FunctionSpec] = {
+    "ADD": FunctionSpec(_arithmetic(lambda a, b: a + b), 2, 2, NUMBER),
+    "APPEND": FunctionSpec(
+        lambda items, value: list(items or []) + [value], 2, 2, LIST, LIST
+    ),
+    "CONCATENATE": FunctionSpec(
+        lambda *texts: "".join(to_text(text) for text in texts),
+        1,
+        255,
+        STRING,
+    ),
+    "CONTAIN": FunctionSpec(
+        lambda items, value: value in (items or []), 2, 2, BOOLEAN, LIST
+    ),
+    "COUNT": FunctionSpec(lambda items: len(items or []), 1, 1, NUMBER, LIST),
+    "DIVIDE": FunctionSpec(
+        _arithmetic(lambda a, b: a / b if b else None), 2, 2, NUMBER
+    ),
+    "FORMAT_DATE": FunctionSpec(_format_date, 2, 3, STRING),
+    "GET": FunctionSpec(_get, 2, 2, ANY, LIST),
+    "IF": FunctionSpec(_if, 3, 3, ANY, STRING, takes_context=True),
+    "JOIN": FunctionSpec(_join, 2, 3, STRING, STRING),
+    "LOWER": FunctionSpec(lambda text: to_text(text).lower(), 1, 1, STRING),
+    "MID": FunctionSpec(_mid, 3, 3, STRING),
+    "MINUS": FunctionSpec(_arithmetic(lambda a, b: a - b), 2, 2, NUMBER),
+    "MULTIPLY": FunctionSpec(_arithmetic(lambda a, b: a * b), 2, 2, NUMBER),
+    "NOW": FunctionSpec(lambda: datetime.now().isoformat(), 0, 0, STRING),
+    "RAND": FunctionSpec(random.random, 0, 0, NUMBER),
+    "REMOVE": FunctionSpec(
+        lambda items, value: [i for i in items or [] if i != value],
+        2,
+        2,
+        LIST,
+        LIST,
+    ),
+    "SPLIT": FunctionSpec(
+        lambda text, separator: to_text(text).split(to_text(separator)),
+        2,
+        2,
+        LIST,
+        STRING,
+    ),
+    "TO_NUMBER": FunctionSpec(_to_number, 1, 1, NUMBER),
+    "TO_TEXT": FunctionSpec(to_text, 1, 1, STRING),
+    "UPPER": FunctionSpec(lambda text: to_text(text).upper(), 1, 1, STRING),
+}
+
+
+def _tokenize(source: str) -> List[Tuple[str, str, int]]:
+    tokens = []
+    position = 0
+    while position < len(source):
+        match = TOKEN.match(source, position)
+        if match is None:
+            raise ConditionSyntaxError(
+                f"Unexpected character {source[position]!r}", source, position
+            )
+        kind = match.lastgroup or ""
+        if kind != "space":
+            tokens.append((kind, match.group(0), position))
+        position = match.end()
+    tokens.append(("end", "", len(source)))
+    return tokens
+
+
+def _lookup(scope: str, path: Tuple[str, ...]) -> Evaluator:
+    attribute = "params" if scope == "session" else "page_params"
+
+    def lookup(context):
+        value = getattr(context, attribute)
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+    return lookup
+
+
+def _compare(operator: str) -> Callable[[Any, Any], bool]:
+    def equals(left, right):
+        if left == right:
+            return True
+        if isinstance(left, str) != isinstance(right, str):
+            # "2" = 2 compares numerically
+            left_number, right_number = _to_number(left), _to_number(right)
+            return left_number is not None and left_number == right_number
+        return False
+
+    def ordered(check):
+        def compare(left, right):
+            left_number, right_number = _to_number(left), _to_number(right)
+            if left_number is not None and right_number is not None:
+                return check(left_number, right_number)
+            if isinstance(left, str) and isinstance(right, str):
+                return check(left, right)
+            return False
+
+        return compare
+
+    return {
+        "=": equals,
+        "!=": lambda left, right: not equals(left, right),
+        ">": ordered(lambda a, b: a > b),
+        "<": ordered(lambda a, b: a < b),
+        ">=": ordered(lambda a, b: a >= b),
+        "<=": ordered(lambda a, b: a <= b),
+        ":": lambda left, right: (
+            to_text(right).lower() in to_text(left).lower()
+            if left is not None
+            else False
+        ),
+    }[operator]
+
+
+class _Parser:
+    """Recursive descent parser that compiles while it parses.
+
+    Every parse method returns (evaluator, static type).
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.index = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, str, int]:
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def advance(self) -> Tuple[str, str, int]:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, kind: str) -> Tuple[str, str, int]:
+        token = self.advance()
+        if token[0] != kind:
+            self.syntax_error(f"Expected {kind}, found {token[1]!r}", token)
+        return token
+
+    def syntax_error(
+        self, message: str, token: Tuple[str, str, int]
+    ) -> NoReturn:
+        raise ConditionSyntaxError(message, self.source, token[2])
+
+    def type_error(
+        self, message: str, token: Tuple[str, str, int]
+    ) -> NoReturn:
+        raise ConditionTypeError(message, self.source, token[2])
+
+    def is_keyword(self, word: str) -> bool:
+        kind, text, _ = self.peek()
+        return kind == "word" and text.upper() == word
+
+    def parse(self) -> Tuple[Evaluator, str]:
+        evaluator, kind = self.parse_or()
+        token = self.peek()
+        if token[0] != "end":
+            self.syntax_error(f"Unexpected {token[1]!r}", token)
+        return evaluator, kind
+
+    def parse_or(self) -> Tuple[Evaluator, str]:
+        evaluator, kind = self.parse_and()
+        operands = [evaluator]
+        while self.is_keyword("OR"):
+            token = self.advance()
+            self.check_boolean(kind, token)
+            evaluator, kind = self.parse_and()
+            self.check_boolean(kind, token)
+            operands.append(evaluator)
+        if len(operands) == 1:
+            return operands[0], kind
+        return (
+            lambda context: any(operand(context) for operand in operands),
+            BOOLEAN,
+        )
+
+    def parse_and(self) -> Tuple[Evaluator, str]:
+        evaluator, kind = self.parse_comparison()
+        operands = [evaluator]
+        while self.is_keyword("AND"):
+            token = self.advance()
+            self.check_boolean(kind, token)
+            evaluator, kind = self.parse_comparison()
+            self.check_boolean(kind, token)
+            operands.append(evaluator)
+        if len(operands) == 1:
+            return operands[0], kind
+        return (
+            lambda context: all(operand(context) for operand in operands),
+            BOOLEAN,
+        )
+
+    def check_boolean(self, kind: str, token: Tuple[str, str, int]):
+        if kind in (STRING, NUMBER, LIST):
+            self.type_error(
+                f"{token[1].upper()} operand must be boolean, not {kind}",
+                token,
+            )
+
+    def parse_comparison(self) -> Tuple[Evaluator, str]:
+        left, left_kind = self.parse_operand()
+        token = self.peek()
+        if token[0] != "operator":
+            return left, left_kind
+        self.advance()
+        right, right_kind = self.parse_operand()
+        operator = token[1]
+        self.check_comparison(operator, left_kind, right_kind, token)
+        compare = _compare(operator)
+        return (
+            lambda context: compare(left(context), right(context)),
+            BOOLEAN,
+        )
+
+    def check_comparison(
+        self,
+        operator: str,
+        left_kind: str,
+        right_kind: str,
+        token: Tuple[str, str, int],
+    ):
+        kinds = {left_kind, right_kind}
+        if operator in ("=", "!=", ":"):
+            if ANY in kinds or NULL in kinds or len(kinds) == 1:
+                return
+            self.type_error(
+                f"Comparing {left_kind} with {right_kind} is always "
+                f"{'false' if operator != '!=' else 'true'}",
+                token,
+            )
+        if NULL in kinds or BOOLEAN in kinds or LIST in kinds:
+            self.type_error(
+                f"Operator {operator} cannot order "
+                f"{left_kind} and {right_kind}",
+                token,
+            )
+        if kinds == {STRING, NUMBER}:
+            self.type_error(
+                f"Operator {operator} compares string with number", token
+            )
+
+    def parse_operand(self) -> Tuple[Evaluator, str]:
+        token = self.advance()
+        kind, text, _ = token
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", text[1:-1])
+            return (lambda context: value), STRING
+        if kind == "minus" and self.peek()[0] == "number":
+            number = -float(self.advance()[1])
+            return (lambda context: number), NUMBER
+        if kind == "number":
+            number = float(text)
+            return (lambda context: number), NUMBER
+        if kind == "lparen":
+            evaluator, value_kind = self.parse_or()
+            self.expect("rparen")
+            return evaluator, value_kind
+        if kind == "word":
+            upper = text.upper()
+            if upper == "NULL":
+                return (lambda context: None), NULL
+            if upper in ("TRUE", "FALSE"):
+                flag = upper == "TRUE"
+                return (lambda context: flag), BOOLEAN
+            self.syntax_error(f"Unquoted string {text!r}", token)
+        if kind == "reference":
+            return self.parse_reference(token)
+        self.syntax_error(f"Unexpected {text or 'end of input'!r}", token)
+        raise AssertionError("unreachable")
+
+    def parse_reference(self, token) -> Tuple[Evaluator, str]:
+        text = token[1]
+        if text.startswith(FUNCTION_PREFIX):
+            return self.parse_function(
+                token, text.removeprefix(FUNCTION_PREFIX)
+            )
+        parts = text[1:].split(".")
+        if len(parts) < 3 or parts[1] != "params":
+            self.syntax_error(f"Unsupported reference {text}", token)
+        if parts[0] not in ("session", "page"):
+            self.syntax_error(f"Unsupported scope ${parts[0]}", token)
+        return _lookup(parts[0], tuple(parts[2:])), ANY
+
+    def parse_function(self, token, name: str) -> Tuple[Evaluator, str]:
+        spec = FUNCTIONS.get(name)
+        if spec is None:
+            self.syntax_error(f"Unknown function {name}", token)
+        self.expect("lparen")
+        arguments: List[Tuple[Evaluator, str]] = []
+        if self.peek()[0] != "rparen":
+            arguments.append(self.parse_or())
+            while self.peek()[0] == "comma":
+                self.advance()
+                arguments.append(self.parse_or())
+        self.expect("rparen")
+
+        if not spec.min_args <= len(arguments) <= spec.max_args:
+            expected = (
+                str(spec.min_args)
+                if spec.min_args == spec.max_args
+                else f"{spec.min_args}-{spec.max_args}"
+            )
+            self.type_error(
+                f"{name} takes {expected} arguments, got {len(arguments)}",
+                token,
+            )
+        if (
+            spec.first_arg is not None
+            and arguments
+            and arguments[0][1] not in (ANY, NULL, spec.first_arg)
+        ):
+            self.type_error(
+                f"{name} expects a {spec.first_arg} first argument, "
+                f"got {arguments[0][1]}",
+                token,
+            )
+
+        function = spec.function
+        evaluators = [evaluator for evaluator, _ in arguments]
+        if spec.takes_context:
+            return (
+                lambda context: function(
+                    context, *(e(context) for e in evaluators)
+                ),
+                spec.returns,
+            )
+        return (
+            lambda context: function(*(e(context) for e in evaluators)),
+            spec.returns,
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(source: str) -> Evaluator:
+    """Compile a value expression eg $sys.func.GET($session.params.a, 0)."""
+    evaluator, _ = _Parser(source).parse()
+    return evaluator
+
+
+@functools.lru_cache(maxsize=None)
+def compile_condition(source: str) -> Callable[[Any], bool]:
+    """Compile a route condition into a callable returning a bool."""
+    if not source.strip():
+        return lambda context: True
+    evaluator, _ = _Parser(source).parse()
+    return lambda context: bool(evaluator(context))
+
+
+def evaluate_condition(condition: str, context: Any) -> bool:
+    return compile_condition(condition)(context)
+
+
+def _function_call_end(text: str, start: int) -> int:
+    # index just past the closing parenthesis, honouring quoted strings
+    depth = 0
+    in_string = False
+    position = start
+    while position < len(text):
+        char = text[position]
+        if in_string:
+            if char == "\\":
+                position += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return position + 1
+        position += 1
+    raise ConditionSyntaxError("Unclosed function call", text, start)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(text: str) -> Evaluator:
+    """Compile text with embedded references and $sys.func calls.
+
+    Text made of a single reference or call keeps the value type, anything
+    else renders to a string.
+    """
+    parts: List[Any] = []
+    position = 0
+    while True:
+        start = text.find("$", position)
+        if start < 0:
+            break
+        if text.startswith(FUNCTION_PREFIX, start):
+            paren = text.find("(", start)
+            if paren < 0:
+                raise ConditionSyntaxError("Expected (", text, start)
+            end = _function_call_end(text, paren)
+        else:
+            match = TEMPLATE_REFERENCE.match(text, start)
+            if match is None:
+                position = start + 1
+                continue
+            end = match.end()
+        if start > position:
+            parts.append(text[position:start])
+        parts.append(compile_expression(text[start:end]))
+        position = end
+    if position < len(text):
+        parts.append(text[position:])
+
+    if len(parts) == 1 and callable(parts[0]):
+        return parts[0]
+    if not any(callable(part) for part in parts):
+        return lambda context: text
+    return lambda context: "".join(
+        to_text(part(context)) if callable(part) else part for part in parts
+    )
+
+
+def render(value: Any, context: Any) -> Any:
+    """Evaluate references in a preset value or response message."""
+    if isinstance(value, dict):
+        return {k: render(v, context) for k, v in value.items()}
+    if isinstance(value, list):
+        return [render(v, context) for v in value]
+    if not isinstance(value, str) or "$" not in value:
+        return value
+    return compile_template(value)(context)
+
+
+def _fulfillment_errors(
+    fulfillment: Optional[Fulfillment], location: str
+) -> List[str]:
+    errors: List[str] = []
+    if fulfillment is None:
+        return errors
+    values = list(fulfillment.set_parameters.values()) + fulfillment.messages
+    for value in values:
+        for text in _strings(value):
+            try:
+                compile_template(text)
+            except ConditionError as error:
+                errors.append(f"{location}: {error}")
+    return errors
+
+
+def _strings(value: Any):
+    if isinstance(value, str):
+        if "$" in value:
+            yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def check_graph(graph: AgentGraph) -> List[str]:
+    """Compile every condition and expression in the graph, collect errors."""
+    errors = []
+
+    def check_routes(routes, handlers, location):
+        for index, route in enumerate(routes):
+            route_location = f"{location} route {index}"
+            if route.condition:
+                try:
+                    compile_condition(route.condition)
+                except ConditionError as error:
+                    errors.append(f"{route_location}: {error}")
+            errors.extend(
+                _fulfillment_errors(route.trigger_fulfillment, route_location)
+            )
+        for handler in handlers:
+            errors.extend(
+                _fulfillment_errors(
+                    handler.trigger_fulfillment,
+                    f"{location} event {handler.event}",
+                )
+            )
+
+    for flow in graph.flows.values():
+        check_routes(flow.routes, flow.event_handlers, flow.name)
+        for page in flow.pages.values():
+            location = f"{flow.name} / {page.name}"
+            check_routes(page.routes, page.event_handlers, location)
+            errors.extend(
+                _fulfillment_errors(page.entry_fulfillment, location)
+            )
+            for parameter in page.form:
+                errors.extend(
+                    _fulfillment_errors(
+                        parameter.initial_prompt,
+                        f"{location} parameter {parameter.name}",
+                    )
+                )
+    return errors
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise ValueError("No agent graph path provided")
+    graph_errors = check_graph(AgentGraph.load(sys.argv[1]))
+    print("\n".join(graph_errors) or "All conditions compiled")
+    if graph_errors:
+        sys.exit(1)
@@ -0,0 +1,591 @@
+"""
+Concurrent conversation load tester
+
+Runs thousands of caller sessions at once on asyncio, against the offline
+simulator in process (`--mode offline`) or through a local detectIntent
+stand-in served over HTTP (`--mode detect-intent`). Either way the agent is
+the simulator running an `AgentGraph`, webhooks are answered by
+`tools.webhook_stub` and their latency is awaited, not slept, so one
+process holds many sessions in flight.
+
+Scenarios come from the graph: every intent route that enters another flow
+(appointment.routing.cancel -> Cancel Appointment, ...) is a caller goal.
+A caller opens with the welcome intent, answers whatever form parameter
+the agent is collecting from its persona (name, date of birth, ...), says
+its goal intent once it is in scope and stays silent otherwise, until the
+session ends or `--max-turns` is reached.
+
+Reported: turns per second, turn latency overall and per page the turn
+ended on, webhook calls per conversation and memory per session (the
+simulator's session state, plus the process peak RSS).
+
+    cd src && python -m tools.conversation_load agent_graph.json \\
+        --sessions 5000 --concurrency 1000 --think-time 2 \\
+        --latency find_appointments=lognormal:900:0.8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import utils
+from tools import webhook_stub
+from tools.agent_graph import AgentGraph
+from tools.simulator import Session, SimulationError, Simulator, UserTurn
+from tools.webhook_load import PERCENTILES, percentile
+
+MAX_TURNS = 20
+# what callers answer when a form asks for a parameter
+PERSONA: Dict[str, Any] = {
+    "name": "Jane Doe",
+    "dob_collection_dob": "1980-02-03",
+    "ssn": "6789",
+    "provider_name": "Doctor Patel",
+    "appointment_date_obj": {"year": 2030, "month": 1, "day": 7},
+    "appointment_time_obj": {"hours": 9, "minutes": 0, "seconds": 0},
+}
+DEFAULT_ANSWER = "yes"
+# telephony opens every call with the welcome intent
+OPENING_TURN = {"intent": utils.IntentNames.DEFAULT_WELCOME_INTENT.value}
+
+
+class Scenario:
+    def __init__(self, *, name: str, goal_intents: List[str]):
+        self.name = name
+        self.goal_intents = goal_intents
+
+
+def build_scenarios(graph: AgentGraph) -> List[Scenario]:
+    """One scenario per flow that an intent route leads into."""
+    goals: Dict[str, List[str]] = {}
+    for flow in graph.flows.values():
+        owners = [flow.routes] + [page.routes for page in flow.pages.values()]
+        for routes in owners:
+            for route in routes:
+                if route.intent and route.target_flow:
+                    intents = goals.setdefault(route.target_flow, [])
+                    if route.intent not in intents:
+                        intents.append(route.intent)
+    return [
+        Scenario(name=flow_name, goal_intents=intents)
+        for flow_name, intents in sorted(goals.items())
+    ]
+
+
+class Caller:
+    def __init__(self, *, scenario: Scenario, number: int):
+        self.scenario = scenario
+        # distinct names so the stub spreads callers over its answers
+        self.persona = {**PERSONA, "name": f"Caller {number}"}
+        self.said: List[str] = []
+
+    def next_turn(
+        self, awaiting: Optional[str], intents: List[str]
+    ) -> Dict[str, Any]:
+        if awaiting is not None:
+            value = self.persona.get(awaiting, DEFAULT_ANSWER)
+            return {"parameters": {awaiting: value}}
+        for intent in self.scenario.goal_intents:
+            if intent in intents and intent not in self.said:
+                self.said.append(intent)
+                return {"intent": intent}
+        return {"event": "no-input"}
+
+
+def deep_size(value: Any, seen: Optional[set] = None) -> int:
+    """Bytes held by value and everything it references."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            deep_size(k, seen) + deep_size(v, seen) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+class TurnStats:
+    def __init__(self, *, page: str, latency: float, webhook_calls: int):
+        self.page = page
+        self.latency = latency
+        self.webhook_calls = webhook_calls
+
+
+class ConversationStats:
+    def __init__(self, *, scenario: str):
+        self.scenario = scenario
+        self.turns: List[TurnStats] = []
+        self.webhook_calls = 0
+        self.session_bytes = 0
+        self.end_state: Optional[str] = None
+        self.error: Optional[str] = None
+
+
+class Agent:
+    """The simulator with stubbed webhooks whose latency is awaited."""
+
+    def __init__(
+        self,
+        graph: AgentGraph,
+        latencies: Dict[str, webhook_stub.Latency],
+        seed: Optional[int] = None,
+    ):
+        self.webhook = webhook_stub.StubWebhook()
+        self.simulator = Simulator(graph, webhook=self.webhook)
+        self.latencies = latencies
+        self.generator = random.Random(seed)  # nosec B311
+
+    def start(self, params: Optional[Dict[str, Any]] = None) -> Session:
+        return self.simulator.start(params)
+
+    async def send(
+        self, session_id: str, session: Session, turn: Dict[str, Any]
+    ):
+        # the simulator runs without awaiting, so the stub can be pointed
+        # at this session for the length of the call
+        self.webhook.session = session_id
+        result = self.simulator.send(session, UserTurn.parse(turn))
+        delay = 0.0
+        for _, tag in result.webhook_calls:
+            for part in webhook_stub.split_tag(tag):
+                latency = (
+                    self.latencies.get(part or "") or self.latencies["default"]
+                )
+                delay += latency.sample(self.generator)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    def expected_input(self, session: Session):
+        return self.simulator.expected_input(session)
+
+
+def _page_label(session: Session) -> str:
+    if not session.frames:
+        return session.end_state or "END_SESSION"
+    flow, page = session.current
+    return f"{flow} / {page}"
+
+
+async def run_offline_conversation(
+    agent: Agent,
+    scenario: Scenario,
+    number: int,
+    max_turns: int,
+    think_time: float,
+) -> ConversationStats:
+    stats = ConversationStats(scenario=scenario.name)
+    caller = Caller(scenario=scenario, number=number)
+    session_id = f"load-{number}"
+    session = agent.start()
+    turn: Dict[str, Any] = OPENING_TURN
+    try:
+        for _ in range(max_turns):
+            start = time.perf_counter()
+            result = await agent.send(session_id, session, turn)
+            stats.turns.append(
+                TurnStats(
+                    page=_page_label(session),
+                    latency=time.perf_counter() - start,
+                    webhook_calls=len(result.webhook_calls),
+                )
+            )
+            stats.webhook_calls += len(result.webhook_calls)
+            if session.ended:
+                break
+            turn = caller.next_turn(*agent.expected_input(session))
+            if think_time:
+                await asyncio.sleep(think_time)
+    except SimulationError as error:
+        stats.error = str(error)
+    stats.end_state = session.end_state
+    stats.session_bytes = deep_size(session)
+    return stats
+
+
+class DetectIntentStandIn:
+    """Minimal HTTP server answering detectIntent calls with the simulator.
+
+    POST /sessions/<id>:detectIntent with a DetectIntentRequest body
+    (queryInput.text, .intent, .event or queryParams.parameters). The
+    queryResult carries what the caller needs to pick its next turn in
+    diagnosticInfo, as the real API reserves that field for free form
+    debugging data.
+    """
+
+    def __init__(self, agent: Agent):
+        self.agent = agent
+        self.sessions: Dict[str, Session] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(
+            self._serve, host, port, limit=2**20
+        )
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request = await _read_http(reader, request=True)
+                if request is None:
+                    break
+                path, body = request
+                status, response = await self.detect_intent(path, body)
+                _write_http(writer, response, status=status)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def detect_intent(self, path: str, body: Dict[str, Any]):
+        session_id = path.rsplit("/", 1)[-1].split(":", 1)[0]
+        query_input = body.get("queryInput", {})
+        parameters = body.get("queryParams", {}).get("parameters", {})
+        turn: Dict[str, Any]
+        if "intent" in query_input:
+            turn = {"intent": query_input["intent"]["intent"]}
+        elif "event" in query_input:
+            turn = {"event": query_input["event"]["event"]}
+        else:
+            turn = {"text": query_input.get("text", {}).get("text", "")}
+        if parameters and "intent" not in turn:
+            turn = {"parameters": parameters}
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = self.agent.start()
+        try:
+            result = await self.agent.send(session_id, session, turn)
+        except SimulationError as error:
+            self.sessions.pop(session_id, None)
+            return 500, {"error": {"message": str(error)}}
+        awaiting, intents = self.agent.expected_input(session)
+        diagnostic_info: Dict[str, Any] = {
+            "awaitingParameter": awaiting,
+            "intents": intents,
+            "webhookCalls": len(result.webhook_calls),
+        }
+        if session.ended:
+            diagnostic_info["sessionBytes"] = deep_size(
+                self.sessions.pop(session_id)
+            )
+        return 200, {
+            "queryResult": {
+                "responseMessages": [
+                    {"text": {"text": [message]}}
+                    for message in result.messages
+                    if isinstance(message, str)
+                ],
+                "currentPage": {"displayName": _page_label(session)},
+                "parameters": session.params,
+                "diagnosticInfo": diagnostic_info,
+                "endState": session.end_state,
+            }
+        }
+
+
+async def _read_http(reader, request: bool):
+    """(request path or status, JSON body), None when the peer hung up."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    body = json.loads(await reader.readexactly(length)) if length else {}
+    parts = start_line.decode("latin-1").split()
+    return (parts[1] if request else int(parts[1])), body
+
+
+def _write_http(
+    writer,
+    body: Dict[str, Any],
+    status: Optional[int] = None,
+    path: Optional[str] = None,
+):
+    data = json.dumps(body).encode("utf-8")
+    if path is not None:
+        start_line = f"POST {path} HTTP/1.1\r\nHost: localhost"
+    else:
+        start_line = f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}"
+    writer.write(
+        (
+            f"{start_line}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n"
+        ).encode("latin-1")
+        + data
+    )
+
+
+async def run_http_conversation(
+    address: Tuple[str, int],
+    scenario: Scenario,
+    number: int,
+    max_turns: int,
+    think_time: float,
+) -> ConversationStats:
+    stats = ConversationStats(scenario=scenario.name)
+    caller = Caller(scenario=scenario, number=number)
+    path = f"/sessions/load-{number}:detectIntent"
+    body: Dict[str, Any] = {"queryInput": {"intent": dict(OPENING_TURN)}}
+    reader, writer = await asyncio.open_connection(*address, limit=2**20)
+    try:
+        for _ in range(max_turns):
+            start = time.perf_counter()
+            _write_http(writer, body, path=path)
+            await writer.drain()
+            response = await _read_http(reader, request=False)
+            latency = time.perf_counter() - start
+            if response is None:
+                raise ConnectionError("detectIntent stand-in hung up")
+            status, payload = response
+            if status != 200:
+                stats.error = payload.get("error", {}).get("message")
+                break
+            result = payload["queryResult"]
+            info = result["diagnosticInfo"]
+            stats.turns.append(
+                TurnStats(
+                    page=result["currentPage"]["displayName"],
+                    latency=latency,
+                    webhook_calls=info["webhookCalls"],
+                )
+            )
+            stats.webhook_calls += info["webhookCalls"]
+            if result["endState"]:
+                stats.end_state = result["endState"]
+                stats.session_bytes = info.get("sessionBytes", 0)
+                break
+            turn = caller.next_turn(info["awaitingParameter"], info["intents"])
+            if "intent" in turn:
+                body = {"queryInput": {"intent": {"intent": turn["intent"]}}}
+            elif "event" in turn:
+                body = {"queryInput": {"event": {"event": turn["event"]}}}
+            else:
+                body = {
+                    "queryInput": {"text": {"text": ""}},
+                    "queryParams": {"parameters": turn["parameters"]},
+                }
+            if think_time:
+                await asyncio.sleep(think_time)
+    finally:
+        writer.close()
+    return stats
+
+
+async def run_load_test(
+    graph: AgentGraph,
+    *,
+    sessions: int,
+    concurrency: int,
+    mode: str = "offline",
+    scenarios: Optional[List[Scenario]] = None,
+    latencies: Optional[Dict[str, webhook_stub.Latency]] = None,
+    max_turns: int = MAX_TURNS,
+    think_time: float = 0.0,
+    seed: Optional[int] = None,
+) -> List[ConversationStats]:
+    scenarios = scenarios or build_scenarios(graph)
+    if not scenarios:
+        raise ValueError("No intent route of the graph enters another flow")
+    agent = Agent(
+        graph, latencies or webhook_stub.parse_latencies([]), seed=seed
+    )
+    stand_in = None
+    address: Tuple[str, int] = ("", 0)
+    if mode == "detect-intent":
+        stand_in = DetectIntentStandIn(agent)
+        address = await stand_in.start()
+    elif mode != "offline":
+        raise ValueError(f"Unknown mode {mode}")
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def conversation(number: int) -> ConversationStats:
+        scenario = scenarios[number % len(scenarios)]
+        async with limit:
+            if stand_in is None:
+                return await run_offline_conversation(
+                    agent, scenario, number, max_turns, think_time
+                )
+            return await run_http_conversation(
+                address, scenario, number, max_turns, think_time
+            )
+
+    try:
+        return await asyncio.gather(
+            *(conversation(number) for number in range(sessions))
+        )
+    finally:
+        if stand_in is not None:
+            await stand_in.close()
+
+
+def _distribution(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        **{f"p{rank}": percentile(ordered, rank) for rank in PERCENTILES},
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+def summarize(
+    conversations: List[ConversationStats], elapsed: float
+) -> Dict[str, Any]:
+    turns = [turn for c in conversations for turn in c.turns]
+    by_page: Dict[str, List[float]] = {}
+    for turn in turns:
+        by_page.setdefault(turn.page, []).append(turn.latency * 1000)
+    end_states: Dict[str, int] = {}
+    for c in conversations:
+        state = "error" if c.error else (c.end_state or "max turns")
+        end_states[state] = end_states.get(state, 0) + 1
+    return {
+        "conversations": len(conversations),
+        "turns": len(turns),
+        "elapsed_s": elapsed,
+        "turns_per_s": len(turns) / elapsed if elapsed else 0.0,
+        "turn_latency_ms": _distribution([t.latency * 1000 for t in turns]),
+        "page_latency_ms": {
+            page: {"turns": len(values), **_distribution(values)}
+            for page, values in sorted(by_page.items())
+        },
+        "webhook_calls_per_conversation": _distribution(
+            [float(c.webhook_calls) for c in conversations]
+        ),
+        "session_bytes": _distribution(
+            [float(c.session_bytes) for c in conversations if c.session_bytes]
+        ),
+        # kilobytes on linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "end_states": end_states,
+        "errors": sorted({c.error for c in conversations if c.error}),
+    }
+
+
+def print_summary(summary: Dict[str, Any], top: int = 15):
+    print(
+        f"{summary['conversations']} conversations, {summary['turns']} turns"
+        f" in {summary['elapsed_s']:.1f}s:"
+        f" {summary['turns_per_s']:.1f} turns/s"
+    )
+    ranks = [f"p{rank}" for rank in PERCENTILES]
+    latency = summary["turn_latency_ms"]
+    print(
+        "turn latency ms: "
+        + ", ".join(f"{key} {latency[key]:.1f}" for key in ["mean", *ranks])
+    )
+    fan_out = summary["webhook_calls_per_conversation"]
+    print(
+        "webhook calls per conversation: "
+        + ", ".join(f"{key} {fan_out[key]:.1f}" for key in ["mean", *ranks])
+        + f", max {fan_out['max']:.0f}"
+    )
+    memory = summary["session_bytes"]
+    print(
+        f"session state: mean {memory['mean'] / 1024:.1f} KiB,"
+        f" max {memory['max'] / 1024:.1f} KiB,"
+        f" peak RSS {summary['peak_rss_kb'] / 1024:.1f} MiB"
+    )
+    print("end states: " + json.dumps(summary["end_states"]))
+    pages = sorted(
+        summary["page_latency_ms"].items(),
+        key=lambda item: -item[1]["p95"],
+    )
+    print(f"\n{'page':<60}{'turns':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for page, stats in pages[:top]:
+        print(
+            f"{page[:59]:<60}{stats['turns']:>8}"
+            f"{stats['p50']:>10.1f}{stats['p95']:>10.1f}"
+        )
+    for error in summary["errors"]:
+        print(f"ERROR: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument(
+        "--mode", choices=["offline", "detect-intent"], default="offline"
+    )
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="seconds a caller waits between turns",
+    )
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        default=[],
+        help="only run these scenarios (flow names)",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="TAG=SPEC",
+        help="webhook latency, see tools.webhook_stub",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    scenarios = [
+        scenario
+        for scenario in build_scenarios(graph)
+        if not args.scenario or scenario.name in args.scenario
+    ]
+    start = time.perf_counter()
+    conversations = asyncio.run(
+        run_load_test(
+            graph,
+            sessions=args.sessions,
+            concurrency=args.concurrency,
+            mode=args.mode,
+            scenarios=scenarios,
+            latencies=webhook_stub.parse_latencies(args.latency),
+            max_turns=args.max_turns,
+            think_time=args.think_time,
+            seed=args.seed,
+        )
+    )
+    summary = summarize(conversations, time.perf_counter() - start)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Streaming analyzer for exported conversation logs
+
+`agent_config.init` turns on Stackdriver logging for the agent. The
+Cloud Logging entries, exported by a log sink as newline-delimited JSON
+(optionally gzipped), are read line by line and aggregated in chunks of
+`--chunk` turns. Memory grows with the conversations still open (until
+their End Session turn), not with the length of the export:
+
+    turn latency     from a session's request entry to its next response
+    webhook latency  per tag, from the "Webhook Latencies (ms)" of the
+                     response diagnostic info
+    no-match and     per page the turn ended on, from the match type of
+    no-input rates   the response
+    escalation rate  per flow: conversations escalated to an agent (a
+                     live agent handoff message or human_escalated set)
+                     out of the conversations that entered the flow,
+                     the escalation counted on the flow the caller was
+                     in the turn before
+
+Latencies are counted in fixed `BIN_MS` bins, percentiles are the upper
+edge of their bin.
+
+    cd src && python -m tools.conversation_logs export/*.json.gz \\
+        --webhook-metrics webhook_metrics.json --turns turns.ndjson
+
+`--webhook-metrics` writes the per tag latencies in the format the agent
+build reads from WEBHOOK_METRICS (`utils.interim_prompt`), `--turns` one
+{"conversation", "flow", "page"} record per turn for
+`tools.path_coverage --logs` / `--traffic`.
+"""
+
+import argparse
+import gzip
+import json
+import math
+from datetime import datetime
+from typing import IO, Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+import utils
+from tools.agent_graph import START_PAGE
+from tools.compact_graph import Interner
+
+CHUNK_TURNS = 100000
+BIN_MS = 5
+MAX_MS = 60000
+PERCENTILES = [50, 95, 99]
+WEBHOOK_LATENCIES = "Webhook Latencies (ms)"
+NO_MATCH = "NO_MATCH"
+NO_INPUT = "NO_INPUT"
+# current page of the response that ends a session
+END_SESSION_PAGE = "End Session"
+
+
+class LatencyHistogram:
+    """Latency counts per group in BIN_MS bins, the last one open ended."""
+
+    def __init__(self):
+        self.groups: Interner[str] = Interner()
+        self.bins = MAX_MS // BIN_MS + 1
+        self.counts = np.zeros((0, self.bins), np.int64)
+        self.sums = np.zeros(0)
+
+    def add(self, groups: np.ndarray, latencies_ms: np.ndarray):
+        size = len(self.groups)
+        if size > len(self.counts):
+            self.counts = np.vstack(
+                [
+                    self.counts,
+                    np.zeros((size - len(self.counts), self.bins), np.int64),
+                ]
+            )
+            self.sums = np.concatenate(
+                [self.sums, np.zeros(size - len(self.sums))]
+            )
+        bins = np.minimum(
+            (latencies_ms // BIN_MS).astype(np.int64), self.bins - 1
+        )
+        self.counts += np.bincount(
+            groups * self.bins + bins, minlength=size * self.bins
+        ).reshape(size, self.bins)
+        self.sums += np.bincount(groups, latencies_ms, minlength=size)
+
+    def stats(self, group: int) -> Dict[str, float]:
+        counts = self.counts[group]
+        total = int(counts.sum())
+        cumulative = np.cumsum(counts)
+        stats: Dict[str, Any] = {"calls": total}
+        for rank in PERCENTILES:
+            if not total:
+                stats[f"p{rank}"] = 0.0
+                continue
+            index = int(np.searchsorted(cumulative, total * rank / 100))
+            stats[f"p{rank}"] = float((index + 1) * BIN_MS)
+        stats["mean"] = float(self.sums[group] / total) if total else 0.0
+        return stats
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: self.stats(group)
+            for group, name in enumerate(self.groups.values)
+        }
+
+
+class _Session:
+    def __init__(self):
+        self.request_time: Optional[datetime] = None
+        self.flow = -1
+        # flows entered, as a bitset of flow ids
+        self.flows = 0
+        self.escalated = False
+
+
+def _grow(total: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(total):
+        return total
+    return np.concatenate([total, np.zeros(size - len(total), total.dtype)])
+
+
+def _timestamp(entry: Dict[str, Any]) -> Optional[datetime]:
+    value = entry.get("timestamp")
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _session_id(entry: Dict[str, Any], payload: Dict[str, Any]) -> str:
+    session = (entry.get("labels") or {}).get("session_id")
+    if not session:
+        session = payload.get("session", "").rsplit("/", 1)[-1]
+    if not session:
+        diagnostic = (payload.get("queryResult") or {}).get(
+            "diagnosticInfo"
+        ) or {}
+        session = diagnostic.get("Session Id", "")
+    return session
+
+
+def _escalated(result: Dict[str, Any]) -> bool:
+    if (result.get("parameters") or {}).get("human_escalated") is True:
+        return True
+    return any(
+        "liveAgentHandoff" in message
+        for message in result.get("responseMessages") or []
+    )
+
+
+class ConversationLogAnalyzer:
+    def __init__(
+        self,
+        *,
+        chunk_turns: int = CHUNK_TURNS,
+        turns_out: Optional[IO[str]] = None,
+    ):
+        self.chunk_turns = chunk_turns
+        self.turns_out = turns_out
+        self.flows: Interner[str] = Interner()
+        self.pages: Interner[str] = Interner()
+        self.turn_latency = LatencyHistogram()
+        self.turn_latency.groups.intern("all")
+        self.webhook_latency = LatencyHistogram()
+        self.entries = 0
+        self.skipped = 0
+        self.turns = 0
+        self.conversations = 0
+        # open conversations, by session id
+        self._sessions: Dict[str, _Session] = {}
+
+        # totals per page / flow id
+        self.page_turns = np.zeros(0, np.int64)
+        self.page_no_match = np.zeros(0, np.int64)
+        self.page_no_input = np.zeros(0, np.int64)
+        self.flow_conversations = np.zeros(0, np.int64)
+        self.flow_escalations = np.zeros(0, np.int64)
+
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        # columns of the turns of the current chunk
+        self._page: List[int] = []
+        self._match: List[int] = []
+        self._latency: List[float] = []
+        self._entered: List[int] = []
+        self._escalated: List[int] = []
+        self._webhook_tag: List[int] = []
+        self._webhook_ms: List[float] = []
+
+    def read(self, lines: Iterable[str]):
+        for line in lines:
+            if not line.strip():
+                continue
+            self.entries += 1
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                self.skipped += 1
+                continue
+            self.add(entry)
+
+    def add(self, entry: Dict[str, Any]):
+        payload = entry.get("jsonPayload") or {}
+        session_id = _session_id(entry, payload)
+        if not session_id:
+            self.skipped += 1
+            return
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session()
+            self.conversations += 1
+        if "queryResult" not in payload:
+            if "queryInput" in payload:
+                session.request_time = _timestamp(entry)
+            return
+        result = payload["queryResult"]
+        flow_name = (result.get("currentFlow") or {}).get("displayName")
+        if not flow_name:
+            flow_name = utils.DEFAULT_START_FLOW
+        page_name = (result.get("currentPage") or {}).get("displayName")
+        if not page_name:
+            page_name = START_PAGE
+        flow = self.flows.intern(flow_name)
+        self._page.append(self.pages.intern(f"{flow_name} / {page_name}"))
+
+        match_type = (result.get("match") or {}).get("matchType")
+        self._match.append(
+            1 if match_type == NO_MATCH else 2 if match_type == NO_INPUT else 0
+        )
+
+        response_time = _timestamp(entry)
+        latency = math.nan
+        if session.request_time and response_time:
+            latency = (
+                response_time - session.request_time
+            ).total_seconds() * 1000
+        session.request_time = None
+        self._latency.append(latency)
+
+        entered = not (session.flows >> flow) & 1
+        session.flows |= 1 << flow
+        self._entered.append(flow if entered else -1)
+
+        escalated = -1
+        if not session.escalated and _escalated(result):
+            session.escalated = True
+            escalated = flow if session.flow == -1 else session.flow
+        self._escalated.append(escalated)
+        session.flow = flow
+
+        diagnostic = result.get("diagnosticInfo") or {}
+        for tag, ms in (diagnostic.get(WEBHOOK_LATENCIES) or {}).items():
+            self._webhook_tag.append(self.webhook_latency.groups.intern(tag))
+            self._webhook_ms.append(float(ms))
+
+        if self.turns_out is not None:
+            record = {
+                "conversation": session_id,
+                "flow": flow_name,
+                "page": page_name,
+            }
+            self.turns_out.write(json.dumps(record) + "\n")
+        if page_name == END_SESSION_PAGE:
+            del self._sessions[session_id]
+
+        if len(self._page) >= self.chunk_turns:
+            self.flush()
+
+    def flush(self):
+        """Aggregate the turns of the current chunk."""
+        if not self._page:
+            return
+        self.turns += len(self._page)
+        pages = np.array(self._page, np.int64)
+        match = np.array(self._match, np.int8)
+        size = len(self.pages)
+        self.page_turns = _grow(self.page_turns, size)
+        self.page_turns += np.bincount(pages, minlength=size)
+        self.page_no_match = _grow(self.page_no_match, size)
+        self.page_no_match += np.bincount(pages[match == 1], minlength=size)
+        self.page_no_input = _grow(self.page_no_input, size)
+        self.page_no_input += np.bincount(pages[match == 2], minlength=size)
+
+        size = len(self.flows)
+        entered = np.array(self._entered, np.int64)
+        self.flow_conversations = _grow(self.flow_conversations, size)
+        self.flow_conversations += np.bincount(
+            entered[entered >= 0], minlength=size
+        )
+        escalated = np.array(self._escalated, np.int64)
+        self.flow_escalations = _grow(self.flow_escalations, size)
+        self.flow_escalations += np.bincount(
+            escalated[escalated >= 0], minlength=size
+        )
+
+        latency = np.array(self._latency)
+        latency = latency[~np.isnan(latency) & (latency >= 0)]
+        self.turn_latency.add(np.zeros(len(latency), np.int64), latency)
+        if self._webhook_tag:
+            self.webhook_latency.add(
+                np.array(self._webhook_tag, np.int64),
+                np.array(self._webhook_ms),
+            )
+        self._reset_chunk()
+
+    def summary(self) -> Dict[str, Any]:
+        self.flush()
+        return {
+            "entries": self.entries,
+            "skipped_entries": self.skipped,
+            "turns": self.turns,
+            "conversations": self.conversations,
+            "turn_latency": self.turn_latency.stats(0),
+            "webhooks": self.webhook_latency.summary(),
+            "pages": {
+                name: {
+                    "turns": int(self.page_turns[page]),
+                    "no_match_rate": float(
+                        self.page_no_match[page] / self.page_turns[page]
+                    ),
+                    "no_input_rate": float(
+                        self.page_no_input[page] / self.page_turns[page]
+                    ),
+                }
+                for page, name in enumerate(self.pages.values)
+            },
+            "flows": {
+                name: {
+                    "conversations": int(self.flow_conversations[flow]),
+                    "escalations": int(self.flow_escalations[flow]),
+                    "escalation_rate": float(
+                        self.flow_escalations[flow]
+                        / max(self.flow_conversations[flow], 1)
+                    ),
+                }
+                for flow, name in enumerate(self.flows.values)
+            },
+        }
+
+
+def open_log(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _latency_row(name: str, stats: Dict[str, float]) -> str:
+    return (
+        f"{name:<40}{stats['calls']:>10}"
+        + "".join(f"{stats[f'p{rank}']:>10.0f}" for rank in PERCENTILES)
+        + f"{stats['mean']:>10.0f}"
+    )
+
+
+def print_summary(summary: Dict[str, Any], top: int = 20):
+    print(
+        f"{summary['turns']} turns in {summary['conversations']} "
+        f"conversations, {summary['skipped_entries']} entries skipped"
+    )
+    header = "".join(f"{f'p{rank} ms':>10}" for rank in PERCENTILES)
+    print(f"\n{'latency':<40}{'count':>10}{header}{'mean ms':>10}")
+    print(_latency_row("turn", summary["turn_latency"]))
+    for tag, stats in sorted(summary["webhooks"].items()):
+        print(_latency_row(f"webhook {tag}", stats))
+
+    pages = sorted(
+        summary["pages"].items(),
+        key=lambda item: -(
+            item[1]["no_match_rate"] + item[1]["no_input_rate"]
+        ),
+    )
+    print(f"\n{'page':<60}{'turns':>10}{'no-match':>10}{'no-input':>10}")
+    for name, stats in pages[:top]:
+        print(
+            f"{name:<60}{stats['turns']:>10}"
+            f"{stats['no_match_rate']:>10.1%}{stats['no_input_rate']:>10.1%}"
+        )
+
+    print(f"\n{'flow':<40}{'conversations':>15}{'escalated':>12}")
+    for name, stats in sorted(
+        summary["flows"].items(), key=lambda item: -item[1]["escalation_rate"]
+    ):
+        print(
+            f"{name:<40}{stats['conversations']:>15}"
+            f"{stats['escalation_rate']:>12.1%}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+", help="exported log files")
+    parser.add_argument("--chunk", type=int, default=CHUNK_TURNS)
+    parser.add_argument(
+        "--webhook-metrics", help="write per tag latencies for the build"
+    )
+    parser.add_argument("--turns", help="write one record per turn")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    turns_out = open(args.turns, "w", encoding="utf-8") if args.turns else None
+    try:
+        analyzer = ConversationLogAnalyzer(
+            chunk_turns=args.chunk, turns_out=turns_out
+        )
+        for path in args.logs:
+            with open_log(path) as file:
+                analyzer.read(file)
+        summary = analyzer.summary()
+    finally:
+        if turns_out is not None:
+            turns_out.close()
+
+    if args.webhook_metrics:
+        with open(args.webhook_metrics, "w", encoding="utf-8") as file:
+            json.dump(summary["webhooks"], file, indent=2)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Structural diff between two JSON_PACKAGE exports of the agent
+
+Both exports are indexed by resource type and display name (flows, pages,
+route groups, intents, entity types, webhooks, ...). Every file is parsed
+on its own, normalized and hashed, so unchanged resources cost one hash
+comparison; only resources whose hashes differ are loaded again and
+compared field by field.
+
+Normalization drops generated ids and ordering noise: training phrases,
+entities and synonyms are compared as sets, routes, event handlers and
+parameter presets are matched by what they react to instead of by index,
+repeats of the same key by occurrence (`condition=true#2`). Route order is still reported since CX evaluates conditions in order.
+
+    cd src && python -m tools.export_diff <old export> <new export>
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# generated ids, only dropped when the value looks generated
+GENERATED_KEYS = {"name", "id"}
+GENERATED_ID = re.compile(
+    r"^[0-9a-fA-F]{8}(-?[0-9a-fA-F]{4}){3}-?[0-9a-fA-F]{12}$"
+)
+# lists compared as sets
+UNORDERED_LISTS = {
+    "entities",
+    "excludedPhrases",
+    "synonyms",
+    "trainingPhrases",
+    "transitionRouteGroups",
+}
+
+
+def _route_key(route: Dict[str, Any]) -> str:
+    parts = [
+        f"{field}={route[field]}"
+        for field in ("intent", "condition")
+        if route.get(field)
+    ]
+    return ",".join(parts) or "always"
+
+
+# lists whose items are matched by identity
+KEYED_LISTS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "eventHandlers": lambda item: f"event={item.get('event')}",
+    "parameters": lambda item: str(item.get("displayName") or item.get("id")),
+    "setParameterActions": lambda item: str(item.get("parameter")),
+    "transitionRoutes": _route_key,
+}
+# keyed lists where the order of the items matters
+ORDERED_KEYED_LISTS = {"transitionRoutes"}
+
+
+class Resource:
+    def __init__(
+        self, *, kind: str, name: str, part: str, path: str, digest: str
+    ):
+        self.kind = kind
+        self.name = name
+        self.part = part
+        self.path = path
+        self.digest = digest
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        return self.kind, self.name, self.part
+
+    @property
+    def label(self) -> str:
+        label = f"{self.kind} {self.name}".rstrip()
+        return f"{label} ({self.part})" if self.part else label
+
+
+class Change:
+    def __init__(
+        self,
+        *,
+        op: str,
+        resource: str,
+        path: str = "",
+        old: Any = None,
+        new: Any = None,
+    ):
+        # op is one of "+" added, "-" removed, "~" changed, "^" reordered
+        self.op = op
+        self.resource = resource
+        self.path = path
+        self.old = old
+        self.new = new
+
+    def __str__(self):
+        text = f"{self.op} {self.resource}"
+        if self.path:
+            text += f": {self.path}"
+        if self.op == "~":
+            text += f": {_short(self.old)} -> {_short(self.new)}"
+        elif self.op == "^":
+            text += f": {self.old} -> {self.new}"
+        elif self.path:
+            text += f": {_short(self.new if self.op == '+' else self.old)}"
+        return text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "op": self.op,
+            "resource": self.resource,
+            "path": self.path,
+            "old": self.old,
+            "new": self.new,
+        }
+
+
+def _short(value: Any, limit: int = 120) -> str:
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(
+        value, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+
+
+def normalize(value: Any, key: Optional[str] = None) -> Any:
+    if isinstance(value, dict):
+        return {
+            k: normalize(v, k)
+            for k, v in value.items()
+            if not (
+                k in GENERATED_KEYS
+                and isinstance(v, str)
+                and GENERATED_ID.match(v)
+            )
+        }
+    if isinstance(value, list):
+        items = [normalize(item) for item in value]
+        if key in UNORDERED_LISTS:
+            items.sort(key=_dumps)
+        return items
+    return value
+
+
+def load(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as file:
+        return normalize(json.load(file))
+
+
+def classify(relative: str) -> Tuple[str, List[str], str]:
+    """(kind, owner folders, part) of an exported file path."""
+    parts = relative.replace(os.sep, "/").removesuffix(".json").split("/")
+    if parts == ["agent"]:
+        return "agent", [], ""
+    if len(parts) >= 3 and parts[0] == "flows":
+        flow = parts[1]
+        if len(parts) == 3 and parts[2] == flow:
+            return "flow", [flow], ""
+        if len(parts) == 4 and parts[2] == "pages":
+            return "page", [flow, parts[3]], ""
+        if len(parts) == 4 and parts[2] == "transitionRouteGroups":
+            return "route group", [flow, parts[3]], ""
+        return "flow", [flow], "/".join(parts[2:])
+    if len(parts) >= 2 and parts[0] in ("intents", "entityTypes"):
+        kind = "intent" if parts[0] == "intents" else "entity type"
+        if len(parts) == 3 and parts[2] == parts[1]:
+            return kind, [parts[1]], ""
+        return kind, [parts[1]], "/".join(parts[2:])
+    if len(parts) >= 2 and parts[0] == "webhooks":
+        return "webhook", [parts[-1]], ""
+    return "file", [], "/".join(parts)
+
+
+def index_export(base_path: str) -> Dict[Tuple[str, str, str], Resource]:
+    """Hash every file of an export, keyed by (kind, display name, part)."""
+    entries = []
+    # folder names are sanitized display names, map them back from the
+    # displayName of the resource's own file
+    display_names: Dict[Tuple[str, ...], str] = {}
+    for root, dirs, files in os.walk(base_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(files):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(root, filename)
+            kind, folders, part = classify(os.path.relpath(path, base_path))
+            document = load(path)
+            if not part and isinstance(document, dict):
+                display_name = document.get("displayName")
+                if display_name:
+                    display_names[(kind, *folders)] = display_name
+            entries.append(
+                (
+                    kind,
+                    folders,
+                    part,
+                    path,
+                    hashlib.sha1(_dumps(document).encode()),
+                )
+            )
+
+    index = {}
+    for kind, folders, part, path, digest in entries:
+        names = []
+        for depth in range(1, len(folders) + 1):
+            owner_kind = kind if depth == len(folders) else "flow"
+            names.append(
+                display_names.get(
+                    (owner_kind, *folders[:depth]), folders[depth - 1]
+                )
+            )
+        resource = Resource(
+            kind=kind,
+            name="/".join(names),
+            part=part,
+            path=path,
+            digest=digest.hexdigest(),
+        )
+        index[resource.key] = resource
+    return index
+
+
+def diff_values(
+    old: Any, new: Any, resource: str, path: str, changes: List[Change]
+):
+    if old == new:
+        return
+    key = path.rsplit(".", 1)[-1] if path else ""
+    if isinstance(old, dict) and isinstance(new, dict):
+        for field in sorted(old.keys() | new.keys()):
+            child = f"{path}.{field}" if path else field
+            if field not in new:
+                changes.append(
+                    Change(
+                        op="-", resource=resource, path=child, old=old[field]
+                    )
+                )
+            elif field not in old:
+                changes.append(
+                    Change(
+                        op="+", resource=resource, path=child, new=new[field]
+                    )
+                )
+            else:
+                diff_values(old[field], new[field], resource, child, changes)
+    elif isinstance(old, list) and isinstance(new, list):
+        if key in KEYED_LISTS:
+            _diff_keyed(old, new, resource, path, changes)
+        elif key in UNORDERED_LISTS:
+            old_items = {_dumps(item): item for item in old}
+            new_items = {_dumps(item): item for item in new}
+            for text in sorted(old_items.keys() - new_items.keys()):
+                changes.append(
+                    Change(
+                        op="-",
+                        resource=resource,
+                        path=path,
+                        old=old_items[text],
+                    )
+                )
+            for text in sorted(new_items.keys() - old_items.keys()):
+                changes.append(
+                    Change(
+                        op="+",
+                        resource=resource,
+                        path=path,
+                        new=new_items[text],
+                    )
+                )
+        else:
+            for position in range(max(len(old), len(new))):
+                child = f"{path}[{position}]"
+                if position >= len(new):
+                    changes.append(
+                        Change(
+                            op="-",
+                            resource=resource,
+                            path=child,
+                            old=old[position],
+                        )
+                    )
+                elif position >= len(old):
+                    changes.append(
+                        Change(
+                            op="+",
+                            resource=resource,
+                            path=child,
+                            new=new[position],
+                        )
+                    )
+                else:
+                    diff_values(
+                        old[position], new[position], resource, child, changes
+                    )
+    else:
+        changes.append(
+            Change(op="~", resource=resource, path=path, old=old, new=new)
+        )
+
+
+def _keyed(
+    items: List[Any], identity: Callable[[Dict[str, Any]], str]
+) -> Dict[str, Any]:
+    """Items by identity, repeated ones numbered `key#2`, `key#3`, ..."""
+    keyed: Dict[str, Any] = {}
+    seen: Dict[str, int] = {}
+    for item in items:
+        item_key = identity(item)
+        seen[item_key] = seen.get(item_key, 0) + 1
+        if seen[item_key] > 1:
+            item_key = f"{item_key}#{seen[item_key]}"
+        keyed[item_key] = item
+    return keyed
+
+
+def _diff_keyed(
+    old: List[Any], new: List[Any], resource: str, path: str, changes
+):
+    identity = KEYED_LISTS[path.rsplit(".", 1)[-1]]
+    old_items = _keyed(old, identity)
+    new_items = _keyed(new, identity)
+    for item_key, item in old_items.items():
+        child = f"{path}[{item_key}]"
+        if item_key not in new_items:
+            changes.append(
+                Change(op="-", resource=resource, path=child, old=item)
+            )
+        else:
+            diff_values(item, new_items[item_key], resource, child, changes)
+    for item_key, item in new_items.items():
+        if item_key not in old_items:
+            changes.append(
+                Change(
+                    op="+",
+                    resource=resource,
+                    path=f"{path}[{item_key}]",
+                    new=item,
+                )
+            )
+    if path.rsplit(".", 1)[-1] in ORDERED_KEYED_LISTS:
+        old_order = [k for k in old_items if k in new_items]
+        new_order = [k for k in new_items if k in old_items]
+        if old_order != new_order:
+            changes.append(
+                Change(
+                    op="^",
+                    resource=resource,
+                    path=path,
+                    old=old_order,
+                    new=new_order,
+                )
+            )
+
+
+def diff_exports(old_path: str, new_path: str) -> List[Change]:
+    old_index = index_export(old_path)
+    new_index = index_export(new_path)
+    changes: List[Change] = []
+    for key in sorted(old_index.keys() | new_index.keys()):
+        old, new = old_index.get(key), new_index.get(key)
+        if old is None:
+            changes.append(Change(op="+", resource=new_index[key].label))
+        elif new is None:
+            changes.append(Change(op="-", resource=old.label))
+        elif old.digest != new.digest:
+            diff_values(load(old.path), load(new.path), new.label, "", changes)
+    return changes
+
+
+def main(old_path: str, new_path: str, output_format: str = "text"):
+    changes = diff_exports(old_path, new_path)
+    if output_format == "json":
+        print(json.dumps([c.to_dict() for c in changes], indent=2))
+    else:
+        for change in changes:
+            print(change)
+        print(f"{len(changes)} changes")
+    sys.exit(1 if changes else 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        raise ValueError("Usage: export_diff.py <old> <new> [text|json]")
+    main(*sys.argv[1:4])
@@ -0,0 +1,316 @@
+"""
+Local intent classifier for training phrase regression tests
+
+Approximates the flow level NLU of the agent: training phrases are embedded
+as TF-IDF vectors over word unigrams and character n-grams, utterances are
+scored against every phrase with a single matrix product (cosine
+similarity), and an intent matches when its best phrase scores at least the
+flow `classification_threshold` set by `utils.set_flow_nlu_settings`.
+
+A labelled corpus is newline-delimited JSON; utterances labelled with an
+intent that is not in scope for the flow are expected to be no-match:
+
+    {"flow": "Scheduling", "text": "move my visit", "intent": "..."}
+
+Without a corpus, every training phrase is scored leave-one-out against the
+other phrases of the flow.
+
+    cd src && python -m tools.intent_classifier [corpus.jsonl] [graph.json]
+"""
+
+import json
+import math
+import re
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import utils
+from resources import desired_action_intents, wrapup_intents
+from tools.agent_graph import AgentGraph
+
+NO_MATCH = "NO_MATCH"
+DEFAULT_THRESHOLD = 0.3
+# flows that route on intents, with the phrases and threshold we deploy
+FLOW_INTENTS: Dict[str, Tuple[Dict[str, List[str]], float]] = {
+    utils.FlowNames.SCHEDULING.value: (desired_action_intents.INTENTS, 0.5),
+    utils.FlowNames.WRAPUP_BLOCK.value: (
+        wrapup_intents.INTENTS,
+        DEFAULT_THRESHOLD,
+    ),
+}
+THRESHOLD_CANDIDATES = np.round(np.linspace(0.05, 0.95, 91), 2)
+
+_NON_WORD = re.compile(r"[^\w' ]+")
+
+
+def normalize(text: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def features(text: str, ngram_range: Tuple[int, int] = (3, 5)) -> Counter:
+    counts: Counter = Counter()
+    for word in normalize(text).split():
+        counts[f"w:{word}"] += 1
+        padded = f" {word} "
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            for start in range(max(len(padded) - n + 1, 1)):
+                counts[padded[start:][:n]] += 1
+    return counts
+
+
+class TfidfVectorizer:
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+
+    def fit(self, texts: Iterable[str]):
+        document_frequency: Counter = Counter()
+        total = 0
+        for text in texts:
+            total += 1
+            document_frequency.update(features(text).keys())
+        self.vocabulary = {
+            feature: column
+            for column, feature in enumerate(sorted(document_frequency))
+        }
+        self.idf = np.array(
+            [
+                math.log((1 + total) / (1 + document_frequency[feature])) + 1
+                for feature in sorted(document_frequency)
+            ],
+            dtype=np.float32,
+        )
+        return self
+
+    def weights(self, text: str) -> Dict[int, float]:
+        """Sparse L2 normalized row, column -> weight."""
+        row = {}
+        for feature, count in features(text).items():
+            column = self.vocabulary.get(feature)
+            if column is not None:
+                # sublinear term frequency
+                row[column] = (1 + math.log(count)) * float(self.idf[column])
+        norm = math.sqrt(sum(weight * weight for weight in row.values()))
+        return {column: weight / norm for column, weight in row.items()}
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), len(self.vocabulary)), np.float32)
+        for row, text in enumerate(texts):
+            for column, weight in self.weights(text).items():
+                matrix[row, column] = weight
+        return matrix
+
+
+class IntentClassifier:
+    def __init__(
+        self,
+        intents: Dict[str, List[str]],
+        threshold: float = DEFAULT_THRESHOLD,
+    ):
+        self.threshold = threshold
+        self.intents = [name for name, phrases in intents.items() if phrases]
+        self.phrases: List[str] = []
+        # phrases are grouped by intent, starts[i] is the first phrase of
+        # intents[i] so per intent maxima are one reduceat call
+        starts = []
+        for name in self.intents:
+            starts.append(len(self.phrases))
+            self.phrases.extend(intents[name])
+        self.starts = np.array(starts, dtype=np.intp)
+        self.phrase_intent = np.repeat(
+            np.arange(len(self.intents)),
+            np.diff(np.append(self.starts, len(self.phrases))),
+        )
+        self.vectorizer = TfidfVectorizer().fit(self.phrases)
+        self.phrase_vectors = self.vectorizer.transform(self.phrases)
+
+    def _intent_scores(self, similarity: np.ndarray) -> np.ndarray:
+        if not self.intents:
+            return np.zeros((similarity.shape[0], 0), np.float32)
+        return np.maximum.reduceat(similarity, self.starts, axis=1)
+
+    def score(self, utterances: List[str]) -> np.ndarray:
+        """Utterances x intents matrix of best phrase cosine similarity."""
+        vectors = self.vectorizer.transform(utterances)
+        return self._intent_scores(vectors @ self.phrase_vectors.T)
+
+    def score_training_phrases(self) -> np.ndarray:
+        """Leave-one-out scores of every training phrase."""
+        similarity = self.phrase_vectors @ self.phrase_vectors.T
+        np.fill_diagonal(similarity, -1.0)
+        return self._intent_scores(similarity)
+
+    def predict(
+        self, scores: np.ndarray, threshold: Optional[float] = None
+    ) -> np.ndarray:
+        """Index of the matched intent per row, len(intents) for no-match."""
+        threshold = self.threshold if threshold is None else threshold
+        if scores.shape[1] == 0:
+            return np.full(scores.shape[0], len(self.intents))
+        best = scores.argmax(axis=1)
+        return np.where(
+            scores.max(axis=1) >= threshold, best, len(self.intents)
+        )
+
+    def classify(self, utterance: str) -> Tuple[Optional[str], float]:
+        scores = self.score([utterance])
+        index = int(self.predict(scores)[0])
+        if index == len(self.intents):
+            return None, float(scores.max()) if scores.size else 0.0
+        return self.intents[index], float(scores[0, index])
+
+    def label_indexes(self, labels: List[Optional[str]]) -> np.ndarray:
+        index: Dict[Optional[str], int] = {
+            name: i for i, name in enumerate(self.intents)
+        }
+        return np.array(
+            [index.get(label, len(self.intents)) for label in labels],
+            dtype=np.intp,
+        )
+
+
+class FlowReport:
+    def __init__(
+        self,
+        *,
+        flow: str,
+        labels: List[str],
+        confusion: np.ndarray,
+        threshold: float,
+        accuracy: float,
+        recommended_threshold: float,
+        recommended_accuracy: float,
+    ):
+        self.flow = flow
+        self.labels = labels
+        self.confusion = confusion
+        self.threshold = threshold
+        self.accuracy = accuracy
+        self.recommended_threshold = recommended_threshold
+        self.recommended_accuracy = recommended_accuracy
+
+    def format(self) -> str:
+        width = max(len(label) for label in self.labels)
+        lines = [
+            f"== {self.flow}",
+            f"threshold {self.threshold:.2f}: accuracy {self.accuracy:.3f}",
+            f"recommended threshold {self.recommended_threshold:.2f}: "
+            f"accuracy {self.recommended_accuracy:.3f}",
+            "confusion matrix (rows expected, columns predicted):",
+        ]
+        for row, label in enumerate(self.labels):
+            counts = " ".join(
+                f"{count:4d}" for count in self.confusion[row].tolist()
+            )
+            lines.append(f"  [{row:2d}] {label:<{width}} {counts}")
+        return "\n".join(lines)
+
+
+def confusion_matrix(
+    expected: np.ndarray, predicted: np.ndarray, size: int
+) -> np.ndarray:
+    return np.bincount(expected * size + predicted, minlength=size * size)[
+        : size * size
+    ].reshape(size, size)
+
+
+def recommend_threshold(
+    classifier: IntentClassifier, scores: np.ndarray, expected: np.ndarray
+) -> Tuple[float, float]:
+    """Sweep all candidate thresholds at once, return the most accurate.
+
+    Ties go to the highest threshold, which misroutes the fewest callers.
+    """
+    if scores.shape[0] == 0 or scores.shape[1] == 0:
+        return classifier.threshold, 0.0
+    best = scores.max(axis=1)
+    argmax = scores.argmax(axis=1)
+    accepted = best[None, :] >= THRESHOLD_CANDIDATES[:, None]
+    predicted = np.where(accepted, argmax[None, :], len(classifier.intents))
+    accuracy = (predicted == expected[None, :]).mean(axis=1)
+    index = len(accuracy) - 1 - int(np.argmax(accuracy[::-1]))
+    return float(THRESHOLD_CANDIDATES[index]), float(accuracy[index])
+
+
+def evaluate(
+    flow: str,
+    classifier: IntentClassifier,
+    utterances: Optional[List[str]] = None,
+    labels: Optional[List[Optional[str]]] = None,
+) -> FlowReport:
+    if utterances is None:
+        scores = classifier.score_training_phrases()
+        expected = classifier.phrase_intent
+    else:
+        scores = classifier.score(utterances)
+        expected = classifier.label_indexes(labels or [])
+    size = len(classifier.intents) + 1
+    predicted = classifier.predict(scores)
+    recommended, recommended_accuracy = recommend_threshold(
+        classifier, scores, expected
+    )
+    return FlowReport(
+        flow=flow,
+        labels=classifier.intents + [NO_MATCH],
+        confusion=confusion_matrix(expected, predicted, size),
+        threshold=classifier.threshold,
+        accuracy=float((predicted == expected).mean()) if len(expected) else 0,
+        recommended_threshold=recommended,
+        recommended_accuracy=recommended_accuracy,
+    )
+
+
+def flow_classifiers(
+    graph: Optional[AgentGraph] = None,
+) -> Dict[str, IntentClassifier]:
+    """One classifier per flow, from a graph snapshot or our resources."""
+    if graph is None:
+        return {
+            flow: IntentClassifier(intents, threshold)
+            for flow, (intents, threshold) in FLOW_INTENTS.items()
+        }
+
+    classifiers = {}
+    for flow in graph.flows.values():
+        routes = list(flow.routes)
+        for page in flow.pages.values():
+            routes.extend(page.routes)
+        names = sorted({route.intent for route in routes if route.intent})
+        if not names:
+            continue
+        classifiers[flow.name] = IntentClassifier(
+            {name: graph.intents.get(name, []) for name in names},
+            flow.nlu_threshold or DEFAULT_THRESHOLD,
+        )
+    return classifiers
+
+
+def load_corpus(path: str) -> Dict[str, List[Tuple[str, Optional[str]]]]:
+    corpus = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                item = json.loads(line)
+                corpus[item["flow"]].append((item["text"], item.get("intent")))
+    return corpus
+
+
+def main(corpus_path: Optional[str] = None, graph_path: Optional[str] = None):
+    graph = AgentGraph.load(graph_path) if graph_path else None
+    corpus = load_corpus(corpus_path) if corpus_path else None
+    for flow, classifier in flow_classifiers(graph).items():
+        if corpus is None:
+            report = evaluate(flow, classifier)
+        elif flow in corpus:
+            texts, labels = zip(*corpus[flow])
+            report = evaluate(flow, classifier, list(texts), list(labels))
+        else:
+            continue
+        print(report.format(), end="\n\n")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
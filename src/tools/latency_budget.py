@@ -0,0 +1,354 @@
+"""
+Static latency budget per conversation path
+
+Enumerates the paths through the agent graph (`tools.paths`) and counts
+the webhook calls, page transitions, prompts and caller inputs on each.
+Latency is estimated from per-tag webhook latencies and a fixed cost per
+page transition:
+
+    expected   every webhook answers in its expected time
+    worst      every webhook runs into the timeout, unless a worst case
+               below it is given
+
+Both are reported for the whole path and for its slowest turn, the dead
+air between a caller input and the next prompt. The budgets are for what
+the caller waits in one turn: paths whose slowest turn is expected to
+take more than `--budget-ms`, or takes more than `--worst-budget-ms` in
+the worst case, are flagged, and the command exits with 1 then.
+
+Latencies come from `--latency TAG=EXPECTED_MS[:WORST_MS]` or a JSON file
+of {"tag": {"expected_ms": ..., "worst_ms": ...}}:
+
+    cd src && python -m tools.latency_budget agent_graph.json \\
+        --latency authenticate=400 --latency find_appointments=900:4000 \\
+        --budget-ms 3000
+
+With `--pages` the report is per page the caller answers on instead: the
+speech and DTMF settings in effect there (`utils.SPEECH_PROFILES`), how
+many path inputs it takes and the slowest turn leading up to it. It does
+not check the budgets.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import utils
+from tools.agent_graph import AgentGraph
+from tools.paths import MAX_STEPS, MAX_VISITS, Path, enumerate_paths
+
+DEFAULT_EXPECTED_MS = 300.0
+DEFAULT_WORST_MS = utils.WEBHOOK_TIMEOUT_SECONDS * 1000.0
+HOP_MS = 20.0
+BUDGET_MS = 3000.0
+MAX_PATHS = 100000
+
+
+class WebhookLatency:
+    def __init__(
+        self,
+        *,
+        expected_ms: float = DEFAULT_EXPECTED_MS,
+        worst_ms: float = DEFAULT_WORST_MS,
+    ):
+        self.expected_ms = expected_ms
+        self.worst_ms = worst_ms
+
+    @classmethod
+    def parse(cls, spec: str) -> "WebhookLatency":
+        expected, _, worst = spec.partition(":")
+        return cls(
+            expected_ms=float(expected),
+            worst_ms=float(worst) if worst else DEFAULT_WORST_MS,
+        )
+
+
+class PathEstimate:
+    def __init__(
+        self,
+        *,
+        path: Path,
+        expected_ms: float,
+        worst_ms: float,
+        expected_turn_ms: float,
+        worst_turn_ms: float,
+        turns: Optional[List[Tuple[float, float]]] = None,
+    ):
+        self.path = path
+        self.expected_ms = expected_ms
+        self.worst_ms = worst_ms
+        # slowest single turn, what one caller input waits for
+        self.expected_turn_ms = expected_turn_ms
+        self.worst_turn_ms = worst_turn_ms
+        # (expected, worst) of every turn
+        self.turns = turns or []
+        self.over_budget = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        path = self.path
+        return {
+            "flows": path.flows,
+            "end": path.end,
+            "pages": len(path.pages),
+            "webhook_calls": [tag for _, tag in path.webhook_calls],
+            "prompts": path.prompts,
+            "inputs": path.inputs,
+            "expected_ms": self.expected_ms,
+            "worst_ms": self.worst_ms,
+            "expected_turn_ms": self.expected_turn_ms,
+            "worst_turn_ms": self.worst_turn_ms,
+            "over_budget": self.over_budget,
+        }
+
+
+def estimate(
+    path: Path,
+    latencies: Dict[str, WebhookLatency],
+    hop_ms: float = HOP_MS,
+) -> PathEstimate:
+    default = latencies.get("default") or WebhookLatency()
+    totals: List[Tuple[float, float]] = []
+    for turn in path.turns():
+        expected = worst = 0.0
+        for kind, value in turn:
+            if kind == "page":
+                expected += hop_ms
+                worst += hop_ms
+            elif kind == "webhook":
+                latency = latencies.get(value[1] or "", default)
+                expected += latency.expected_ms
+                worst += latency.worst_ms
+        totals.append((expected, worst))
+    return PathEstimate(
+        path=path,
+        expected_ms=sum(expected for expected, _ in totals),
+        worst_ms=sum(worst for _, worst in totals),
+        expected_turn_ms=max(expected for expected, _ in totals),
+        worst_turn_ms=max(worst for _, worst in totals),
+        turns=totals,
+    )
+
+
+def analyze(
+    graph: AgentGraph,
+    latencies: Dict[str, WebhookLatency],
+    *,
+    hop_ms: float = HOP_MS,
+    budget_ms: Optional[float] = BUDGET_MS,
+    worst_budget_ms: Optional[float] = None,
+    max_steps: int = MAX_STEPS,
+    max_visits: int = MAX_VISITS,
+    max_paths: int = MAX_PATHS,
+) -> List[PathEstimate]:
+    """Estimates of every path, slowest worst case turn first."""
+    estimates: List[PathEstimate] = []
+    for path in enumerate_paths(
+        graph, max_steps=max_steps, max_visits=max_visits
+    ):
+        if len(estimates) >= max_paths:
+            utils.logger.warning(f"Stopped after {max_paths} paths")
+            break
+        path_estimate = estimate(path, latencies, hop_ms)
+        path_estimate.over_budget = (
+            budget_ms is not None
+            and path_estimate.expected_turn_ms > budget_ms
+        ) or (
+            worst_budget_ms is not None
+            and path_estimate.worst_turn_ms > worst_budget_ms
+        )
+        estimates.append(path_estimate)
+    estimates.sort(key=lambda e: (-e.worst_turn_ms, -e.expected_turn_ms))
+    return estimates
+
+
+class ListeningPage:
+    """A page the caller answers on, over all paths."""
+
+    def __init__(self, *, flow: str, page: str, settings: Dict[str, Any]):
+        self.flow = flow
+        self.page = page
+        self.settings = settings
+        self.inputs = 0
+        # slowest turn before the caller answers here
+        self.expected_turn_ms = 0.0
+        self.worst_turn_ms = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "flow": self.flow,
+            "page": self.page,
+            "advanced_settings": self.settings,
+            "inputs": self.inputs,
+            "expected_turn_ms": self.expected_turn_ms,
+            "worst_turn_ms": self.worst_turn_ms,
+        }
+
+
+def input_pages(path: Path) -> List[Tuple[str, str]]:
+    """Page each caller input of the path is given on."""
+    pages = []
+    page = None
+    for kind, value in path.steps:
+        if kind == "page":
+            page = value
+        elif kind == "input" and page is not None:
+            pages.append(page)
+    return pages
+
+
+def listening_pages(
+    graph: AgentGraph, estimates: List[PathEstimate]
+) -> List[ListeningPage]:
+    """Pages the caller answers on, most inputs first."""
+    pages: Dict[Tuple[str, str], ListeningPage] = {}
+    for path_estimate in estimates:
+        # turn i ends with input i
+        for key, (expected, worst) in zip(
+            input_pages(path_estimate.path), path_estimate.turns
+        ):
+            if key not in pages:
+                pages[key] = ListeningPage(
+                    flow=key[0],
+                    page=key[1],
+                    settings=graph.speech_settings(*key),
+                )
+            page = pages[key]
+            page.inputs += 1
+            page.expected_turn_ms = max(page.expected_turn_ms, expected)
+            page.worst_turn_ms = max(page.worst_turn_ms, worst)
+    return sorted(pages.values(), key=lambda p: (-p.inputs, p.flow, p.page))
+
+
+def describe_settings(settings: Dict[str, Any]) -> str:
+    speech = settings.get("speech_settings", {})
+    dtmf = settings.get("dtmf_settings", {})
+    parts = []
+    if "endpointer_sensitivity" in speech:
+        parts.append(f"endpointer {speech['endpointer_sensitivity']}")
+    if "no_speech_timeout" in speech:
+        parts.append(f"no speech {speech['no_speech_timeout']}")
+    if dtmf.get("enabled"):
+        parts.append(
+            f"dtmf {dtmf.get('max_digits', '?')}{dtmf.get('finish_digit', '')}"
+        )
+    return ", ".join(parts) or "agent default"
+
+
+def load_latencies(
+    specs: List[str], path: Optional[str] = None
+) -> Dict[str, WebhookLatency]:
+    latencies = {}
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            for tag, values in json.load(file).items():
+                latencies[tag] = WebhookLatency(**values)
+    for item in specs:
+        tag, separator, spec = item.partition("=")
+        if not separator:
+            raise ValueError(
+                f"Expected TAG=EXPECTED_MS[:WORST_MS], got {item}"
+            )
+        latencies[tag] = WebhookLatency.parse(spec)
+    return latencies
+
+
+def print_report(estimates: List[PathEstimate], top: int, verbose: bool):
+    flagged = [e for e in estimates if e.over_budget]
+    print(
+        f"{len(estimates)} paths, {len(flagged)} over budget, "
+        f"{sum(e.path.truncated for e in estimates)} truncated"
+    )
+    print(
+        f"{'expected ms':>12}{'worst ms':>10}{'expected turn':>15}"
+        f"{'worst turn':>12}{'webhooks':>10}{'pages':>7}{'prompts':>9}  path"
+    )
+    for path_estimate in (flagged or estimates)[:top]:
+        path = path_estimate.path
+        print(
+            f"{path_estimate.expected_ms:>12.0f}"
+            f"{path_estimate.worst_ms:>10.0f}"
+            f"{path_estimate.expected_turn_ms:>15.0f}"
+            f"{path_estimate.worst_turn_ms:>12.0f}"
+            f"{len(path.webhook_calls):>10}{len(path.pages):>7}"
+            f"{path.prompts:>9}  "
+            + " > ".join(path.flows)
+            + f" [{path.end}]"
+            + (" OVER BUDGET" if path_estimate.over_budget else "")
+        )
+        if verbose:
+            for flow, page in path.pages:
+                print(f"{'':>12}  {flow} / {page}")
+            for _, tag in path.webhook_calls:
+                print(f"{'':>12}  webhook {tag}")
+
+
+def print_pages(pages: List[ListeningPage], top: int):
+    print(
+        f"{len(pages)} pages take caller input\n"
+        f"{'inputs':>8}{'expected turn':>15}{'worst turn':>12}  "
+        "page  [settings]"
+    )
+    for page in pages[:top]:
+        print(
+            f"{page.inputs:>8}{page.expected_turn_ms:>15.0f}"
+            f"{page.worst_turn_ms:>12.0f}  {page.flow} / {page.page}"
+            f"  [{describe_settings(page.settings)}]"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="TAG=EXPECTED_MS[:WORST_MS]",
+        help="webhook latency per tag, default=... for the other tags",
+    )
+    parser.add_argument("--latency-file", help="JSON latencies per tag")
+    parser.add_argument("--hop-ms", type=float, default=HOP_MS)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--worst-budget-ms", type=float)
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--max-visits", type=int, default=MAX_VISITS)
+    parser.add_argument("--max-paths", type=int, default=MAX_PATHS)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument(
+        "--pages",
+        action="store_true",
+        help="report the pages taking caller input and their settings",
+    )
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    estimates = analyze(
+        graph,
+        load_latencies(args.latency, args.latency_file),
+        hop_ms=args.hop_ms,
+        budget_ms=args.budget_ms,
+        worst_budget_ms=args.worst_budget_ms,
+        max_steps=args.max_steps,
+        max_visits=args.max_visits,
+        max_paths=args.max_paths,
+    )
+    if args.pages:
+        pages = listening_pages(graph, estimates)
+        if args.json:
+            print(json.dumps([p.to_dict() for p in pages], indent=2))
+        else:
+            print_pages(pages, args.top)
+        return
+    if args.json:
+        print(json.dumps([e.to_dict() for e in estimates], indent=2))
+    else:
+        print_report(estimates, args.top, args.verbose)
+    if any(e.over_budget for e in estimates):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Page and route coverage of test conversations over the agent's paths
+
+Enumerates the conversation paths (`tools.paths`, bounded by
+`--max-steps` and `--max-visits`, walked by `--workers` processes) and
+checks which of their pages and routes the given conversations hit:
+
+    scripts    simulator scripts (`tools.simulator`), run offline
+    logs       logged conversations, newline-delimited JSON with one
+               {"conversation": ..., "flow": ..., "page": ...} record
+               per turn, the page the turn ended on
+
+A logged turn only shows the page it ended on, so a log covers a route
+when it leads straight from one logged page to the next (or to the flow
+of the next page); the pages and routes run through within one turn are
+not seen.
+
+A path counts as covered when one conversation took every route on it.
+Uncovered routes are ranked by traffic: the visits of their page in the
+`--traffic` logs (production calls, same format) if given, otherwise
+the number of enumerated paths they are on.
+
+    cd src && python -m tools.path_coverage agent_graph.json \\
+        --scripts tests/*.json --logs test_calls.ndjson \\
+        --traffic production.ndjson --workers 4 --matrix coverage.csv
+
+The matrix has a row per conversation and a column per page and route,
+with the times the conversation hit them.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from tools import compact_graph
+from tools.agent_graph import START_PAGE, AgentGraph
+from tools.compact_graph import NONE, CompactGraph
+from tools.paths import MAX_STEPS, MAX_VISITS, Path, enumerate_paths
+from tools.simulator import run_script
+
+MAX_PATHS = 1000000
+
+
+class Conversation:
+    """Pages and routes one conversation hit, by compact node / route."""
+
+    def __init__(self, *, name: str):
+        self.name = name
+        self.pages: Counter = Counter()
+        self.routes: Counter = Counter()
+
+
+def route_id(compact: CompactGraph, flow: str, owner: str, index: int) -> int:
+    node = compact.node(flow, owner)
+    if node == NONE:
+        return NONE
+    return compact.route_offsets[node] + index
+
+
+def script_conversation(
+    compact: CompactGraph, graph: AgentGraph, name: str, script
+) -> Conversation:
+    result, _ = run_script(graph, script)
+    conversation = Conversation(name=name)
+    for turn in result.turns:
+        for flow, page in turn.pages:
+            conversation.pages[compact.node(flow, page)] += 1
+        for flow, owner, index in turn.routes:
+            conversation.routes[route_id(compact, flow, owner, index)] += 1
+    conversation.pages.pop(NONE, None)
+    conversation.routes.pop(NONE, None)
+    return conversation
+
+
+def _routes_between(compact: CompactGraph, source: int, target: int):
+    target_flow = compact.node_flow[target]
+    for route in compact.routes(source):
+        kind = compact.route_target_kind[route]
+        if (
+            kind == compact_graph.TARGET_NODE
+            and compact.route_target[route] == target
+        ) or (
+            kind == compact_graph.TARGET_FLOW
+            and compact.route_target[route] == target_flow
+            and compact.node_flow[source] != target_flow
+        ):
+            yield route
+
+
+def read_log(compact: CompactGraph, path: str) -> List[Conversation]:
+    """Conversations of a log, read line by line."""
+    conversations: Dict[str, Conversation] = {}
+    last: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            name = str(record["conversation"])
+            node = compact.node(record["flow"], record.get("page", START_PAGE))
+            conversation = conversations.setdefault(
+                name, Conversation(name=name)
+            )
+            if node == NONE:
+                continue
+            conversation.pages[node] += 1
+            if name in last:
+                for route in _routes_between(compact, last[name], node):
+                    conversation.routes[route] += 1
+            last[name] = node
+    return list(conversations.values())
+
+
+def page_traffic(conversations: Iterable[Conversation]) -> Counter:
+    traffic: Counter = Counter()
+    for conversation in conversations:
+        traffic.update(conversation.pages)
+    return traffic
+
+
+class PathCoverage:
+    def __init__(
+        self, compact: CompactGraph, conversations: List[Conversation]
+    ):
+        self.compact = compact
+        self.conversations = conversations
+        self.paths = 0
+        self.truncated = 0
+        self.covered_paths = 0
+        # pages and routes on enumerated paths, with the paths on them
+        self.path_pages: Counter = Counter()
+        self.path_routes: Counter = Counter()
+        # conversations that hit a route, as a bitset
+        self._route_hits: Dict[int, int] = {}
+        for bit, conversation in enumerate(conversations):
+            for route in conversation.routes:
+                self._route_hits[route] = (
+                    self._route_hits.get(route, 0) | 1 << bit
+                )
+        self._everyone = (1 << len(conversations)) - 1
+
+    def add(self, path: Path):
+        compact = self.compact
+        self.paths += 1
+        self.truncated += path.truncated
+        self.path_pages.update(
+            {compact.node(flow, page) for flow, page in path.pages}
+        )
+        routes = {route_id(compact, *route) for route in path.routes}
+        self.path_routes.update(routes)
+        hit_all = self._everyone
+        if not hit_all:
+            return
+        for route in routes:
+            hit_all &= self._route_hits.get(route, 0)
+            if not hit_all:
+                return
+        self.covered_paths += 1
+
+    def covered_pages(self) -> set:
+        return {
+            node
+            for conversation in self.conversations
+            for node in conversation.pages
+        }
+
+    def covered_routes(self) -> set:
+        return set(self._route_hits)
+
+    def uncovered_routes(
+        self, traffic: Optional[Counter] = None
+    ) -> List[Dict[str, Any]]:
+        covered = self.covered_routes()
+        routes: List[Dict[str, Any]] = []
+        for node in range(self.compact.node_count):
+            for route in self.compact.routes(node):
+                if route in covered or route not in self.path_routes:
+                    continue
+                routes.append(
+                    {
+                        "route": describe_route(self.compact, node, route),
+                        "traffic": (
+                            traffic[node]
+                            if traffic is not None
+                            else self.path_routes[route]
+                        ),
+                        "paths": self.path_routes[route],
+                    }
+                )
+        routes.sort(key=lambda r: (-r["traffic"], -r["paths"]))
+        return routes
+
+    def summary(self) -> Dict[str, Any]:
+        pages = [
+            node
+            for node in range(self.compact.node_count)
+            if not self.compact.is_start(node)
+        ]
+        covered_pages = self.covered_pages()
+        covered_routes = self.covered_routes()
+        return {
+            "conversations": len(self.conversations),
+            "paths": self.paths,
+            "truncated_paths": self.truncated,
+            "covered_paths": self.covered_paths,
+            "pages": len(pages),
+            "pages_on_paths": sum(
+                1 for node in pages if node in self.path_pages
+            ),
+            "covered_pages": sum(1 for node in pages if node in covered_pages),
+            "routes": len(self.compact.route_intent),
+            "routes_on_paths": len(self.path_routes),
+            "covered_routes": sum(
+                1 for route in self.path_routes if route in covered_routes
+            ),
+        }
+
+
+def describe_route(compact: CompactGraph, node: int, route: int) -> str:
+    flow, page = compact.key(node)
+    kind = compact.route_target_kind[route]
+    target = compact.route_target[route]
+    if kind == compact_graph.TARGET_NODE:
+        target_name = compact.page_of(target)
+    elif kind == compact_graph.TARGET_FLOW:
+        target_name = f"flow {compact.flow_names[target]}"
+    elif kind == compact_graph.TARGET_NONE:
+        target_name = "(stays)"
+    else:
+        target_name = compact.names[target]
+    intent = compact.route_intent[route]
+    condition = compact.route_condition[route]
+    trigger = (
+        compact.intents[intent]
+        if intent != NONE
+        else compact.conditions[condition]
+        if condition != NONE
+        else "true"
+    )
+    index = route - compact.route_offsets[node]
+    return f"{flow} / {page} #{index} [{trigger}] -> {target_name}"
+
+
+def write_matrix(
+    path: str, compact: CompactGraph, conversations: List[Conversation]
+):
+    pages = [
+        node
+        for node in range(compact.node_count)
+        if not compact.is_start(node)
+    ]
+    routes = [
+        (node, route)
+        for node in range(compact.node_count)
+        for route in compact.routes(node)
+    ]
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["conversation"]
+            + [" / ".join(compact.key(node)) for node in pages]
+            + [
+                f"{' / '.join(compact.key(node))} "
+                f"#{route - compact.route_offsets[node]}"
+                for node, route in routes
+            ]
+        )
+        for conversation in conversations:
+            writer.writerow(
+                [conversation.name]
+                + [conversation.pages[node] for node in pages]
+                + [conversation.routes[route] for _, route in routes]
+            )
+
+
+def print_report(summary: Dict[str, Any], uncovered, top: int):
+    print(
+        f"paths          {summary['covered_paths']:>8} of "
+        f"{summary['paths']} covered, {summary['truncated_paths']} "
+        "truncated"
+    )
+    print(
+        f"pages          {summary['covered_pages']:>8} of "
+        f"{summary['pages_on_paths']} on paths covered "
+        f"({summary['pages']} pages)"
+    )
+    print(
+        f"routes         {summary['covered_routes']:>8} of "
+        f"{summary['routes_on_paths']} on paths covered "
+        f"({summary['routes']} routes)"
+    )
+    if uncovered:
+        print(f"\nuncovered routes, top {min(top, len(uncovered))}:")
+        print(f"{'traffic':>8} {'paths':>8}  route")
+        for route in uncovered[:top]:
+            print(
+                f"{route['traffic']:>8} {route['paths']:>8}  "
+                f"{route['route']}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("agent_graph", help="agent graph JSON")
+    parser.add_argument(
+        "--scripts", nargs="*", default=[], help="simulator scripts"
+    )
+    parser.add_argument(
+        "--logs", nargs="*", default=[], help="logged test conversations"
+    )
+    parser.add_argument(
+        "--traffic", nargs="*", default=[], help="logged production calls"
+    )
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--max-visits", type=int, default=MAX_VISITS)
+    parser.add_argument("--max-paths", type=int, default=MAX_PATHS)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--matrix", help="write the coverage matrix CSV")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    args = parser.parse_args(argv)
+
+    graph = AgentGraph.load(args.agent_graph)
+    compact = CompactGraph.from_graph(graph)
+    conversations = []
+    for script_path in args.scripts:
+        with open(script_path, "r", encoding="utf-8") as file:
+            script = json.load(file)
+        conversations.append(
+            script_conversation(compact, graph, script_path, script)
+        )
+    for log_path in args.logs:
+        conversations.extend(read_log(compact, log_path))
+    traffic = None
+    if args.traffic:
+        traffic = page_traffic(
+            conversation
+            for log_path in args.traffic
+            for conversation in read_log(compact, log_path)
+        )
+
+    coverage = PathCoverage(compact, conversations)
+    for path in itertools.islice(
+        enumerate_paths(
+            graph,
+            compact=compact,
+            max_steps=args.max_steps,
+            max_visits=args.max_visits,
+            workers=args.workers,
+        ),
+        args.max_paths,
+    ):
+        coverage.add(path)
+
+    if args.matrix:
+        write_matrix(args.matrix, compact, conversations)
+    summary = coverage.summary()
+    uncovered = coverage.uncovered_routes(traffic)
+    if args.json:
+        print(
+            json.dumps(
+                {**summary, "uncovered_routes": uncovered[: args.top]},
+                indent=2,
+            )
+        )
+    else:
+        print_report(summary, uncovered, args.top)
+    if coverage.paths >= args.max_paths:
+        print(
+            f"stopped after {args.max_paths} paths, see --max-paths",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
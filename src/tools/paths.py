@@ -0,0 +1,463 @@
+"""
+Conversation path enumeration over the agent graph
+
+Walks the graph the way the simulator runs it, but takes every route
+instead of evaluating conditions: a path is one sequence of pages, routes,
+webhook calls, prompts and caller inputs from the START page of the start
+flow to the end of the session.
+
+Statically every condition may be true, with two exceptions that keep the
+paths to the ones CX can take:
+- a condition route that is always true ("true" or no condition) shadows
+  the condition routes after it
+- a page resuming after a sub-flow returned with END_FLOW does not take
+  the route that called the sub-flow again (nor the routes without a
+  target it took before it), that condition was what the sub-flow was
+  there to change (a patient is authenticated now, ...). The simulator
+  resumes a caller the same way, so the returns of a path replay there
+
+Event handlers are only followed for the failure events a sub-flow raises
+on its caller (flow.failed, flow.failed.human-escalation); no-match,
+no-input and webhook errors are left to the simulator. Paths stop after
+`max_steps` steps or when a page would be entered more than `max_visits`
+times on one path, and are marked truncated then. Large agents can be
+walked by a pool of processes, `enumerate_paths(graph, workers=4)`.
+
+The walk runs on the `CompactGraph` of the agent, pages are integer nodes
+and their routes array ranges, steps still name flows and pages.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import utils
+from tools import compact_graph
+from tools.agent_graph import START_PAGE, AgentGraph, Flow, Fulfillment, Page
+from tools.compact_graph import NONE, CompactGraph
+
+END_FLOW = utils.SymbolicPages.END_FLOW.value
+END_SESSION = utils.SymbolicPages.END_SESSION.value
+END_FLOW_EVENTS = {
+    utils.SymbolicPages.END_FLOW_WITH_FAILURE.value: (
+        utils.EventNames.FLOW_FAILED.value
+    ),
+    utils.SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION.value: (
+        utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION.value
+    ),
+}
+# an unhandled human escalation is handled as a flow failure
+EVENT_FALLBACKS = {
+    utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION.value: (
+        utils.EventNames.FLOW_FAILED.value
+    ),
+}
+MAX_STEPS = 400
+MAX_VISITS = 2
+SPLIT_DEPTH = 3
+SHARDS_PER_WORKER = 4
+
+# where a fulfillment lives: (flow, owner page or START, part, key) with
+# part "entry" (key None), "form" (parameter name), "route" or "event"
+# (index in the owner's routes / event handlers)
+Site = Tuple[str, str, str, Any]
+
+
+class Path:
+    """One conversation path, as the steps it takes.
+
+    Steps are (kind, value) with kind one of
+        page         (flow, page) entered
+        route        (flow, owner page, index) taken
+        event        (flow, event) handled
+        fulfillment  site of the fulfillment that runs next, see `Site`
+        webhook      (webhook, tag) called
+        prompt       message played
+        input        form parameter or intent the caller gives
+    """
+
+    def __init__(self, *, steps: List[Tuple[str, Any]], end: str):
+        self.steps = steps
+        # END_SESSION, a symbolic end page of the start flow, "no route"
+        # when a page has nowhere to go, or "truncated"
+        self.end = end
+
+    @property
+    def truncated(self) -> bool:
+        return self.end == "truncated"
+
+    def values(self, kind: str) -> List[Any]:
+        return [value for step, value in self.steps if step == kind]
+
+    @property
+    def pages(self) -> List[Tuple[str, str]]:
+        return self.values("page")
+
+    @property
+    def routes(self) -> List[Tuple[str, str, int]]:
+        return self.values("route")
+
+    @property
+    def webhook_calls(self) -> List[Tuple[str, Optional[str]]]:
+        return self.values("webhook")
+
+    @property
+    def prompts(self) -> int:
+        return len(self.values("prompt"))
+
+    @property
+    def inputs(self) -> int:
+        return len(self.values("input"))
+
+    @property
+    def flows(self) -> List[str]:
+        """Flows in the order they are entered, repeats collapsed."""
+        flows: List[str] = []
+        for flow, _ in self.pages:
+            if not flows or flows[-1] != flow:
+                flows.append(flow)
+        return flows
+
+    def turns(self) -> List[List[Tuple[str, Any]]]:
+        """Steps between caller inputs, what runs while the caller waits."""
+        turns: List[List[Tuple[str, Any]]] = [[]]
+        for step in self.steps:
+            if step[0] == "input":
+                turns.append([])
+            else:
+                turns[-1].append(step)
+        return turns
+
+
+def is_always_true(condition: Optional[str]) -> bool:
+    return not condition or condition.strip().lower() == "true"
+
+
+def _site_owner(graph: AgentGraph, site: Site):
+    flow, owner, part, key = site
+    item: Union[Flow, Page]
+    if owner == START_PAGE:
+        item = graph.flows[flow]
+    else:
+        item = graph.get_page(flow, owner)
+    if part == "route":
+        return item.routes[key], "trigger_fulfillment"
+    if part == "event":
+        return item.event_handlers[key], "trigger_fulfillment"
+    # forms and entry fulfillments only exist on pages
+    page = graph.get_page(flow, owner)
+    if part == "form":
+        parameter = next(p for p in page.form if p.name == key)
+        return parameter, "initial_prompt"
+    return page, "entry_fulfillment"
+
+
+def get_fulfillment(graph: AgentGraph, site: Site) -> Optional[Fulfillment]:
+    item, attribute = _site_owner(graph, site)
+    return getattr(item, attribute)
+
+
+def set_fulfillment(
+    graph: AgentGraph, site: Site, fulfillment: Optional[Fulfillment]
+):
+    item, attribute = _site_owner(graph, site)
+    setattr(item, attribute, fulfillment)
+
+
+class PathEnumerator:
+    """Depth first walk over the paths of the agent.
+
+    With `shard=(index, count)` only the paths of one shard are walked:
+    routes are numbered in walk order where a path takes its
+    `split_depth`-th branch (a page with more than one route it can
+    take), and shard i follows the ones numbered i modulo count. Paths
+    that end before that branch belong to shard 0. Together the shards
+    give every path once.
+    """
+
+    def __init__(
+        self,
+        graph: Optional[AgentGraph] = None,
+        *,
+        max_steps: int = MAX_STEPS,
+        max_visits: int = MAX_VISITS,
+        compact: Optional[CompactGraph] = None,
+        shard: Tuple[int, int] = (0, 1),
+        split_depth: int = SPLIT_DEPTH,
+    ):
+        # the walk runs on the compact form, pass one to share it
+        if compact is None:
+            if graph is None:
+                raise ValueError("A graph or its compact form is required")
+            compact = CompactGraph.from_graph(graph)
+        self.compact = compact
+        self.max_steps = max_steps
+        self.max_visits = max_visits
+        self.shard = shard
+        self.split_depth = split_depth
+        self._steps: List[Tuple[str, Any]] = []
+        self._visits: List[int] = []
+        # [node, previous node, routes not to retake on return]
+        self._frames: List[List[Any]] = []
+        # branches taken on the current path, and routes numbered so far
+        # at the split depth
+        self._depth = 0
+        self._split_routes = 0
+
+    def paths(self, start_flow: Optional[str] = None) -> Iterator[Path]:
+        compact = self.compact
+        if start_flow:
+            node = compact.node(start_flow)
+        else:
+            node = compact.flow_start[compact.start_flow]
+        self._steps = []
+        self._visits = [0] * compact.node_count
+        self._frames = [[node, node, frozenset()]]
+        self._depth = self._split_routes = 0
+        for path in self._enter():
+            # the walk is suspended on the path, past the split or not
+            if self._depth > self.split_depth or self.shard[0] == 0:
+                yield path
+
+    def _path(self, end: str) -> Path:
+        return Path(steps=list(self._steps), end=end)
+
+    def _fulfill(self, index: int, site: Site):
+        if index == NONE:
+            return
+        self._steps.append(("fulfillment", site))
+        fulfillment = self.compact.fulfillments[index]
+        if fulfillment.webhook:
+            self._steps.append(
+                ("webhook", (fulfillment.webhook, fulfillment.tag))
+            )
+        for message in fulfillment.messages:
+            self._steps.append(("prompt", message))
+
+    def _enter(self) -> Iterator[Path]:
+        compact = self.compact
+        node = self._frames[-1][0]
+        if (
+            self._visits[node] >= self.max_visits
+            or len(self._steps) >= self.max_steps
+        ):
+            yield self._path("truncated")
+            return
+        self._visits[node] += 1
+        mark = len(self._steps)
+        flow, page_name = compact.key(node)
+        self._steps.append(("page", (flow, page_name)))
+        if not compact.is_start(node):
+            self._fulfill(
+                compact.node_entry[node], (flow, page_name, "entry", None)
+            )
+            for parameter in compact.form(node):
+                if compact.form_required[parameter]:
+                    name = compact.names[compact.form_parameter[parameter]]
+                    self._fulfill(
+                        compact.form_prompt[parameter],
+                        (flow, page_name, "form", name),
+                    )
+                    self._steps.append(("input", name))
+        yield from self._routes(frozenset())
+        del self._steps[mark:]
+        self._visits[node] -= 1
+
+    def _routes(self, taken: frozenset) -> Iterator[Path]:
+        compact = self.compact
+        node = self._frames[-1][0]
+        flow, page_name = compact.key(node)
+        routes = compact.routes(node)
+        candidates = []
+        for route in routes:
+            if route - routes.start in taken:
+                continue
+            candidates.append(route)
+            if compact.is_unconditional(route):
+                break
+        if not candidates:
+            yield self._path("no route")
+            return
+        branch = len(candidates) > 1
+        for route in candidates:
+            if branch and self._depth == self.split_depth:
+                self._split_routes += 1
+                if self._split_routes % self.shard[1] != self.shard[0]:
+                    continue
+            index = route - routes.start
+            mark = len(self._steps)
+            intent = compact.route_intent[route]
+            if intent != NONE:
+                self._steps.append(("input", compact.intents[intent]))
+            self._steps.append(("route", (flow, page_name, index)))
+            self._fulfill(
+                compact.route_fulfillment[route],
+                (flow, page_name, "route", index),
+            )
+            self._depth += branch
+            yield from self._follow(
+                compact.route_target_kind[route],
+                compact.route_target[route],
+                taken | {index},
+            )
+            self._depth -= branch
+            del self._steps[mark:]
+
+    def _follow(
+        self, kind: int, target: int, taken: frozenset
+    ) -> Iterator[Path]:
+        compact = self.compact
+        frame = self._frames[-1]
+        if kind == compact_graph.TARGET_MISSING_FLOW:
+            yield self._path(f"missing flow {compact.names[target]}")
+        elif kind == compact_graph.TARGET_MISSING_PAGE:
+            yield self._path(f"missing page {compact.names[target]}")
+        elif kind == compact_graph.TARGET_FLOW:
+            called_with = frame[2]
+            frame[2] = taken
+            start = compact.flow_start[target]
+            self._frames.append([start, start, frozenset()])
+            yield from self._enter()
+            self._frames.pop()
+            frame[2] = called_with
+        elif kind == compact_graph.TARGET_NODE:
+            yield from self._goto(target)
+        elif kind == compact_graph.TARGET_SYMBOLIC:
+            yield from self._symbolic(compact.names[target])
+        else:
+            # no target, the page evaluates its routes again
+            yield from self._routes(taken)
+
+    def _symbolic(self, target: str) -> Iterator[Path]:
+        frame = self._frames[-1]
+        if target == END_SESSION:
+            yield self._path(END_SESSION)
+        elif target == END_FLOW or target in END_FLOW_EVENTS:
+            yield from self._end_flow(target)
+        elif target == "START_PAGE":
+            node = frame[0]
+            yield from self._goto(
+                self.compact.flow_start[self.compact.node_flow[node]]
+            )
+        elif target == "CURRENT_PAGE":
+            yield from self._goto(frame[0])
+        elif target == "PREVIOUS_PAGE":
+            yield from self._goto(frame[1])
+        else:
+            yield self._path(f"missing page {target}")
+
+    def _goto(self, node: int) -> Iterator[Path]:
+        frame = self._frames[-1]
+        saved = list(frame)
+        frame[:] = [node, frame[0], frozenset()]
+        yield from self._enter()
+        frame[:] = saved
+
+    def _end_flow(self, mode: str) -> Iterator[Path]:
+        callee = self._frames.pop()
+        if not self._frames:
+            yield self._path(mode)
+        elif mode == END_FLOW:
+            yield from self._routes(self._frames[-1][2])
+        else:
+            yield from self._raise(END_FLOW_EVENTS[mode])
+        self._frames.append(callee)
+
+    def _raise(self, event: str) -> Iterator[Path]:
+        compact = self.compact
+        node = self._frames[-1][0]
+        flow = compact.flow_of(node)
+        owners = [node]
+        start = compact.flow_start[compact.node_flow[node]]
+        if start != node:
+            owners.append(start)
+        names = [event] + (
+            [EVENT_FALLBACKS[event]] if event in EVENT_FALLBACKS else []
+        )
+        for owner in owners:
+            handlers = compact.handlers(owner)
+            for name in names:
+                event_id = compact.events.get(name)
+                for handler in handlers:
+                    if compact.handler_event[handler] == event_id:
+                        mark = len(self._steps)
+                        self._steps.append(("event", (flow, name)))
+                        self._fulfill(
+                            compact.handler_fulfillment[handler],
+                            (
+                                flow,
+                                compact.page_of(owner),
+                                "event",
+                                handler - handlers.start,
+                            ),
+                        )
+                        yield from self._follow(
+                            compact.handler_target_kind[handler],
+                            compact.handler_target[handler],
+                            frozenset(),
+                        )
+                        del self._steps[mark:]
+                        return
+        # unhandled, the failure ends this flow as well
+        yield from self._end_flow(
+            utils.SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION.value
+            if event == utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION.value
+            else utils.SymbolicPages.END_FLOW_WITH_FAILURE.value
+        )
+
+
+def enumerate_paths(
+    graph: AgentGraph,
+    *,
+    max_steps: int = MAX_STEPS,
+    max_visits: int = MAX_VISITS,
+    compact: Optional[CompactGraph] = None,
+    workers: int = 1,
+    split_depth: int = SPLIT_DEPTH,
+) -> Iterator[Path]:
+    """Paths of the agent, walked by a pool of `workers` processes if
+    more than one, in shards of the walk (see `PathEnumerator`)."""
+    compact = compact or CompactGraph.from_graph(graph)
+    if workers <= 1:
+        return PathEnumerator(
+            compact=compact, max_steps=max_steps, max_visits=max_visits
+        ).paths()
+    return _enumerate_in_pool(
+        compact,
+        workers=workers,
+        max_steps=max_steps,
+        max_visits=max_visits,
+        split_depth=split_depth,
+    )
+
+
+# set in every worker process by `_init_worker`
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(compact: CompactGraph, settings: Dict[str, int]):
+    _worker["compact"] = compact
+    _worker["settings"] = settings
+
+
+def _enumerate_shard(shard: Tuple[int, int]) -> List[Path]:
+    return list(
+        PathEnumerator(
+            compact=_worker["compact"], shard=shard, **_worker["settings"]
+        ).paths()
+    )
+
+
+def _enumerate_in_pool(
+    compact: CompactGraph, *, workers: int, **settings: int
+) -> Iterator[Path]:
+    # more shards than workers, the subtrees differ a lot in size
+    count = workers * SHARDS_PER_WORKER
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(compact, settings),
+    ) as executor:
+        for paths in executor.map(
+            _enumerate_shard, [(index, count) for index in range(count)]
+        ):
+            yield from paths
@@ -0,0 +1,232 @@
+"""
+Training phrase conflict and near-duplicate detector
+
+Embeds every intent training phrase and every entity synonym from
+`resources.entity_types.ENTITY_TYPES` with the TF-IDF vectorizer of the
+local intent classifier. All pairs are compared on a count sketch of those
+vectors (a small dense random projection that preserves cosine similarity
+up to noise), one block of rows at a time so memory stays at
+block_size x phrases, and only pairs near the thresholds are rescored
+exactly on the sparse TF-IDF rows.
+
+Pairs are reported as
+    conflict: phrases of different owners scoring >= conflict_threshold
+    duplicate: phrases of the same intent or entity value scoring
+        >= duplicate_threshold
+
+An intent and an entity type share an owner when the entity type is named
+after the last segment of the intent (`reschedule` and
+`appointment.routing.reschedule`, `refill` and
+`appointment.routing.medication_refill`), those pairs are not reported.
+
+    cd src && python -m tools.phrase_conflicts
+"""
+
+import sys
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import utils
+from resources import desired_action_intents, wrapup_intents
+from resources.entity_types import ENTITY_TYPES
+from tools.intent_classifier import TfidfVectorizer
+
+CONFLICT_THRESHOLD = 0.8
+DUPLICATE_THRESHOLD = 0.95
+BLOCK_SIZE = 1024
+SKETCH_DIMENSIONS = 256
+# sketch scores this far below the thresholds are still rescored exactly
+SKETCH_MARGIN = 0.25
+
+
+class Phrase:
+    def __init__(self, *, text: str, source: str, owner: str):
+        self.text = text
+        self.source = source
+        self.owner = owner
+
+    def __repr__(self):
+        return f"{self.source}: {self.text!r}"
+
+
+class Conflict:
+    def __init__(self, *, kind: str, left: Phrase, right: Phrase, score):
+        self.kind = kind
+        self.left = left
+        self.right = right
+        self.score = float(score)
+
+    def __str__(self):
+        return (
+            f"{self.kind} {self.score:.2f} "
+            f"[{self.left.source}] {self.left.text!r} <> "
+            f"[{self.right.source}] {self.right.text!r}"
+        )
+
+
+def known_intents() -> Dict[str, List[str]]:
+    """Every intent this repo deploys."""
+    return {**desired_action_intents.INTENTS, **wrapup_intents.INTENTS}
+
+
+def collect_phrases(
+    intents: Dict[str, List[str]],
+    entity_types: Optional[Dict[str, Dict[str, List[str]]]] = None,
+) -> List[Phrase]:
+    phrases = []
+    owners = {name: name.rsplit(".", 1)[-1].lower() for name in intents}
+    for display_name, texts in intents.items():
+        for text in texts:
+            phrases.append(
+                Phrase(
+                    text=text, source=display_name, owner=owners[display_name]
+                )
+            )
+    for display_name, entities in (entity_types or {}).items():
+        name = display_name.lower()
+        owner = next(
+            (
+                owner
+                for owner in owners.values()
+                if owner == name or owner.endswith(f"_{name}")
+            ),
+            f"@{name}",
+        )
+        for value, synonyms in entities.items():
+            for text in synonyms:
+                phrases.append(
+                    Phrase(
+                        text=text,
+                        source=f"@{display_name}:{value}",
+                        owner=owner,
+                    )
+                )
+    return phrases
+
+
+def sketch(rows: List[Dict[int, float]], dimensions: int) -> np.ndarray:
+    """Count sketch projection of sparse rows, seeded so runs agree."""
+    columns = 1 + max((max(row, default=0) for row in rows), default=0)
+    generator = np.random.default_rng(0)
+    buckets = generator.integers(0, dimensions, columns)
+    signs = generator.choice(np.array([-1.0, 1.0], np.float32), columns)
+    row_ids = np.repeat(np.arange(len(rows)), [len(row) for row in rows])
+    features = np.fromiter(
+        (column for row in rows for column in row), np.intp, len(row_ids)
+    )
+    weights = np.fromiter(
+        (weight for row in rows for weight in row.values()),
+        np.float32,
+        len(row_ids),
+    )
+    projected = np.zeros((len(rows), dimensions), np.float32)
+    np.add.at(
+        projected, (row_ids, buckets[features]), signs[features] * weights
+    )
+    return projected
+
+
+def cosine(left: Dict[int, float], right: Dict[int, float]) -> float:
+    if len(right) < len(left):
+        left, right = right, left
+    return sum(
+        weight * right.get(column, 0.0) for column, weight in left.items()
+    )
+
+
+def find_conflicts(
+    phrases: List[Phrase],
+    *,
+    conflict_threshold: float = CONFLICT_THRESHOLD,
+    duplicate_threshold: float = DUPLICATE_THRESHOLD,
+    block_size: int = BLOCK_SIZE,
+    dimensions: int = SKETCH_DIMENSIONS,
+) -> List[Conflict]:
+    if not phrases:
+        return []
+    texts = [phrase.text for phrase in phrases]
+    vectorizer = TfidfVectorizer().fit(texts)
+    rows = [vectorizer.weights(text) for text in texts]
+    projected = sketch(rows, dimensions)
+    owner_ids: Dict[str, int] = {}
+    owners = np.array(
+        [owner_ids.setdefault(p.owner, len(owner_ids)) for p in phrases]
+    )
+    source_ids: Dict[str, int] = {}
+    sources = np.array(
+        [source_ids.setdefault(p.source, len(source_ids)) for p in phrases]
+    )
+    # pairs of one owner only matter as duplicates within one source
+    lowest = min(conflict_threshold, duplicate_threshold) - SKETCH_MARGIN
+
+    conflicts = []
+    columns = np.arange(len(phrases))
+    for start in range(0, len(phrases), block_size):
+        block = columns[start:][:block_size]
+        similarity = projected[block] @ projected.T
+        same_owner = owners[block][:, None] == owners[None, :]
+        same_source = sources[block][:, None] == sources[None, :]
+        # upper triangle only, each pair once and no self pairs
+        candidates = (
+            (similarity >= lowest)
+            & (columns > block[:, None])
+            & (same_source | ~same_owner)
+        )
+        for row, column in zip(*np.nonzero(candidates)):
+            left = block[row]
+            score = cosine(rows[left], rows[column])
+            duplicate = bool(same_owner[row, column])
+            if score < (
+                duplicate_threshold if duplicate else conflict_threshold
+            ):
+                continue
+            conflicts.append(
+                Conflict(
+                    kind="duplicate" if duplicate else "conflict",
+                    left=phrases[left],
+                    right=phrases[column],
+                    score=score,
+                )
+            )
+    conflicts.sort(key=lambda conflict: -conflict.score)
+    return conflicts
+
+
+def check_intents(
+    intent_items: Dict[str, List[str]],
+    entity_types: Optional[Dict[str, Dict[str, List[str]]]] = None,
+    **kwargs,
+) -> List[Conflict]:
+    """Conflicts involving `intent_items` against everything we deploy.
+
+    `utils.create_intents` runs it before every push of intents.
+    """
+    intents = {**known_intents(), **intent_items}
+    if entity_types is None:
+        entity_types = ENTITY_TYPES
+    return [
+        conflict
+        for conflict in find_conflicts(
+            collect_phrases(intents, entity_types), **kwargs
+        )
+        if conflict.left.source in intent_items
+        or conflict.right.source in intent_items
+    ]
+
+
+def log_conflicts(conflicts: Iterable[Conflict]):
+    for conflict in conflicts:
+        utils.logger.warning(f"Training phrase {conflict}")
+
+
+def main():
+    conflicts = find_conflicts(collect_phrases(known_intents(), ENTITY_TYPES))
+    for conflict in conflicts:
+        print(conflict)
+    print(f"{len(conflicts)} conflicts")
+    sys.exit(1 if any(c.kind == "conflict" for c in conflicts) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,672 @@
+"""
+Offline conversation simulator for the agent graph
+
+Runs scripted conversations against an `AgentGraph` in-process, without a
+live agent. NLU, webhooks and condition evaluation are pluggable so that
+regression suites can exercise every path through the flows in CI.
+
+Runtime model (a close approximation of Dialogflow CX):
+1. a session starts on the START page of the Default Start Flow
+2. entering a page runs its entry fulfillment, then the form collects any
+   required parameter that is not set yet ($page.params.status = "FINAL"
+   once every required parameter is filled)
+3. condition routes of the active page (or of the flow on START) are
+   evaluated in order after every state change, the first true one wins;
+   the form only prompts for its next parameter when none is
+4. user input is matched against intent routes of the page, then the flow,
+   otherwise it fills form parameters of the page: a value for any of them
+   is taken, and free text goes to the one being collected if it is
+   sys.any. Filled form parameters are set as $page.params and
+   $session.params
+5. END_FLOW returns to the calling page, which resumes without taking the
+   route that called the sub-flow again until it is left (`tools.paths`
+   walks returns the same way); END_FLOW_WITH_FAILURE and
+   END_FLOW_WITH_HUMAN_ESCALATION raise flow.failed /
+   flow.failed.human-escalation on the caller, END_SESSION ends the call
+
+Script file format for the command line:
+
+    {
+        "params": {"callerANI": "+15550100"},
+        "webhooks": {"authenticate": {"session_params": {...}}},
+        "turns": ["hi", {"intent": "appointment.routing.cancel"}],
+        "expect": {"end_state": "END_FLOW_WITH_HUMAN_ESCALATION"}
+    }
+
+    cd src && python -m tools.simulator agent_graph.json script.json
+"""
+
+import json
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import utils
+from tools.agent_graph import (
+    START_PAGE,
+    AgentGraph,
+    EventHandler,
+    Fulfillment,
+    Page,
+    Route,
+)
+from tools.conditions import evaluate_condition, render
+
+END_FLOW_EVENTS = {
+    utils.SymbolicPages.END_FLOW_WITH_FAILURE.value: (
+        utils.EventNames.FLOW_FAILED.value
+    ),
+    utils.SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION.value: (
+        utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION.value
+    ),
+}
+NO_INPUT_DEFAULT = utils.EventNames.NO_INPUT_DEFAULT.value
+# events that fall back to a more generic handler when not handled directly
+EVENT_FALLBACKS = {
+    utils.EventNames.NO_MATCH_1.value: "sys.no-match-default",
+    utils.EventNames.NO_MATCH_2.value: "sys.no-match-default",
+    utils.EventNames.NO_MATCH_3.value: "sys.no-match-default",
+    utils.EventNames.NO_INPUT_1.value: NO_INPUT_DEFAULT,
+    utils.EventNames.NO_INPUT_2.value: NO_INPUT_DEFAULT,
+    utils.EventNames.NO_INPUT_3.value: NO_INPUT_DEFAULT,
+    utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION.value: (
+        utils.EventNames.FLOW_FAILED.value
+    ),
+}
+SYS_ANY = "sys.any"
+
+
+class SimulationError(Exception):
+    pass
+
+
+class WebhookError(Exception):
+    pass
+
+
+class UserTurn:
+    def __init__(
+        self,
+        *,
+        text: Optional[str] = None,
+        intent: Optional[str] = None,
+        parameters: Optional[Dict[str, Any]] = None,
+        event: Optional[str] = None,
+    ):
+        # event is "no-input" or any custom event name to raise
+        self.text = text
+        self.intent = intent
+        self.parameters = parameters or {}
+        self.event = event
+
+    @classmethod
+    def parse(cls, turn: "str | Dict[str, Any] | UserTurn"):
+        if isinstance(turn, UserTurn):
+            return turn
+        if isinstance(turn, str):
+            return cls(text=turn)
+        return cls(**turn)
+
+
+class NluMatch:
+    def __init__(
+        self,
+        intent: Optional[str],
+        parameters: Optional[Dict[str, Any]] = None,
+        confidence: float = 1.0,
+    ):
+        self.intent = intent
+        self.parameters = parameters or {}
+        self.confidence = confidence
+
+
+class ExactMatchNlu:
+    """Matches user text to an intent by exact training phrase."""
+
+    def __init__(self, intents: Dict[str, List[str]]):
+        self.phrases = {
+            phrase.strip().lower(): intent
+            for intent, phrases in intents.items()
+            for phrase in phrases
+        }
+
+    def __call__(self, text: str, session: "Session") -> Optional[NluMatch]:
+        intent = self.phrases.get(text.strip().lower())
+        return NluMatch(intent) if intent else None
+
+
+class WebhookRequest:
+    def __init__(
+        self,
+        *,
+        webhook: str,
+        tag: Optional[str],
+        flow: str,
+        page: str,
+        session_params: Dict[str, Any],
+    ):
+        self.webhook = webhook
+        self.tag = tag
+        self.flow = flow
+        self.page = page
+        self.session_params = session_params
+
+
+class ScriptedWebhook:
+    """Answers webhook calls from canned responses keyed by tag.
+
+    A response is a dict with optional "session_params" and "messages"
+    keys, a callable taking the WebhookRequest, or a list of either which
+    is consumed one call at a time.
+    """
+
+    def __init__(self, responses: Optional[Dict[str, Any]] = None):
+        self.responses = {
+            tag: list(response) if isinstance(response, list) else response
+            for tag, response in (responses or {}).items()
+        }
+
+    def __call__(self, request: WebhookRequest) -> Dict[str, Any]:
+        if request.tag not in self.responses:
+            raise WebhookError(f"No response scripted for tag {request.tag}")
+        response = self.responses[request.tag]
+        if isinstance(response, list):
+            if not response:
+                raise WebhookError(f"Responses exhausted for {request.tag}")
+            response = response.pop(0)
+        if callable(response):
+            response = response(request)
+        return response or {}
+
+
+class _Frame:
+    def __init__(self, flow: str):
+        self.flow = flow
+        self.page = START_PAGE
+        self.previous_page = START_PAGE
+        self.entered = False
+        # route of the page that called a sub-flow, (owner, index), and the
+        # page parameters to resume with when the sub-flow returns
+        self.called_by: Optional[Tuple[str, int]] = None
+        self.page_params: Dict[str, Any] = {}
+
+
+class Session:
+    def __init__(self, params: Optional[Dict[str, Any]] = None):
+        self.params: Dict[str, Any] = dict(params or {})
+        self.page_params: Dict[str, Any] = {}
+        self.frames: List[_Frame] = []
+        self.awaiting_parameter: Optional[str] = None
+        self.no_match_count = 0
+        self.no_input_count = 0
+        self.ended = False
+        self.end_state: Optional[str] = None
+
+    @property
+    def current(self) -> Tuple[str, str]:
+        frame = self.frames[-1]
+        return frame.flow, frame.page
+
+
+class TurnResult:
+    def __init__(self):
+        self.messages: List[Any] = []
+        self.pages: List[Tuple[str, str]] = []
+        self.routes: List[Tuple[str, str, int]] = []
+        self.events: List[str] = []
+        self.webhook_calls: List[Tuple[str, Optional[str]]] = []
+        self.ended = False
+        self.end_state: Optional[str] = None
+
+
+class ConversationResult:
+    def __init__(self, session: Session, turns: List[TurnResult]):
+        self.session = session
+        self.turns = turns
+
+    @property
+    def end_state(self) -> Optional[str]:
+        return self.session.end_state
+
+    @property
+    def pages(self) -> List[Tuple[str, str]]:
+        return [page for turn in self.turns for page in turn.pages]
+
+    @property
+    def webhook_calls(self) -> List[Tuple[str, Optional[str]]]:
+        return [call for turn in self.turns for call in turn.webhook_calls]
+
+    def transcript(self) -> List[str]:
+        lines = []
+        for index, turn in enumerate(self.turns):
+            for flow, page in turn.pages:
+                lines.append(f"[{index}] {flow} / {page}")
+            for event in turn.events:
+                lines.append(f"[{index}] event: {event}")
+            for message in turn.messages:
+                lines.append(f"[{index}] agent: {message}")
+        if self.end_state:
+            lines.append(f"session ended: {self.end_state}")
+        return lines
+
+
+class Simulator:
+    def __init__(
+        self,
+        graph: AgentGraph,
+        *,
+        nlu: Optional[Callable[[str, Session], Optional[NluMatch]]] = None,
+        webhook: Optional[Callable[[WebhookRequest], Dict[str, Any]]] = None,
+        condition_evaluator: Optional[Callable[[str, Session], bool]] = None,
+        max_transitions: int = 100,
+    ):
+        self.graph = graph
+        self.nlu = nlu or ExactMatchNlu(graph.intents)
+        self.webhook = webhook or ScriptedWebhook()
+        self.evaluate = condition_evaluator or evaluate_condition
+        self.max_transitions = max_transitions
+        # (flow, page) -> (condition routes, intent routes), with the index
+        # of every route in its owner so coverage can be reported per route
+        self._route_cache: Dict[Tuple[str, str], Tuple[list, list]] = {}
+
+    def start(self, params: Optional[Dict[str, Any]] = None) -> Session:
+        session = Session(params)
+        session.frames.append(_Frame(self.graph.start_flow))
+        return session
+
+    def run(
+        self,
+        turns: List[Any],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> ConversationResult:
+        session = self.start(params)
+        results = []
+        for turn in turns:
+            if session.ended:
+                break
+            results.append(self.send(session, turn))
+        return ConversationResult(session, results)
+
+    def send(self, session: Session, turn: Any) -> TurnResult:
+        if session.ended:
+            raise SimulationError("Session has already ended")
+        turn = UserTurn.parse(turn)
+        result = TurnResult()
+        self._enter_pending(session, result)
+
+        if turn.event:
+            self._handle_event_input(session, turn.event, result)
+        else:
+            self._handle_user_input(session, turn, result)
+
+        self._advance(session, result)
+        result.ended = session.ended
+        result.end_state = session.end_state
+        return result
+
+    def expected_input(self, session: Session) -> Tuple[Optional[str], list]:
+        """(form parameter being collected, intents the caller can say)."""
+        intents = [route.intent for _, _, route in self._routes(session)[1]]
+        return session.awaiting_parameter, list(dict.fromkeys(intents))
+
+    def _handle_event_input(
+        self, session: Session, event: str, result: TurnResult
+    ):
+        if event == "no-input":
+            session.no_input_count = min(session.no_input_count + 1, 3)
+            event = f"sys.no-input-{session.no_input_count}"
+        self._fire_event(session, event, result)
+
+    def _handle_user_input(
+        self, session: Session, turn: UserTurn, result: TurnResult
+    ):
+        match = None
+        if turn.intent or turn.parameters:
+            match = NluMatch(turn.intent, turn.parameters)
+        elif turn.text is not None:
+            match = self.nlu(turn.text, session)
+        parameters = dict(match.parameters) if match else {}
+
+        route = None
+        if match and match.intent:
+            route = self._match_intent_route(session, match.intent)
+        if route is not None:
+            session.no_match_count = session.no_input_count = 0
+            self._fill_parameters(session, parameters)
+            self._take_route(session, route, result)
+            return
+
+        awaiting = self._awaiting_form_parameter(session)
+        if (
+            awaiting is not None
+            and awaiting.name not in parameters
+            and turn.text
+            and (awaiting.entity_type or "").endswith(SYS_ANY)
+        ):
+            parameters[awaiting.name] = turn.text
+        page = self._current_page(session)
+        form = {parameter.name for parameter in page.form} if page else set()
+        if form.intersection(parameters):
+            session.no_match_count = session.no_input_count = 0
+            self._fill_parameters(session, parameters)
+            return
+
+        session.no_match_count = min(session.no_match_count + 1, 3)
+        self._fire_event(
+            session, f"sys.no-match-{session.no_match_count}", result
+        )
+
+    def _fill_parameters(self, session: Session, parameters: Dict[str, Any]):
+        # form parameters are page and session parameters at once
+        session.params.update(parameters)
+        page = self._current_page(session)
+        if page is None:
+            return
+        for parameter in page.form:
+            if parameter.name in parameters:
+                session.page_params[parameter.name] = parameters[
+                    parameter.name
+                ]
+
+    def _current_page(self, session: Session) -> Optional[Page]:
+        flow, page = session.current
+        if page == START_PAGE:
+            return None
+        return self.graph.get_page(flow, page)
+
+    def _routes(self, session: Session) -> Tuple[list, list]:
+        key = session.current
+        if key not in self._route_cache:
+            flow_name, page_name = key
+            flow = self.graph.flows[flow_name]
+            owner_routes = (
+                flow.routes
+                if page_name == START_PAGE
+                else self.graph.get_page(flow_name, page_name).routes
+            )
+            condition_routes = [
+                (page_name, index, route)
+                for index, route in enumerate(owner_routes)
+                if not route.intent
+            ]
+            intent_routes = [
+                (page_name, index, route)
+                for index, route in enumerate(owner_routes)
+                if route.intent
+            ]
+            if page_name != START_PAGE:
+                # flow level intent routes are in scope on every page
+                intent_routes.extend(
+                    (START_PAGE, index, route)
+                    for index, route in enumerate(flow.routes)
+                    if route.intent
+                )
+            self._route_cache[key] = (condition_routes, intent_routes)
+        return self._route_cache[key]
+
+    def _match_intent_route(self, session: Session, intent: str):
+        called_by = session.frames[-1].called_by
+        for owner, index, route in self._routes(session)[1]:
+            if route.intent != intent or (owner, index) == called_by:
+                continue
+            if route.condition and not self.evaluate(route.condition, session):
+                continue
+            return owner, index, route
+        return None
+
+    def _match_condition_route(self, session: Session):
+        called_by = session.frames[-1].called_by
+        for owner, index, route in self._routes(session)[0]:
+            if (owner, index) == called_by:
+                continue
+            if route.condition and self.evaluate(route.condition, session):
+                return owner, index, route
+        return None
+
+    def _awaiting_form_parameter(self, session: Session):
+        page = self._current_page(session)
+        if page is None or session.awaiting_parameter is None:
+            return None
+        for parameter in page.form:
+            if parameter.name == session.awaiting_parameter:
+                return parameter
+        return None
+
+    def _enter_pending(self, session: Session, result: TurnResult) -> bool:
+        frame = session.frames[-1]
+        if frame.entered:
+            return True
+        frame.entered = True
+        result.pages.append(session.current)
+        page = self._current_page(session)
+        if page is not None and page.entry_fulfillment:
+            return self._fulfill(session, page.entry_fulfillment, result)
+        return True
+
+    def _advance(self, session: Session, result: TurnResult):
+        for _ in range(self.max_transitions):
+            if session.ended:
+                return
+            if not self._enter_pending(session, result):
+                continue
+
+            page = self._current_page(session)
+            pending = None
+            if page is not None and page.form:
+                for parameter in page.form:
+                    value = session.params.get(parameter.name)
+                    if value is None:
+                        if parameter.required and pending is None:
+                            pending = parameter
+                    elif parameter.name not in session.page_params:
+                        # set session parameters prefill the form
+                        session.page_params[parameter.name] = value
+                if pending is None:
+                    session.awaiting_parameter = None
+                    session.page_params["status"] = "FINAL"
+
+            matched = self._match_condition_route(session)
+            if matched is None:
+                if (
+                    pending is not None
+                    and session.awaiting_parameter != pending.name
+                ):
+                    session.awaiting_parameter = pending.name
+                    if pending.initial_prompt:
+                        self._fulfill(session, pending.initial_prompt, result)
+                return
+            owner, index, route = matched
+            before = dict(session.params), session.current
+            self._take_route(session, matched, result)
+            has_target = route.target_page or route.target_flow
+            if not has_target and before == (
+                session.params,
+                session.current,
+            ):
+                # nothing changed, re-evaluating would loop forever
+                return
+        flow, page_name = session.current
+        raise SimulationError(
+            f"More than {self.max_transitions} transitions without user "
+            f"input, stuck around {flow} / {page_name}"
+        )
+
+    def _take_route(self, session: Session, matched, result: TurnResult):
+        owner, index, route = matched
+        flow = session.current[0]
+        result.routes.append((flow, owner, index))
+        self._transition(session, route, result, called_by=(owner, index))
+
+    def _transition(
+        self,
+        session: Session,
+        target: "Route | EventHandler",
+        result: TurnResult,
+        called_by: Optional[Tuple[str, int]] = None,
+    ):
+        if target.trigger_fulfillment is not None:
+            if not self._fulfill(session, target.trigger_fulfillment, result):
+                return
+        if target.target_flow:
+            if target.target_flow not in self.graph.flows:
+                raise SimulationError(f"Flow {target.target_flow} not found")
+            caller = session.frames[-1]
+            caller.called_by = called_by
+            caller.page_params = session.page_params
+            session.frames.append(_Frame(target.target_flow))
+            self._reset_page_state(session)
+        elif target.target_page:
+            self._goto_page(session, target.target_page, result)
+
+    def _reset_page_state(self, session: Session):
+        session.page_params = {}
+        session.awaiting_parameter = None
+
+    def _goto_page(self, session: Session, target: str, result: TurnResult):
+        frame = session.frames[-1]
+        if target == utils.SymbolicPages.END_SESSION:
+            self._end_session(session, target)
+            return
+        if target in (
+            utils.SymbolicPages.END_FLOW,
+            utils.SymbolicPages.END_FLOW_WITH_FAILURE,
+            utils.SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION,
+        ):
+            self._end_flow(session, target, result)
+            return
+
+        if target == "START_PAGE":
+            target = START_PAGE
+        elif target == "CURRENT_PAGE":
+            target = frame.page
+        elif target == "PREVIOUS_PAGE":
+            target = frame.previous_page
+        elif target not in self.graph.flows[frame.flow].pages:
+            raise SimulationError(
+                f"Page {target} not found in flow {frame.flow}"
+            )
+        frame.previous_page = frame.page
+        frame.page = target
+        frame.entered = False
+        frame.called_by = None
+        self._reset_page_state(session)
+
+    def _end_flow(self, session: Session, mode: str, result: TurnResult):
+        session.frames.pop()
+        if not session.frames:
+            self._end_session(session, mode)
+            return
+        # the calling page resumes with its parameters and re-evaluates its
+        # routes, except the one that called the sub-flow
+        session.page_params = session.frames[-1].page_params
+        session.awaiting_parameter = None
+        if mode in END_FLOW_EVENTS:
+            self._fire_event(session, END_FLOW_EVENTS[mode], result)
+
+    def _end_session(self, session: Session, state: str):
+        session.ended = True
+        session.end_state = state
+
+    def _event_handlers(self, session: Session):
+        awaiting = self._awaiting_form_parameter(session)
+        if awaiting is not None:
+            yield awaiting.reprompt_event_handlers
+        page = self._current_page(session)
+        if page is not None:
+            yield page.event_handlers
+        yield self.graph.flows[session.current[0]].event_handlers
+
+    def _fire_event(self, session: Session, event: str, result: TurnResult):
+        result.events.append(event)
+        names = [event]
+        if event in EVENT_FALLBACKS:
+            names.append(EVENT_FALLBACKS[event])
+        for handlers in self._event_handlers(session):
+            for name in names:
+                for handler in handlers:
+                    if handler.event == name:
+                        self._transition(session, handler, result)
+                        return
+
+        # unhandled flow failures bubble up to the calling flow
+        if event == utils.EventNames.FLOW_FAILED_HUMAN_ESCALATION:
+            self._end_flow(
+                session,
+                utils.SymbolicPages.END_FLOW_WITH_HUMAN_ESCALATION,
+                result,
+            )
+        elif event == utils.EventNames.FLOW_FAILED:
+            self._end_flow(
+                session, utils.SymbolicPages.END_FLOW_WITH_FAILURE, result
+            )
+
+    def _fulfill(
+        self, session: Session, fulfillment: Fulfillment, result: TurnResult
+    ) -> bool:
+        # presets first, then the webhook, then the static messages
+        for parameter, value in fulfillment.set_parameters.items():
+            session.params[parameter] = render(value, session)
+
+        webhook_messages: List[Any] = []
+        if fulfillment.webhook:
+            flow, page = session.current
+            result.webhook_calls.append((fulfillment.webhook, fulfillment.tag))
+            request = WebhookRequest(
+                webhook=fulfillment.webhook,
+                tag=fulfillment.tag,
+                flow=flow,
+                page=page,
+                session_params=dict(session.params),
+            )
+            try:
+                response = self.webhook(request)
+            except WebhookError:
+                self._fire_event(
+                    session, utils.EventNames.WEBHOOK_ERROR.value, result
+                )
+                return False
+            session.params.update(response.get("session_params", {}))
+            webhook_messages = response.get("messages", [])
+
+        for message in fulfillment.messages:
+            result.messages.append(render(message, session))
+        result.messages.extend(webhook_messages)
+        return True
+
+
+def run_script(graph: AgentGraph, script: Dict[str, Any]):
+    simulator = Simulator(
+        graph, webhook=ScriptedWebhook(script.get("webhooks"))
+    )
+    conversation = simulator.run(script["turns"], script.get("params"))
+
+    errors = []
+    expect = script.get("expect", {})
+    if "end_state" in expect and expect["end_state"] != (
+        conversation.end_state
+    ):
+        errors.append(
+            f"expected end state {expect['end_state']}, "
+            f"got {conversation.end_state}"
+        )
+    visited = {f"{flow}/{page}" for flow, page in conversation.pages}
+    for page in expect.get("pages", []):
+        if page not in visited:
+            errors.append(f"expected to visit {page}")
+    return conversation, errors
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        raise ValueError("Usage: simulator.py <agent_graph.json> <scripts>")
+    agent_graph = AgentGraph.load(sys.argv[1])
+    failed = False
+    for script_path in sys.argv[2:]:
+        with open(script_path, "r", encoding="utf-8") as file:
+            conversation, errors = run_script(agent_graph, json.load(file))
+        print(f"== {script_path}")
+        print("\n".join(conversation.transcript()))
+        for error in errors:
+            failed = True
+            print(f"FAILED: {error}")
+    if failed:
+        sys.exit(1)
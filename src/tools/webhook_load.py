@@ -0,0 +1,274 @@
+"""
+Load generator for the agent's webhooks
+
+Keeps `--concurrency` webhook calls in flight for `--duration` seconds (or
+`--calls` calls), picking tags by weight, and reports p50 / p95 / p99
+latency, the timeout rate and the error rate per tag and overall. Calls
+time out like CX does, after `utils.WEBHOOK_TIMEOUT_SECONDS`.
+
+Against the local stub, started in process:
+
+    cd src && python -m tools.webhook_load --serve \\
+        --latency find_appointments=lognormal:900:0.8 --concurrency 50
+
+Against a deployed webhook (every tag goes to --url unless a
+WEBHOOK=URL override names the webhook of the tag):
+
+    cd src && python -m tools.webhook_load --url https://... \\
+        --url upsert-data-into-spanner=https://...
+
+The `--json` summary of a run against the deployed webhooks is what the
+agent build reads from WEBHOOK_METRICS to decide which webhook
+fulfillments return partial responses (`utils.interim_prompt`).
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import utils
+from tools import webhook_stub
+
+# webhook of every tag the flows call
+TAG_WEBHOOKS = {
+    utils.WebHookTags.Authentication.value: utils.WebHookNames.DIAGFLOW,
+    "find_appointments": utils.WebHookNames.DIAGFLOW,
+    "office_hours": utils.WebHookNames.DIAGFLOW,
+    "need_extra_with_wait": utils.WebHookNames.UPSERT_DATA_INTO_SPANNER,
+}
+DEFAULT_MIX = {
+    utils.WebHookTags.Authentication.value: 2,
+    "find_appointments": 2,
+    "office_hours": 1,
+    "need_extra_with_wait": 1,
+}
+# session parameters each tag is called with
+TAG_PARAMS: Dict[str, Dict[str, Any]] = {
+    utils.WebHookTags.Authentication.value: {
+        "name": "Jane Doe",
+        "dob_collection_dob": "1980-02-03",
+    },
+    "find_appointments": {"appointments_limit": 4, "appointment_date": None},
+    "office_hours": {},
+    "need_extra_with_wait": {"premature_hang_up": True, "wrap_codes": []},
+}
+PERCENTILES = [50, 95, 99]
+
+
+class CallResult:
+    def __init__(self, *, tag: str, latency: float, outcome: str):
+        # outcome is "ok", "timeout" or "error"
+        self.tag = tag
+        self.latency = latency
+        self.outcome = outcome
+
+
+def percentile(sorted_values: List[float], rank: float) -> float:
+    """Nearest rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, int(-(-rank * len(sorted_values) // 100)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def call(url: str, tag: str, session: str, timeout: float) -> CallResult:
+    body = webhook_stub.webhook_request(tag, TAG_PARAMS.get(tag, {}), session)
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    start = time.perf_counter()
+    try:
+        # urls come from the command line, http(s) only
+        with urllib.request.urlopen(  # nosec B310
+            request, timeout=timeout
+        ) as response:
+            response.read()
+        outcome = "ok"
+    except TimeoutError:
+        outcome = "timeout"
+    except urllib.error.URLError as error:
+        timed_out = isinstance(getattr(error, "reason", None), TimeoutError)
+        outcome = "timeout" if timed_out else "error"
+    except OSError:
+        outcome = "error"
+    return CallResult(
+        tag=tag, latency=time.perf_counter() - start, outcome=outcome
+    )
+
+
+def run_load(
+    urls: Dict[str, str],
+    *,
+    concurrency: int,
+    duration: Optional[float] = None,
+    calls: Optional[int] = None,
+    mix: Optional[Dict[str, int]] = None,
+    timeout: float = utils.WEBHOOK_TIMEOUT_SECONDS,
+) -> List[CallResult]:
+    """Run `concurrency` callers until `duration` passes or `calls` ran.
+
+    `urls` maps webhook display names to URLs, "default" covers the rest.
+    """
+    mix = mix or DEFAULT_MIX
+    # weighted round robin, so short runs still cover every tag
+    schedule = [tag for tag, weight in mix.items() for _ in range(weight)]
+    deadline = time.monotonic() + duration if duration else None
+    counter = iter(range(calls if calls else 2**62))
+    counter_lock = threading.Lock()
+
+    def next_call() -> Optional[int]:
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        with counter_lock:
+            return next(counter, None)
+
+    def caller(worker: int) -> List[CallResult]:
+        results = []
+        number = next_call()
+        while number is not None:
+            tag = schedule[number % len(schedule)]
+            webhook = TAG_WEBHOOKS.get(tag, utils.WebHookNames.DIAGFLOW)
+            url = urls.get(webhook.value) or urls["default"]
+            session = f"load-{worker}-{number}"
+            results.append(call(url, tag, session, timeout))
+            number = next_call()
+        return results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        batches = list(executor.map(caller, range(concurrency)))
+    return [result for batch in batches for result in batch]
+
+
+def summarize(results: List[CallResult]) -> Dict[str, Dict[str, Any]]:
+    """{tag: stats} plus "all", latencies in milliseconds."""
+    groups: Dict[str, List[CallResult]] = {"all": results}
+    for result in results:
+        groups.setdefault(result.tag, []).append(result)
+    summary = {}
+    for tag, group in groups.items():
+        latencies = sorted(
+            r.latency * 1000 for r in group if r.outcome == "ok"
+        )
+        count = len(group) or 1
+        summary[tag] = {
+            "calls": len(group),
+            **{
+                f"p{rank}": percentile(latencies, rank) for rank in PERCENTILES
+            },
+            "timeout_rate": sum(r.outcome == "timeout" for r in group) / count,
+            "error_rate": sum(r.outcome == "error" for r in group) / count,
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict[str, Any]], elapsed: float):
+    header = ["tag", "calls"] + [f"p{rank} ms" for rank in PERCENTILES]
+    print(
+        f"{header[0]:<24}{header[1]:>8}"
+        + "".join(f"{column:>10}" for column in header[2:])
+        + f"{'timeouts':>10}{'errors':>10}"
+    )
+    for tag, stats in summary.items():
+        print(
+            f"{tag:<24}{stats['calls']:>8}"
+            + "".join(f"{stats[f'p{rank}']:>10.1f}" for rank in PERCENTILES)
+            + f"{stats['timeout_rate']:>10.2%}{stats['error_rate']:>10.2%}"
+        )
+    calls = summary["all"]["calls"]
+    print(f"{calls} calls in {elapsed:.1f}s, {calls / elapsed:.1f} calls/s")
+
+
+def parse_urls(items: List[str]) -> Dict[str, str]:
+    urls = {}
+    for item in items:
+        name, separator, url = item.partition("=")
+        if separator and not name.startswith(("http:", "https:")):
+            urls[name] = url
+        else:
+            urls["default"] = item
+    for url in urls.values():
+        if not url.startswith(("http://", "https://")):
+            raise ValueError(f"Not an http(s) URL: {url}")
+    return urls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url",
+        action="append",
+        default=[],
+        metavar="[WEBHOOK=]URL",
+        help="webhook URL, for every webhook or only the named one",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="start the webhook stub in process and load it",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="TAG=SPEC",
+        help="stub latency, see tools.webhook_stub",
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--calls", type=int, help="stop after this many")
+    parser.add_argument(
+        "--mix",
+        type=json.loads,
+        help='JSON weights per tag, like {"find_appointments": 3}',
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=utils.WEBHOOK_TIMEOUT_SECONDS
+    )
+    parser.add_argument("--json", action="store_true", help="JSON output")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    server = None
+    urls = parse_urls(args.url)
+    if args.serve:
+        server = webhook_stub.serve(
+            port=0,
+            latencies=webhook_stub.parse_latencies(args.latency),
+            seed=args.seed,
+        )
+        host, port = server.server_address[:2]
+        urls.setdefault("default", f"http://{host}:{port}")
+    if "default" not in urls:
+        parser.error("--url or --serve is required")
+
+    start = time.perf_counter()
+    try:
+        results = run_load(
+            urls,
+            concurrency=args.concurrency,
+            duration=None if args.calls else args.duration,
+            calls=args.calls,
+            mix=args.mix,
+            timeout=args.timeout,
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    summary = summarize(results)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Local stub of the agent's webhooks
+
+Speaks the Dialogflow CX WebhookRequest / WebhookResponse JSON contract for
+the tags the flows call:
+
+    diagflow                  authenticate, find_appointments, office_hours
+    upsert-data-into-spanner  need_extra_with_wait, conversation_started,
+                              human_escalate, success_path
+
+A combined tag ("authenticate+find_appointments") runs its tags in order
+in one call, every tag seeing the parameters the tags before it set, and
+answers with all of them, see `tools.coalesce_webhooks`.
+
+Answers are deterministic per session (a hash of the caller's name or the
+session id picks found / not found and how many appointments there are),
+so load runs and simulator runs are repeatable. Every tag sleeps for a
+latency drawn from its own distribution before answering:
+
+    fixed:<ms>                 always <ms>
+    uniform:<low ms>:<high ms>
+    normal:<mean ms>:<sd ms>
+    lognormal:<median ms>:<sigma>
+    <spec>@<error rate>        answer HTTP 500 for that share of calls
+
+    cd src && python -m tools.webhook_stub --port 8080 \\
+        --latency default=lognormal:150:0.4 \\
+        --latency find_appointments=lognormal:900:0.8@0.01
+
+`StubWebhook` answers the same way in process, as a simulator webhook.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+import utils
+from tools.simulator import WebhookError, WebhookRequest
+
+DEFAULT_LATENCY = "lognormal:150:0.4"
+TAG_SEPARATOR = "+"
+# share of callers the authenticate tag finds without an ssn
+PATIENT_FOUND_RATE = 0.7
+MAX_APPOINTMENTS = 3
+FACILITIES = ["Main Street Clinic", "Riverside Medical Center"]
+DOCTORS = ["Doctor Patel", "Doctor Garcia", "Doctor Kim"]
+APPOINTMENT_TYPES = ["Follow Up", "Annual Physical", "Consultation"]
+
+
+class Latency:
+    def __init__(
+        self,
+        *,
+        kind: str,
+        params: List[float],
+        error_rate: float = 0.0,
+    ):
+        self.kind = kind
+        self.params = params
+        self.error_rate = error_rate
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        spec, _, error_rate = spec.partition("@")
+        kind, *params = spec.split(":")
+        arity = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in arity or len(params) != arity[kind]:
+            raise ValueError(f"Invalid latency spec {spec}")
+        return cls(
+            kind=kind,
+            params=[float(param) for param in params],
+            error_rate=float(error_rate or 0.0),
+        )
+
+    def sample(self, generator: random.Random) -> float:
+        """Latency in seconds."""
+        if self.kind == "fixed":
+            milliseconds = self.params[0]
+        elif self.kind == "uniform":
+            milliseconds = generator.uniform(*self.params)
+        elif self.kind == "normal":
+            milliseconds = generator.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            milliseconds = median * generator.lognormvariate(0.0, sigma)
+        return max(milliseconds, 0.0) / 1000
+
+    def fails(self, generator: random.Random) -> bool:
+        return generator.random() < self.error_rate
+
+
+def _bucket(*values: Any) -> int:
+    text = "|".join(str(value) for value in values)
+    return zlib.crc32(text.encode("utf-8")) % 100
+
+
+def authenticate(params: Dict[str, Any], session: str) -> Dict[str, Any]:
+    name = params.get("name") or params.get("genesysPatientName")
+    if not name or not params.get("dob_collection_dob"):
+        return {"patientFound": "false", "needToAskSsn": "false"}
+    if params.get("ssn"):
+        return {"patientFound": "true", "needToAskSsn": "false"}
+    if _bucket(name, params["dob_collection_dob"]) < PATIENT_FOUND_RATE * 100:
+        return {"patientFound": "true", "needToAskSsn": "false"}
+    return {"patientFound": "false", "needToAskSsn": "true"}
+
+
+def _appointment(session: str, position: int) -> Dict[str, Any]:
+    bucket = _bucket(session, position)
+    start = datetime.datetime(2030, 1, 7, 9) + datetime.timedelta(
+        days=7 * position + bucket % 5, hours=bucket % 8
+    )
+    return {
+        "appointmentId": f"stub-{zlib.crc32(session.encode())}-{position}",
+        "appointmentType": APPOINTMENT_TYPES[bucket % len(APPOINTMENT_TYPES)],
+        "facilityName": FACILITIES[bucket % len(FACILITIES)],
+        "doctorName": DOCTORS[bucket % len(DOCTORS)],
+        "startTime": start.isoformat(),
+    }
+
+
+def find_appointments(params: Dict[str, Any], session: str):
+    count = _bucket(session) % (MAX_APPOINTMENTS + 1)
+    appointments = [_appointment(session, i) for i in range(count)]
+    if params.get("appointment_date"):
+        day = str(params["appointment_date"])[:10]
+        appointments = [
+            appointment
+            for appointment in appointments
+            if appointment["startTime"].startswith(day)
+        ]
+    limit = params.get("appointments_limit")
+    if limit:
+        appointments = appointments[: int(limit)]
+    response: Dict[str, Any] = {
+        "appointments": appointments,
+        "num_appointments": count,
+        "num_appointments_on_date": len(appointments),
+    }
+    for key, appointment in zip(
+        ["first_appointment", "second_appointment", "third_appointment"],
+        appointments,
+    ):
+        response[key] = appointment
+    return response
+
+
+def office_hours(params: Dict[str, Any], session: str) -> Dict[str, Any]:
+    return {"is_pac_open": "true"}
+
+
+def acknowledge(params: Dict[str, Any], session: str) -> Dict[str, Any]:
+    return {}
+
+
+TAGS: Dict[str, Callable[[Dict[str, Any], str], Dict[str, Any]]] = {
+    utils.WebHookTags.Authentication.value: authenticate,
+    "find_appointments": find_appointments,
+    "office_hours": office_hours,
+    "need_extra_with_wait": acknowledge,
+    "conversation_started": acknowledge,
+    "human_escalate": acknowledge,
+    "success_path": acknowledge,
+}
+
+
+def split_tag(tag: Optional[str]) -> List[Optional[str]]:
+    """The tags a call runs, more than one for a combined tag."""
+    return list(tag.split(TAG_SEPARATOR)) if tag else [tag]
+
+
+def respond(
+    tag: Optional[str], params: Dict[str, Any], session: str = ""
+) -> Dict[str, Any]:
+    """Session parameters the webhook sets for a call of `tag`."""
+    params = dict(params)
+    response: Dict[str, Any] = {}
+    for part in split_tag(tag):
+        if part not in TAGS:
+            raise KeyError(f"Unknown webhook tag {part}")
+        answer = TAGS[part](params, session)
+        params.update(answer)
+        response.update(answer)
+    return response
+
+
+class StubWebhook:
+    """In process stub for `tools.simulator.Simulator`, without latency."""
+
+    def __init__(self, session: str = "simulator"):
+        self.session = session
+
+    def __call__(self, request: WebhookRequest) -> Dict[str, Any]:
+        try:
+            params = respond(request.tag, request.session_params, self.session)
+        except KeyError as error:
+            raise WebhookError(str(error))
+        return {"session_params": params}
+
+
+def webhook_request(
+    tag: str, params: Dict[str, Any], session: str
+) -> Dict[str, Any]:
+    """A WebhookRequest body as CX sends it."""
+    return {
+        "detectIntentResponseId": f"{session}-{tag}",
+        "fulfillmentInfo": {"tag": tag},
+        "sessionInfo": {"session": session, "parameters": params},
+    }
+
+
+def webhook_response(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "fulfillmentResponse": {"messages": []},
+        "sessionInfo": {"parameters": params},
+    }
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # load tests open many connections at once
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address,
+        latencies: Dict[str, Latency],
+        seed: Optional[int] = None,
+    ):
+        super().__init__(address, StubHandler)
+        self.latencies = latencies
+        # latencies, not secrets
+        self.generator = random.Random(seed)  # nosec B311
+        self.generator_lock = threading.Lock()
+
+    def draw(self, tag: str):
+        """(latency in seconds, fail) for one call of `tag`."""
+        seconds, fail = 0.0, False
+        with self.generator_lock:
+            for part in split_tag(tag):
+                latency = (
+                    self.latencies.get(part or "") or self.latencies["default"]
+                )
+                seconds += latency.sample(self.generator)
+                fail = latency.fails(self.generator) or fail
+        return seconds, fail
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubServer
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            tag = body.get("fulfillmentInfo", {}).get("tag")
+            session_info = body.get("sessionInfo", {})
+            params = respond(
+                tag,
+                session_info.get("parameters", {}),
+                session_info.get("session", ""),
+            )
+        except (KeyError, ValueError) as error:
+            self._send(400, {"error": str(error)})
+            return
+        latency, fail = self.server.draw(tag)
+        time.sleep(latency)
+        if fail:
+            self._send(500, {"error": "stub failure"})
+        else:
+            self._send(200, webhook_response(params))
+
+    def _send(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            # the caller timed out and hung up
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # one line per call drowns a load run
+        pass
+
+
+def parse_latencies(specs: List[str]) -> Dict[str, Latency]:
+    """{tag: Latency} from TAG=SPEC items, "default" covers other tags."""
+    latencies = {"default": Latency.parse(DEFAULT_LATENCY)}
+    for item in specs:
+        tag, separator, spec = item.partition("=")
+        if not separator:
+            raise ValueError(f"Expected TAG=SPEC, got {item}")
+        latencies[tag] = Latency.parse(spec)
+    return latencies
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    latencies: Optional[Dict[str, Latency]] = None,
+    seed: Optional[int] = None,
+) -> StubServer:
+    """Start the stub in a background thread, stop it with shutdown()."""
+    server = StubServer(
+        (host, port), latencies or parse_latencies([]), seed=seed
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        metavar="TAG=SPEC",
+        help="latency of a tag, default=SPEC for every other tag",
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    server = StubServer(
+        (args.host, args.port),
+        parse_latencies(args.latency),
+        seed=args.seed,
+    )
+    print(f"Webhook stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import copy
+import functools
+import json
 import logging
 import os
+import threading
 import time
 from collections import defaultdict
+from datetime import timedelta
 from enum import Enum
-from typing import Any, Dict, List, MutableSequence, TypedDict
+from typing import Any, Dict, List, MutableSequence, Optional, Tuple, TypedDict
 
 import google.protobuf.duration_pb2 as duration_pb2  # type: ignore
 from dfcx_scrapi.builders.flows import FlowBuilder
@@ -24,6 +29,7 @@ from dfcx_scrapi.core.webhooks import Webhooks
 from dfcx_scrapi.tools.copy_util import CopyUtil
 from google.api_core import exceptions as core_exceptions
 from google.cloud.dialogflowcx_v3beta1.types import (  # noqa: E501
+    AdvancedSettings,
     EventHandler,
     NluSettings,
     Page,
@@ -31,6 +37,9 @@ from google.cloud.dialogflowcx_v3beta1.types import (  # noqa: E501
     Webhook,
 )
 
+import agent_cache
+import commons
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)-8s %(message)s",
@@ -40,6 +49,16 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 DEFAULT_START_FLOW = "Default Start Flow"
+# how long CX waits for our webhooks
+WEBHOOK_TIMEOUT_SECONDS = 10
+# measured webhook latencies, the `tools.webhook_load --json` summary
+WEBHOOK_METRICS = os.environ.get("WEBHOOK_METRICS")
+# webhooks slower than this (at the percentile below) play an interim
+# prompt while the caller waits, see interim_prompt
+PARTIAL_RESPONSE_THRESHOLD_MS = float(
+    os.environ.get("PARTIAL_RESPONSE_THRESHOLD_MS", 1000)
+)
+PARTIAL_RESPONSE_PERCENTILE = "p95"
 
 
 class FlowNames(str, Enum):
@@ -71,7 +90,6 @@ class WebHookTags(str, Enum):
 
 
 def get_webhook_uri(webhook_name: WebHookNames):
-
     webhook_uri = {
         WebHookNames.DIAGFLOW: os.environ["DIAGFLOW_URL"],
         WebHookNames.UPSERT_DATA_INTO_SPANNER: os.environ[
@@ -141,6 +159,7 @@ class Config:
         self,
     ):
         self.project_id = os.environ.get("PROJECT_ID")
+        self.location = os.environ.get("LOCATION")
         self.service_account_key = os.environ.get(
             "GOOGLE_APPLICATION_CREDENTIALS"
         )
@@ -151,6 +170,14 @@ class Config:
         self.gcs_bucket_uri_to_restore = os.environ.get(
             "GCS_BUCKET_URI_TO_RESTORE"
         )
+        # agent display name -> agent resource name, filled by get_agent_id
+        self.agent_ids: Dict[str, str] = {}
+
+    def for_agent(self, agent_display_name: str) -> "Config":
+        config = copy.copy(self)
+        config.agent_display_name = agent_display_name
+        config.agent_ids = {}
+        return config
 
 
 def delete_flow_with_check(flow_display_name, config, agent_id=None):
@@ -173,11 +200,161 @@ def delete_flow_with_check(flow_display_name, config, agent_id=None):
 
 
 def get_agent_id(config: Config):
-    agents = Agents(creds_path=config.service_account_key)
-    agent = agents.get_agent_by_display_name(
-        project_id=config.project_id, display_name=config.agent_display_name
+    agent_id = config.agent_ids.get(config.agent_display_name)
+    if agent_id is not None:
+        return agent_id
+    agent_id = agent_cache.resolve_agent(
+        Agents(creds_path=config.service_account_key),
+        project_id=config.project_id,
+        location=config.location,
+        display_name=config.agent_display_name,
+    )
+    if agent_id is None:
+        raise ValueError(f"Agent {config.agent_display_name} not found")
+    config.agent_ids[config.agent_display_name] = agent_id
+    return agent_id
+
+
+class SpeechProfiles(str, Enum):
+    # yes / no, or one of a few options read out
+    SHORT_ANSWER = "short_answer"
+    # first and last name, often spelled out
+    NAME = "name"
+    # date of birth, spoken or keyed as MMDDYYYY
+    DATE = "date"
+    # last four of the SSN, spoken or keyed
+    DIGITS = "digits"
+
+
+# advanced_settings per profile, fields as in AdvancedSettings. A higher
+# endpointer sensitivity ends the caller's turn sooner after they stop
+# talking, the no speech timeout is how long CX waits for them to start
+SPEECH_PROFILES: Dict[SpeechProfiles, Dict[str, Any]] = {
+    SpeechProfiles.SHORT_ANSWER: {
+        "speech_settings": {
+            "endpointer_sensitivity": 90,
+            "no_speech_timeout": timedelta(seconds=4),
+        },
+    },
+    SpeechProfiles.NAME: {
+        "speech_settings": {
+            "endpointer_sensitivity": 60,
+            "no_speech_timeout": timedelta(seconds=5),
+        },
+    },
+    SpeechProfiles.DATE: {
+        "speech_settings": {
+            "endpointer_sensitivity": 40,
+            "no_speech_timeout": timedelta(seconds=6),
+        },
+        "dtmf_settings": {
+            "enabled": True,
+            "max_digits": 8,
+            "finish_digit": "#",
+            "interdigit_timeout_duration": timedelta(seconds=3),
+        },
+    },
+    SpeechProfiles.DIGITS: {
+        "speech_settings": {
+            "endpointer_sensitivity": 50,
+            "no_speech_timeout": timedelta(seconds=5),
+        },
+        "dtmf_settings": {
+            "enabled": True,
+            "max_digits": 4,
+            "finish_digit": "#",
+            "interdigit_timeout_duration": timedelta(seconds=2),
+        },
+    },
+}
+
+# where the profiles apply, a page profile overrides the one of its flow
+FLOW_SPEECH_PROFILES: Dict[str, SpeechProfiles] = {
+    FlowNames.NAME_COLLECTION.value: SpeechProfiles.NAME,
+    FlowNames.DOB_COLLECTION.value: SpeechProfiles.DATE,
+    FlowNames.SSN_COLLECTION.value: SpeechProfiles.DIGITS,
+}
+PAGE_SPEECH_PROFILES: Dict[Tuple[str, str], SpeechProfiles] = {
+    (FlowNames.FIND_EXISTING_APPOINTMENT.value, page): (
+        SpeechProfiles.SHORT_ANSWER
+    )
+    for page in [
+        "> Describe 1 Appointment",
+        "> Describe 2 Appointments",
+        "> Describe 3 Appointments",
+        "> Describe 1st Appointment After Date",
+        "> Describe Next Appointment With Provider",
+    ]
+}
+
+
+def speech_profile(
+    flow_name: str, page_name: Optional[str] = None
+) -> Optional[SpeechProfiles]:
+    """Profile of a page, or of the flow itself without a page name."""
+    flow_name = getattr(flow_name, "value", flow_name)
+    if page_name is None:
+        return FLOW_SPEECH_PROFILES.get(flow_name)
+    return PAGE_SPEECH_PROFILES.get((flow_name, page_name))
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_unsupported(message_type: str, field: str):
+    logger.warning(
+        "%s has no %s in this client library, not setting it",
+        message_type,
+        field,
+    )
+
+
+def _known_fields(message_type, values: Dict[str, Any]) -> Dict[str, Any]:
+    fields = message_type.meta.fields
+    known = {}
+    for name, value in values.items():
+        if name not in fields:
+            _warn_unsupported(message_type.__name__, name)
+            continue
+        if isinstance(value, dict):
+            value = _known_fields(fields[name].message, value)
+        known[name] = value
+    return known
+
+
+def create_advanced_settings(
+    profile: SpeechProfiles, settings_type=AdvancedSettings
+):
+    """advanced_settings of a profile, as `settings_type` (v3beta1 default).
+
+    Settings older client libraries do not know yet are left out.
+    """
+    return settings_type(
+        _known_fields(settings_type, SPEECH_PROFILES[profile])
+    )
+
+
+# digits of a keyed date, MMDDYYYY
+KEYPAD_DATE_DIGITS = 8
+
+
+def keypad_date_condition(name: str) -> str:
+    """True once all MMDDYYYY digits are keyed into `<name>_keyed`."""
+    keyed = f"$page.params.{name}_keyed"
+    last_digit = f"$sys.func.MID({keyed}, {KEYPAD_DATE_DIGITS}, 1)"
+    return f'{keyed} != null AND {last_digit} != ""'
+
+
+def keypad_date_value(name: str, suffix: str = "") -> str:
+    """The date keyed into `<name>_keyed` as YYYY-MM-DD plus `suffix`."""
+    keyed = f"$page.params.{name}_keyed"
+
+    def digits(start: int, length: int) -> str:
+        return f"$sys.func.MID({keyed}, {start}, {length})"
+
+    return (
+        "$sys.func.CONCATENATE("
+        f'{digits(5, 4)}, "-", {digits(1, 2)}, "-", '
+        f'{digits(3, 2)}, "{suffix}")'
     )
-    return agent.name
 
 
 class SymbolicPages(str, Enum):
@@ -195,7 +372,52 @@ class EventHandlerMessages:
         self.no_input_2 = no_input_2
 
 
-def create_event_handlers(
+# proto fragments built once per distinct content, see _fragment
+_fragments: Dict[Any, Any] = {}
+_fragments_lock = threading.Lock()
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return _freeze(value.value)
+    if isinstance(value, dict):
+        return tuple(
+            sorted((_freeze(k), _freeze(v)) for k, v in value.items())
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, "__dict__"):
+        return (type(value).__name__, _freeze(vars(value)))
+    # True == 1 == 1.0 hash alike but build different protos
+    return (type(value).__name__, value)
+
+
+def _copy_proto(message):
+    message_type = type(message)
+    copied = message_type()
+    message_type.pb(copied).CopyFrom(message_type.pb(message))
+    return copied
+
+
+def _fragment(kind: str, content: Any, build):
+    """Build a proto (or list of protos) once per distinct content.
+
+    Every call gets its own copy, so callers can keep mutating what they
+    get back, and equal arguments always produce byte-identical protos.
+    """
+    key = (kind, _freeze(content))
+    with _fragments_lock:
+        fragment = _fragments.get(key)
+    if fragment is None:
+        fragment = build()
+        with _fragments_lock:
+            fragment = _fragments.setdefault(key, fragment)
+    if isinstance(fragment, list):
+        return [_copy_proto(message) for message in fragment]
+    return _copy_proto(fragment)
+
+
+def _build_event_handlers(
     event_handler_messages: EventHandlerMessages,
     end_escalation_page: str,
     page_parameter: bool = False,
@@ -268,6 +490,20 @@ def create_event_handlers(
     return event_handlers
 
 
+def create_event_handlers(
+    event_handler_messages: EventHandlerMessages,
+    end_escalation_page: str,
+    page_parameter: bool = False,
+):
+    return _fragment(
+        "event_handlers",
+        (event_handler_messages, end_escalation_page, page_parameter),
+        lambda: _build_event_handlers(
+            event_handler_messages, end_escalation_page, page_parameter
+        ),
+    )
+
+
 def get_symbolic_page(flow_name: str, mode: SymbolicPages):
     symbolic_dict = {
         SymbolicPages.END_FLOW_WITH_FAILURE: Page(
@@ -435,17 +671,140 @@ class ResponseMessageArgs(TypedDict):
     message: str | List[str] | Dict[str, Any] | Dict[str, str]
 
 
+@functools.lru_cache(maxsize=None)
+def load_webhook_metrics(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring webhook metrics %s: %s", path, e)
+        return {}
+
+
+def webhook_latency_ms(tag: Optional[str]) -> Optional[float]:
+    """Measured latency of a webhook tag, None when it was not measured.
+
+    A combined tag ("authenticate+find_appointments") without its own
+    measurement costs its tags together.
+    """
+    if not tag:
+        return None
+    metrics = load_webhook_metrics(WEBHOOK_METRICS)
+    if tag in metrics:
+        return metrics[tag].get(PARTIAL_RESPONSE_PERCENTILE)
+    latencies = [
+        (metrics.get(part) or {}).get(PARTIAL_RESPONSE_PERCENTILE)
+        for part in tag.split("+")
+    ]
+    measured = [latency for latency in latencies if latency is not None]
+    if len(latencies) == 1 or len(measured) < len(latencies):
+        return None
+    return sum(measured)
+
+
+def interim_prompt(tag: Optional[str]) -> Optional[str]:
+    """What to say while the webhook of `tag` runs, None when it is fast."""
+    latency = webhook_latency_ms(tag)
+    if latency is None or latency < PARTIAL_RESPONSE_THRESHOLD_MS:
+        return None
+    first = (tag or "").split("+")[0]
+    return commons.INTERIM_PROMPTS.get(first, commons.INTERIM_PROMPT_DEFAULT)
+
+
+# webhook tags whose calls are memoized in session parameters, see
+# library.DialogflowLibrary.memoize_webhook
+MEMOIZED_WEBHOOK_TAGS = ["find_appointments"]
+
+
+def memo_key_parameter(tag: str) -> str:
+    return f"{tag}_memo_key"
+
+
+def memo_last_parameter(tag: str) -> str:
+    return f"{tag}_memo_last"
+
+
+def forget_memoized_webhooks() -> Dict[str, None]:
+    """Presets making every memoized webhook call again on next use.
+
+    For fulfillments after which the backend may change, eg a caller
+    handed over to cancel or reschedule an appointment.
+    """
+    return {memo_last_parameter(tag): None for tag in MEMOIZED_WEBHOOK_TAGS}
+
+
 def create_fulfillment_builder(
     webhook: str = None,
     tag: str = None,
     parameter_presets: Dict[str, str] = None,
     response_message: ResponseMessageArgs = None,
+    return_partial_responses: Optional[bool] = None,
+    interim_message: Optional[str] = None,
 ) -> FulfillmentBuilder:
+    """Fulfillment calling `webhook` with `tag`.
+
+    With `return_partial_responses` None, a fulfillment with a webhook and
+    no response message of its own returns partial responses when the tag
+    is slower than PARTIAL_RESPONSE_THRESHOLD_MS: the interim message is
+    played right away instead of after the webhook answers. Fulfillments
+    with their own messages are left alone, those may depend on what the
+    webhook returns; pass True to stream them anyway.
+    """
+    tag = tag.value if isinstance(tag, Enum) else tag
+    if return_partial_responses is None:
+        prompt = None
+        if webhook and not response_message:
+            prompt = interim_prompt(tag)
+        elif webhook and interim_prompt(tag):
+            logger.info("Not streaming %s, its fulfillment has messages", tag)
+        return_partial_responses = prompt is not None
+        interim_message = interim_message or prompt
+    elif return_partial_responses and not interim_message:
+        interim_message = commons.INTERIM_PROMPTS.get(
+            tag, commons.INTERIM_PROMPT_DEFAULT
+        )
+    if not return_partial_responses:
+        interim_message = None
+    content = (
+        webhook,
+        tag,
+        parameter_presets,
+        response_message,
+        return_partial_responses,
+        interim_message,
+    )
+    fulfillment_builder = FulfillmentBuilder()
+    # load_proto_obj, the constructor skips empty (falsy) protos
+    fulfillment_builder.load_proto_obj(
+        _fragment("fulfillment", content, lambda: _build_fulfillment(*content))
+    )
+    return fulfillment_builder
+
+
+def _build_fulfillment(
+    webhook,
+    tag,
+    parameter_presets,
+    response_message,
+    return_partial_responses=False,
+    interim_message=None,
+):
     fulfillment_builder = FulfillmentBuilder()
     fulfillment_builder.create_new_proto_obj(
         webhook=webhook,
         tag=tag,
+        return_partial_responses=return_partial_responses,
     )
+    if interim_message:
+        # partial responses send the messages queued before the webhook
+        # call while it runs
+        fulfillment_builder.add_response_message(
+            ResponseMessageBuilder().create_new_proto_obj(
+                response_type="text", message=interim_message
+            )
+        )
     if parameter_presets:
         fulfillment_builder.add_parameter_presets(parameter_presets)
 
@@ -456,7 +815,7 @@ def create_fulfillment_builder(
         )
         fulfillment_builder.add_response_message(response_message_obj)
 
-    return fulfillment_builder
+    return fulfillment_builder.proto_obj
 
 
 def create_webhook(config: Config, webhook_obj: Webhook):
@@ -474,6 +833,12 @@ def create_webhook(config: Config, webhook_obj: Webhook):
 
 
 def create_intents(config, intent_items: dict[str, list[str]]):
+    # phrase_conflicts imports this module
+    from tools import phrase_conflicts
+
+    phrase_conflicts.log_conflicts(
+        phrase_conflicts.check_intents(intent_items)
+    )
     agent_id = get_agent_id(config)
     intents = Intents()
     for display_name, intent_list in intent_items.items():
@@ -499,6 +864,14 @@ def create_event_handler(
     message: str = None,
     target_page: str = None,
 ):
+    return _fragment(
+        "event_handler",
+        (event, message, target_page),
+        lambda: _build_event_handler(event, message, target_page),
+    )
+
+
+def _build_event_handler(event, message, target_page):
     fulfilment_builder = FulfillmentBuilder()
     fulfilment_builder.create_new_proto_obj(overwrite=True)
     if message:
@@ -567,6 +940,9 @@ def create_flow_by_name(config, flow_name, nlu_threshold=0.3):
         display_name=flow_name,
     )
     set_flow_nlu_settings(flow_obj_proto, threshold=nlu_threshold)
+    profile = speech_profile(flow_name)
+    if profile is not None:
+        flow_obj_proto.advanced_settings = create_advanced_settings(profile)
     flow_obj = Flows().create_flow(agent_id=agent_id, obj=flow_obj_proto)
     flows_instance = Flows()
     flows_map = flows_instance.get_flows_map(agent_id=agent_id, reverse=True)
@@ -577,11 +953,15 @@ def create_flow_by_name(config, flow_name, nlu_threshold=0.3):
 def create_pages(
     pages_to_create, flow_obj, pages_instance, flows_map, flow_name
 ):
-
     builder_map = {}
     for page in pages_to_create:
         page_builder = PageBuilder()
         page_builder.create_new_proto_obj(display_name=page, overwrite=True)
+        profile = speech_profile(flow_name, page)
+        if profile is not None:
+            page_builder.proto_obj.advanced_settings = (
+                create_advanced_settings(profile)
+            )
         builder_map[page] = page_builder
     for page_display_name, builder in builder_map.items():
         pages_instance.create_page(
@@ -625,7 +1005,7 @@ def create_webhook_if_not_exists(config, wb_name, uri):
         webhook_obj.display_name = wb_name
         webhook_obj.generic_web_service.uri = uri
         timeout_duration = duration_pb2.Duration()
-        timeout_duration.seconds = 10  # Set the timeout to 10 seconds
+        timeout_duration.seconds = WEBHOOK_TIMEOUT_SECONDS
         webhook_obj.timeout = timeout_duration
         webhooks_instance.create_webhook(agent_id=agent_id, obj=webhook_obj)
     except Exception as e:
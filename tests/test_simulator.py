@@ -0,0 +1,174 @@
+import utils
+from tools.agent_graph import AgentGraph
+from tools.simulator import Simulator
+
+START_FLOW = utils.DEFAULT_START_FLOW
+
+
+def make_graph(*flows, intents=None):
+    return AgentGraph.from_dict(
+        {"flows": list(flows), "intents": intents, "start_flow": START_FLOW}
+    )
+
+
+def test_form_parameters_are_page_parameters():
+    graph = make_graph(
+        {
+            "name": START_FLOW,
+            "routes": [{"condition": "true", "target_page": "Ask"}],
+            "pages": [
+                {
+                    "name": "Ask",
+                    "form": [
+                        {"name": "date", "entity_type": "sys.date"},
+                        {
+                            "name": "note",
+                            "entity_type": "sys.any",
+                            "required": False,
+                        },
+                    ],
+                    "routes": [
+                        {
+                            "condition": '$page.params.note = "urgent"',
+                            "target_page": "Urgent",
+                        },
+                        {
+                            "condition": '$page.params.status = "FINAL"',
+                            "target_page": "Done",
+                        },
+                    ],
+                },
+                {"name": "Urgent"},
+                {"name": "Done"},
+            ],
+        }
+    )
+    simulator = Simulator(graph)
+
+    # a value for a form parameter that is not being collected
+    session = simulator.start()
+    simulator.send(session, "hi")
+    assert session.awaiting_parameter == "date"
+    turn = simulator.send(session, {"parameters": {"note": "urgent"}})
+    assert turn.events == []
+    assert session.current == (START_FLOW, "Urgent")
+    assert session.params["note"] == "urgent"
+
+    session = simulator.start()
+    simulator.send(session, "hi")
+    simulator.send(session, {"parameters": {"date": "2027-03-15"}})
+    assert session.current == (START_FLOW, "Done")
+    assert session.params["date"] == "2027-03-15"
+
+
+def test_sub_flow_returns_to_the_calling_page():
+    graph = make_graph(
+        {
+            "name": START_FLOW,
+            "routes": [
+                {"condition": "true", "target_flow": "Scheduling"},
+                {
+                    "condition": "$session.params.scheduled = true",
+                    "target_page": "Goodbye",
+                },
+            ],
+            "pages": [
+                {
+                    "name": "Goodbye",
+                    "routes": [
+                        {"condition": "true", "target_page": "END_SESSION"}
+                    ],
+                }
+            ],
+        },
+        {
+            "name": "Scheduling",
+            "routes": [{"condition": "true", "target_page": "Book"}],
+            "pages": [
+                {
+                    "name": "Book",
+                    "routes": [
+                        {
+                            "intent": "confirm",
+                            "target_page": "END_FLOW",
+                            "trigger_fulfillment": {
+                                "set_parameters": {"scheduled": True}
+                            },
+                        }
+                    ],
+                }
+            ],
+        },
+        intents={"confirm": ["yes"]},
+    )
+    conversation = Simulator(graph).run(["hi", "yes"])
+    assert conversation.end_state == "END_SESSION"
+    assert conversation.pages == [
+        (START_FLOW, "START"),
+        ("Scheduling", "START"),
+        ("Scheduling", "Book"),
+        (START_FLOW, "Goodbye"),
+    ]
+
+
+def test_keyed_date_moves_on_in_the_same_turn():
+    # the "> Ask If Patient Knows Date" form, see create_keypad_date_route
+    entity_types = "projects/-/locations/-/agents/-/entityTypes"
+    graph = make_graph(
+        {
+            "name": START_FLOW,
+            "routes": [{"condition": "true", "target_page": "Ask Date"}],
+            "pages": [
+                {
+                    "name": "Ask Date",
+                    "form": [
+                        {
+                            "name": "appointment_date_obj",
+                            "entity_type": f"{entity_types}/sys.date",
+                        },
+                        {
+                            "name": "appointment_date_obj_keyed",
+                            "entity_type": (
+                                f"{entity_types}/sys.number-sequence"
+                            ),
+                            "required": False,
+                        },
+                    ],
+                    "routes": [
+                        {
+                            "condition": utils.keypad_date_condition(
+                                "appointment_date_obj"
+                            ),
+                            "target_page": "Find Appointment",
+                            "trigger_fulfillment": {
+                                "set_parameters": {
+                                    "appointment_date": (
+                                        utils.keypad_date_value(
+                                            "appointment_date_obj",
+                                            "T00:00:00",
+                                        )
+                                    )
+                                }
+                            },
+                        }
+                    ],
+                },
+                {"name": "Find Appointment"},
+            ],
+        }
+    )
+    simulator = Simulator(graph)
+    session = simulator.start()
+    simulator.send(session, "hi")
+    assert session.awaiting_parameter == "appointment_date_obj"
+
+    # too few digits for MMDDYYYY, the date is still asked for
+    keyed = {"appointment_date_obj_keyed": "0315"}
+    simulator.send(session, {"parameters": keyed})
+    assert session.current == (START_FLOW, "Ask Date")
+
+    keyed = {"appointment_date_obj_keyed": "03152027"}
+    turn = simulator.send(session, {"parameters": keyed})
+    assert turn.events == []
+    assert session.current == (START_FLOW, "Find Appointment")
+    assert session.params["appointment_date"] == "2027-03-15T00:00:00"